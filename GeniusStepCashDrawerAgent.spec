@@ -17,9 +17,19 @@ a = Analysis(
         'websockets',
         'pydantic',
         'win32print', 'win32api', 'win32con',
+        'numpy', 'PIL', 'brotli',
         'h11', 'click', 'anyio',
         'logger', 'config', 'state', 'dashboard',
-        'web_ui', 'ws_client', 'printer_raw',
+        'web_ui', 'ws_client', 'printer_raw', 'spooler',
+        'transports',
+        'raster',
+        'idempotency',
+        'spool_store',
+        'breaker',
+        'routing',
+        'throughput',
+        'history_store',
+        'log_search',
     ],
     hookspath=[],
     hooksconfig={},
@@ -5,8 +5,10 @@ import signal
 import sys
 import webbrowser
 import uvicorn
-from logger import setup_logging, get_logger
-from config import APP_VERSION, load_config
+from logger import setup_logging, get_logger, set_level, set_json_output, shutdown_logging
+from config import (
+    APP_VERSION, AgentConfig, load_config, start_config_watcher, subscribe as subscribe_config,
+)
 
 # Initialize logging first
 setup_logging()
@@ -15,6 +17,14 @@ log = get_logger("app")
 # Import after logging setup
 from ws_client import start_ws_in_background
 from web_ui import app
+from printer_raw import prepare_drawer
+from spool_store import durable_spool
+from history_store import history_store
+from state import app_state
+from spooler import print_spooler, SpoolerFullError
+from breaker import printer_breakers
+from transports import transport_pool
+from routing import configured_printers
 
 HOST = "127.0.0.1"
 PORT = 16732
@@ -63,6 +73,41 @@ def open_browser():
         log.info("Could not open browser. Navigate to %s manually.", URL)
 
 
+def prepare_printer(cfg: AgentConfig):
+    """
+    فتح قناة الدرج مسبقاً على عامل الطابعة. تحسين فقط: قائمة ممتلئة لا تُفشل
+    حفظ الإعدادات (تم الحفظ بالفعل)، والمهمة التالية تفتح القناة بنفسها.
+    """
+    if not cfg.printer_name:
+        return
+    try:
+        print_spooler.submit(
+            cfg.printer_name, "PREPARE_DRAWER", prepare_drawer,
+            cfg.printer_name, cfg.drawer_pin, cfg.pulse_on, cfg.pulse_off,
+        )
+    except SpoolerFullError as e:
+        log.warning("Drawer channel not prepared for '%s': %s", cfg.printer_name, e)
+
+
+def on_config_change(new: AgentConfig, old: AgentConfig):
+    """
+    تطبيق الإعدادات الجديدة (من REST أو WebSocket أو تعديل config.json يدوياً)
+    على السجل وحدود المعدل والطابعات، بدل أن يعيد كل مكوّن قراءتها.
+    """
+    if new.log_level != old.log_level:
+        set_level("", new.log_level)
+    if new.log_json != old.log_json:
+        set_json_output(new.log_json)
+    app_state.configure_limits(new)
+    # Stop monitoring printers that were removed or replaced, and close their connections
+    for removed in configured_printers(old) - configured_printers(new):
+        printer_breakers.forget(removed)
+        transport_pool.discard(removed)
+    drawer = ("printer_name", "drawer_pin", "pulse_on", "pulse_off")
+    if any(getattr(new, name) != getattr(old, name) for name in drawer):
+        prepare_printer(new)
+
+
 def signal_handler(sig, frame):
     """معالجة إشارة الإيقاف."""
     log.info("Shutdown signal received")
@@ -80,8 +125,22 @@ if __name__ == "__main__":
 
         # Load config early to validate
         cfg = load_config()
+        set_level("", cfg.log_level)
+        set_json_output(cfg.log_json)
+        app_state.configure_limits(cfg)
+        subscribe_config(on_config_change)
+        start_config_watcher()
         log.info("Device: %s | Printer: %s", cfg.device_id, cfg.printer_name or "(not set)")
 
+        # Restore the audit trail and counters before anything is logged to history
+        app_state.attach_history(history_store)
+
+        # Resume jobs left on disk by a printer outage or a previous run
+        durable_spool.start()
+
+        # Pre-open the drawer channel on the printer's worker thread
+        prepare_printer(cfg)
+
         # Start API server thread
         t_api = threading.Thread(target=run_api, name="api-server", daemon=True)
         t_api.start()
@@ -109,5 +168,7 @@ if __name__ == "__main__":
         log.error("Fatal error: %s", e, exc_info=True)
         input("\nPress Enter to exit...")
     finally:
+        history_store.close()
         log.info("GeniusStep CashDrawer Agent stopped.")
+        shutdown_logging()
         sys.exit(0)
@@ -0,0 +1,86 @@
+# bench_history.py
+"""
+قياس تكلفة سجل العمليات في الذاكرة لكل استدعاء: add_history و get_history(200)،
+مقارنةً بالتطبيق السابق (deque من dataclass مع strftime مرتين لكل إدخال).
+سطر AppState يشمل أيضاً القفل والعدادات وإبلاغ المشتركين.
+
+    python bench_history.py [عدد التكرارات]
+"""
+import sys
+import time
+import timeit
+from collections import deque
+from dataclasses import dataclass
+from state import AppState, HistoryRing, history_dict
+
+
+@dataclass
+class _LegacyEntry:
+    timestamp: float
+    action: str
+    source: str
+    status: str
+    detail: str = ""
+
+    def to_dict(self) -> dict:
+        return {
+            "timestamp": self.timestamp,
+            "time_str": time.strftime("%H:%M:%S", time.localtime(self.timestamp)),
+            "date_str": time.strftime("%Y-%m-%d", time.localtime(self.timestamp)),
+            "action": self.action,
+            "source": self.source,
+            "status": self.status,
+            "detail": self.detail,
+        }
+
+
+class _LegacyHistory:
+    """السجل كما كان: كائن لكل عملية، ونسخ الـ deque كاملاً عند كل قراءة."""
+
+    def __init__(self):
+        self._history: deque[_LegacyEntry] = deque(maxlen=200)
+
+    def add_history(self, action: str, source: str, status: str, detail: str = ""):
+        self._history.appendleft(_LegacyEntry(time.time(), action, source, status, detail))
+
+    def get_history(self, limit: int = 50) -> list[dict]:
+        return [e.to_dict() for e in list(self._history)[:limit]]
+
+
+class _Ring:
+    """HistoryRing وحدها، لمقارنة البنية نفسها بدون بقية AppState."""
+
+    def __init__(self):
+        self._history = HistoryRing(200)
+        self._seq = 0
+
+    def add_history(self, action: str, source: str, status: str, detail: str = ""):
+        self._seq += 1
+        self._history.append(self._seq, time.time(), action, source, status, detail)
+
+    def get_history(self, limit: int = 50) -> list[dict]:
+        return [history_dict(row) for row in self._history.newest(limit)]
+
+
+def _per_call_us(func, number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main(number: int = 20000):
+    print(f"{'':<22}{'add_history':>14}{'get_history(200)':>20}")
+    for name, history in (
+        ("legacy deque", _LegacyHistory()),
+        ("HistoryRing", _Ring()),
+        ("AppState", AppState()),
+    ):
+        for i in range(200):
+            history.add_history("OPEN_DRAWER", "websocket", "ok", f"Order {i}")
+        add_us = _per_call_us(
+            lambda: history.add_history("PRINT_RECEIPT", "rest_api", "ok", "Order 42"), number,
+        )
+        get_us = _per_call_us(lambda: history.get_history(200), max(1, number // 100))
+        print(f"{name:<22}{add_us:>11.2f} us{get_us:>17.1f} us")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
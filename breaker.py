@@ -0,0 +1,252 @@
+# breaker.py
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+from logger import get_logger
+
+log = get_logger("breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# عدد الإخفاقات المتتالية في الإرسال قبل فتح الدائرة
+FAILURE_THRESHOLD = 3
+
+# بعد هذه المدة تُسمح محاولة واحدة لطابعة لا تدعم فحص الحالة
+OPEN_TIMEOUT = 15.0
+
+# فترات فحص الحالة في الخلفية (ثوانٍ)
+PROBE_INTERVAL = 10.0
+PROBE_INTERVAL_OPEN = 2.0
+
+
+class PrinterUnavailableError(RuntimeError):
+    """الطابعة معروفة بأنها غير متاحة (الدائرة مفتوحة): فشل فوري بدون انتظار."""
+
+
+@dataclass
+class PrinterStatus:
+    """نتيجة فحص حالة الطابعة (DLE EOT أو حالة Windows spooler)."""
+    online: bool
+    reason: str = ""
+    flags: dict = field(default_factory=dict)
+
+
+class CircuitBreaker:
+    """قاطع دائرة لطابعة واحدة تغذيه نتائج الإرسال وفحص الحالة الدوري."""
+
+    def __init__(self, printer_name: str):
+        self.printer_name = printer_name
+        self.state = CLOSED
+        self.reason = ""
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.last_status: PrinterStatus | None = None
+        self.last_probe_at = 0.0
+        self.next_probe_at = 0.0
+        self.last_success_at = 0.0
+
+    def check(self) -> None:
+        """يرفع PrinterUnavailableError فوراً إذا كانت الدائرة مفتوحة."""
+        if self.state == CLOSED:
+            return
+        if (self.state == OPEN and not self.trial_running
+                and time.monotonic() - self.opened_at >= OPEN_TIMEOUT):
+            # Let one request through to find out whether the printer is back
+            self.state = HALF_OPEN
+            self.trial_running = True
+            return
+        raise PrinterUnavailableError(
+            f"Printer '{self.printer_name}' unavailable: {self.reason}"
+        )
+
+    def to_dict(self) -> dict:
+        now = time.monotonic()
+        return {
+            "state": self.state,
+            "reason": self.reason,
+            "failures": self.failures,
+            "trips": self.trips,
+            "status": None if self.last_status is None else {
+                "online": self.last_status.online, **self.last_status.flags,
+            },
+            "probed_ago_s": round(now - self.last_probe_at, 1) if self.last_probe_at else None,
+        }
+
+
+class BreakerRegistry:
+    """
+    قواطع الدوائر لكل الطابعات مع خيط فحص حالة في الخلفية.
+    النتائج مخزنة، فالطلب إلى طابعة معطلة يفشل فوراً بالسبب الدقيق
+    (نفد الورق، الغطاء مفتوح، غير متصلة) بدل الانتظار داخل OpenPrinter/WritePrinter.
+    """
+
+    def __init__(self):
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._listeners: list[Callable[[str, str], None]] = []
+        self._probe: Callable[[str], PrinterStatus | None] | None = None
+        self._monitor: threading.Thread | None = None
+        # Grows on every recorded result (for ETags)
+        self.version: int = 0
+
+    def start(self, probe: Callable[[str], PrinterStatus | None]):
+        """تشغيل خيط الفحص. probe(printer_name) يرجع الحالة، أو None إذا لم تُعرف."""
+        with self._lock:
+            if self._monitor is not None:
+                return
+            self._probe = probe
+            self._monitor = threading.Thread(
+                target=self._monitor_loop, name="printer-monitor", daemon=True,
+            )
+            self._monitor.start()
+
+    def subscribe(self, listener: Callable[[str, str], None]):
+        """تسجيل دالة تُستدعى بـ (printer_name, state) عند كل تغيّر في الحالة."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def _get(self, printer_name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(printer_name)
+        if breaker is None:
+            breaker = CircuitBreaker(printer_name)
+            self._breakers[printer_name] = breaker
+            self._wake.notify()
+        return breaker
+
+    def watch(self, printer_name: str) -> None:
+        """بدء مراقبة حالة طابعة قبل أول مهمة لها."""
+        with self._lock:
+            self._get(printer_name)
+
+    def check(self, printer_name: str) -> None:
+        with self._lock:
+            self._get(printer_name).check()
+
+    def record_success(self, printer_name: str):
+        with self._lock:
+            breaker = self._get(printer_name)
+            breaker.failures = 0
+            breaker.trial_running = False
+            breaker.last_success_at = time.monotonic()
+            self.version += 1
+            changed = self._transition(breaker, CLOSED, "")
+        self._notify(printer_name, changed)
+
+    def end_trial(self, printer_name: str):
+        """
+        المهمة انتهت بدون نتيجة عن الطابعة (فشل تجهيزها مثلاً): إذا كانت هي المحاولة
+        التجريبية تعود الدائرة مفتوحة وتُسمح محاولة أخرى، بدل البقاء في HALF_OPEN.
+        """
+        with self._lock:
+            breaker = self._breakers.get(printer_name)
+            if breaker is None or not breaker.trial_running:
+                return
+            breaker.trial_running = False
+            if breaker.state == HALF_OPEN:
+                breaker.state = OPEN
+
+    def record_failure(self, printer_name: str, reason: str):
+        with self._lock:
+            breaker = self._get(printer_name)
+            breaker.failures += 1
+            breaker.trial_running = False
+            self.version += 1
+            changed = None
+            if breaker.state == HALF_OPEN or breaker.failures >= FAILURE_THRESHOLD:
+                changed = self._transition(breaker, OPEN, reason)
+            # Confirm with a status probe right away
+            breaker.next_probe_at = 0.0
+            self._wake.notify()
+        self._notify(printer_name, changed)
+
+    def record_probe(self, printer_name: str, status: PrinterStatus):
+        with self._lock:
+            breaker = self._get(printer_name)
+            breaker.last_status = status
+            breaker.last_probe_at = time.monotonic()
+            self.version += 1
+            if status.online:
+                breaker.failures = 0
+                changed = self._transition(breaker, CLOSED, "")
+            else:
+                changed = self._transition(breaker, OPEN, status.reason)
+        self._notify(printer_name, changed)
+
+    def _transition(self, breaker: CircuitBreaker, state: str, reason: str) -> str | None:
+        """تغيير الحالة (يُستدعى مع _lock). يرجع الحالة الجديدة إذا تغيرت."""
+        if state == OPEN:
+            breaker.reason = reason
+            breaker.opened_at = time.monotonic()
+        if breaker.state == state:
+            return None
+        breaker.state = state
+        if state == OPEN:
+            breaker.trips += 1
+            log.warning("Circuit opened for printer '%s': %s", breaker.printer_name, reason)
+        else:
+            breaker.reason = ""
+            breaker.trial_running = False
+            log.info("Circuit closed for printer '%s'", breaker.printer_name)
+        return state
+
+    def _notify(self, printer_name: str, state: str | None):
+        if state is None:
+            return
+        for listener in list(self._listeners):
+            try:
+                listener(printer_name, state)
+            except Exception as e:
+                log.error("Breaker listener failed: %s", e)
+
+    def _monitor_loop(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                due = [b.printer_name for b in self._breakers.values() if b.next_probe_at <= now]
+                if not due:
+                    next_at = min((b.next_probe_at for b in self._breakers.values()), default=None)
+                    self._wake.wait(None if next_at is None else next_at - now)
+                    continue
+            for printer_name in due:
+                self._probe_one(printer_name)
+
+    def _probe_one(self, printer_name: str):
+        with self._lock:
+            breaker = self._breakers.get(printer_name)
+            # Jobs are flowing: their results are fresher than a probe
+            busy = (breaker is not None and breaker.state == CLOSED
+                    and time.monotonic() - breaker.last_success_at < PROBE_INTERVAL)
+        if not busy:
+            try:
+                status = self._probe(printer_name)
+            except Exception as e:
+                # Could not even reach the printer
+                status = PrinterStatus(online=False, reason=f"unreachable ({e})")
+            if status is not None:
+                self.record_probe(printer_name, status)
+        with self._lock:
+            breaker = self._breakers.get(printer_name)
+            if breaker is None:
+                return
+            interval = PROBE_INTERVAL if breaker.state == CLOSED else PROBE_INTERVAL_OPEN
+            breaker.next_probe_at = time.monotonic() + interval
+
+    def forget(self, printer_name: str):
+        """حذف حالة طابعة (مثلاً بعد تغيير الإعدادات)."""
+        with self._lock:
+            self._breakers.pop(printer_name, None)
+            self.version += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {name: b.to_dict() for name, b in self._breakers.items()}
+
+
+# ── Singleton ──
+printer_breakers = BreakerRegistry()
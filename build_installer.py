@@ -27,6 +27,9 @@ hidden_imports = [
     'win32print',
     'win32api',
     'win32con',
+    'numpy',
+    'PIL',
+    'brotli',
     'uvicorn.lifespan.on',
     'uvicorn.lifespan.off',
     'uvicorn.protocols.websockets.auto',
@@ -49,6 +52,16 @@ hidden_imports = [
     'web_ui',
     'ws_client',
     'printer_raw',
+    'spooler',
+    'transports',
+    'raster',
+    'idempotency',
+    'spool_store',
+    'breaker',
+    'routing',
+    'throughput',
+    'history_store',
+    'log_search',
 ]
 
 for imp in hidden_imports:
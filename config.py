@@ -1,9 +1,12 @@
 # config.py
 import json
+import os
 import threading
+import time
 from pathlib import Path
-from pydantic import BaseModel, field_validator
-from logger import get_logger
+from typing import Callable
+from pydantic import BaseModel, ConfigDict, field_validator, model_validator
+from logger import get_logger, LOG_LEVELS
 
 log = get_logger("config")
 
@@ -11,6 +14,9 @@ APP_VERSION = "2.1.0"
 APP_DIR = Path(r"C:\ProgramData\GeniusStep\CashDrawerAgent")
 CFG_PATH = APP_DIR / "config.json"
 
+# فترة فحص تعديل config.json يدوياً (ثوانٍ)
+CONFIG_POLL_INTERVAL = 2.0
+
 try:
     APP_DIR.mkdir(parents=True, exist_ok=True)
 except OSError:
@@ -18,6 +24,9 @@ except OSError:
 
 
 class AgentConfig(BaseModel):
+    # Immutable snapshot: changes go through save_config / update_config
+    model_config = ConfigDict(frozen=True)
+
     device_id: str = "POS-001"
     device_token: str = "CHANGE_ME"
     wss_url: str = "wss://app.propanel.ma/hardware/ws"
@@ -25,6 +34,29 @@ class AgentConfig(BaseModel):
     drawer_pin: int = 0
     pulse_on: int = 60
     pulse_off: int = 120
+    logo_path: str = ""
+    ws_max_inflight: int = 8
+    # طابعات إضافية حسب الدور: {"kitchen": "tcp://192.168.1.60", "bar": "EPSON TM-T20"}
+    printers: dict[str, str] = {}
+    # توجيه الأصناف حسب فئة المنتج إلى طابعة: {"Drinks": "bar", "Food": "kitchen"}
+    category_routes: dict[str, str] = {}
+    # حدود المعدل لكل (مصدر، عميل): معدل في الدقيقة + سعة دفعة
+    drawer_rate_per_minute: int = 10
+    drawer_burst: int = 10
+    receipt_rate_per_minute: int = 30
+    receipt_burst: int = 30
+    # مدة الاحتفاظ بسجل العمليات على القرص (أيام)
+    history_retention_days: int = 365
+    # مستوى السجل عند التشغيل، و JSON lines بدل السطور النصية
+    log_level: str = "INFO"
+    log_json: bool = False
+
+    @model_validator(mode="after")
+    def routes_must_target_printers(self):
+        unknown = set(self.category_routes.values()) - set(self.printers) - {"receipt"}
+        if unknown:
+            raise ValueError(f"category_routes target unknown printers: {sorted(unknown)}")
+        return self
 
     @field_validator("drawer_pin")
     @classmethod
@@ -33,6 +65,36 @@ class AgentConfig(BaseModel):
             raise ValueError("drawer_pin must be 0 or 1")
         return v
 
+    @field_validator("ws_max_inflight")
+    @classmethod
+    def inflight_must_be_positive(cls, v: int) -> int:
+        if v < 1 or v > 256:
+            raise ValueError("ws_max_inflight must be between 1 and 256")
+        return v
+
+    @field_validator("drawer_rate_per_minute", "drawer_burst",
+                     "receipt_rate_per_minute", "receipt_burst")
+    @classmethod
+    def rate_must_be_positive(cls, v: int) -> int:
+        if v < 1 or v > 10000:
+            raise ValueError("rate limits must be between 1 and 10000")
+        return v
+
+    @field_validator("history_retention_days")
+    @classmethod
+    def retention_must_be_valid(cls, v: int) -> int:
+        if v < 1 or v > 3650:
+            raise ValueError("history_retention_days must be between 1 and 3650")
+        return v
+
+    @field_validator("log_level")
+    @classmethod
+    def log_level_must_be_valid(cls, v: str) -> str:
+        v = v.upper()
+        if v not in LOG_LEVELS:
+            raise ValueError(f"log_level must be one of {', '.join(LOG_LEVELS)}")
+        return v
+
     @field_validator("pulse_on", "pulse_off")
     @classmethod
     def pulse_must_be_positive(cls, v: int) -> int:
@@ -50,6 +112,17 @@ class ConfigUpdatePayload(BaseModel):
     drawer_pin: int | None = None
     pulse_on: int | None = None
     pulse_off: int | None = None
+    logo_path: str | None = None
+    ws_max_inflight: int | None = None
+    printers: dict[str, str] | None = None
+    category_routes: dict[str, str] | None = None
+    drawer_rate_per_minute: int | None = None
+    drawer_burst: int | None = None
+    receipt_rate_per_minute: int | None = None
+    receipt_burst: int | None = None
+    history_retention_days: int | None = None
+    log_level: str | None = None
+    log_json: bool | None = None
 
     @field_validator("drawer_pin")
     @classmethod
@@ -58,6 +131,37 @@ class ConfigUpdatePayload(BaseModel):
             raise ValueError("drawer_pin must be 0 or 1")
         return v
 
+    @field_validator("ws_max_inflight")
+    @classmethod
+    def inflight_must_be_positive(cls, v):
+        if v is not None and (v < 1 or v > 256):
+            raise ValueError("ws_max_inflight must be between 1 and 256")
+        return v
+
+    @field_validator("drawer_rate_per_minute", "drawer_burst",
+                     "receipt_rate_per_minute", "receipt_burst")
+    @classmethod
+    def rate_must_be_positive(cls, v):
+        if v is not None and (v < 1 or v > 10000):
+            raise ValueError("rate limits must be between 1 and 10000")
+        return v
+
+    @field_validator("history_retention_days")
+    @classmethod
+    def retention_must_be_valid(cls, v):
+        if v is not None and (v < 1 or v > 3650):
+            raise ValueError("history_retention_days must be between 1 and 3650")
+        return v
+
+    @field_validator("log_level")
+    @classmethod
+    def log_level_must_be_valid(cls, v):
+        if v is not None:
+            v = v.upper()
+            if v not in LOG_LEVELS:
+                raise ValueError(f"log_level must be one of {', '.join(LOG_LEVELS)}")
+        return v
+
     @field_validator("pulse_on", "pulse_off")
     @classmethod
     def pulse_must_be_positive(cls, v):
@@ -66,47 +170,160 @@ class ConfigUpdatePayload(BaseModel):
         return v
 
 
-# ── Config cache with thread safety ──
-_config_cache: AgentConfig | None = None
-_config_lock = threading.Lock()
+# ── Config snapshot ──
+# الإعدادات نسخة ثابتة (frozen) مع رقم نسخة: القراءة بدون قفل ولا قرص، وكل تغيير
+# (REST، WebSocket، أو تعديل config.json يدوياً) ينشر نسخة جديدة ويبلغ المشتركين.
+_snapshot: tuple[int, AgentConfig] | None = None
+# Reentrant: listeners run under it (in order) and may call load_config/save_config
+_config_lock = threading.RLock()
+_listeners: list[Callable[[AgentConfig, AgentConfig], None]] = []
+# (mtime_ns, size) of config.json when last read or written, for the watcher
+_file_stamp: tuple[int, int] | None = None
+_watcher_started = False
 
 
-def load_config(force_reload: bool = False) -> AgentConfig:
-    """تحميل الإعدادات مع تخزين مؤقت (thread-safe)."""
-    global _config_cache
-    with _config_lock:
-        if _config_cache is not None and not force_reload:
-            return _config_cache
+def _stamp() -> tuple[int, int] | None:
+    try:
+        st = CFG_PATH.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _write_atomic(cfg: AgentConfig) -> None:
+    """كتابة ملف مؤقت ثم استبدال config.json به، فلا يبقى ملف نصف مكتوب بعد انقطاع مفاجئ."""
+    tmp = CFG_PATH.with_name(CFG_PATH.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(cfg.model_dump_json(indent=2))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, CFG_PATH)
+
+
+def _publish(cfg: AgentConfig) -> None:
+    """نشر نسخة جديدة وإبلاغ المشتركين إذا تغيرت (يُستدعى مع _config_lock)."""
+    global _snapshot
+    old = _snapshot[1] if _snapshot is not None else None
+    if old is not None and old == cfg:
+        return
+    _snapshot = ((_snapshot[0] if _snapshot is not None else 0) + 1, cfg)
+    if old is None:
+        return
+    for listener in list(_listeners):
         try:
-            if CFG_PATH.exists():
-                data = json.loads(CFG_PATH.read_text(encoding="utf-8"))
-                _config_cache = AgentConfig(**data)
-                log.info("Config loaded from %s", CFG_PATH)
-            else:
-                _config_cache = AgentConfig()
-                save_config(_config_cache)
-                log.info("Default config created at %s", CFG_PATH)
+            listener(cfg, old)
         except Exception as e:
-            log.error("Failed to load config: %s", e)
-            _config_cache = AgentConfig()
-        return _config_cache
+            log.error("Config listener failed: %s", e)
+
+
+def _reload() -> AgentConfig:
+    """قراءة config.json ونشره (يُستدعى مع _config_lock). ملف تالف لا يستبدل آخر نسخة سليمة."""
+    global _file_stamp
+    stamp = _stamp()
+    try:
+        if stamp is not None:
+            cfg = AgentConfig(**json.loads(CFG_PATH.read_text(encoding="utf-8")))
+            log.info("Config loaded from %s", CFG_PATH)
+        else:
+            cfg = AgentConfig()
+            _write_atomic(cfg)
+            stamp = _stamp()
+            log.info("Default config created at %s", CFG_PATH)
+    except Exception as e:
+        log.error("Failed to load config: %s", e)
+        if _snapshot is not None:
+            _file_stamp = stamp
+            return _snapshot[1]
+        cfg = AgentConfig()
+    _file_stamp = stamp
+    _publish(cfg)
+    return cfg
+
+
+def load_config(force_reload: bool = False) -> AgentConfig:
+    """الإعدادات الحالية: بدون قفل ولا قراءة من القرص بعد أول تحميل."""
+    snapshot = _snapshot
+    if snapshot is not None and not force_reload:
+        return snapshot[1]
+    with _config_lock:
+        if _snapshot is not None and not force_reload:
+            return _snapshot[1]
+        return _reload()
 
 
 def save_config(cfg: AgentConfig) -> None:
-    """حفظ الإعدادات وتحديث الذاكرة المؤقتة."""
-    global _config_cache
+    """حفظ الإعدادات (كتابة ذرية) ونشرها كنسخة جديدة."""
+    global _file_stamp
     with _config_lock:
         try:
-            CFG_PATH.write_text(cfg.model_dump_json(indent=2), encoding="utf-8")
-            _config_cache = cfg
-            log.info("Config saved to %s", CFG_PATH)
+            _write_atomic(cfg)
         except Exception as e:
             log.error("Failed to save config: %s", e)
             raise
+        _file_stamp = _stamp()
+        log.info("Config saved to %s", CFG_PATH)
+        _publish(cfg)
+
+
+def update_config(changes: dict) -> AgentConfig:
+    """
+    دمج تغييرات على النسخة الحالية والتحقق منها وحفظها في خطوة واحدة،
+    فلا يضيع تحديث عند وصول أمرين (REST و WebSocket) في نفس الوقت.
+    """
+    with _config_lock:
+        new_cfg = AgentConfig(**{**load_config().model_dump(), **changes})
+        save_config(new_cfg)
+        return new_cfg
+
+
+def config_snapshot() -> tuple[int, AgentConfig]:
+    """
+    (رقم النسخة، الإعدادات) من نفس النسخة المنشورة بقراءة واحدة، فلا يُقرن رقم نسخة
+    بإعدادات نسخة أخرى إذا نُشر تغيير بين قراءتين. الرقم يتغير مع كل تغيير فعلي.
+    """
+    snapshot = _snapshot
+    if snapshot is None:
+        load_config()
+        snapshot = _snapshot
+    return snapshot
+
+
+def subscribe(listener: Callable[[AgentConfig, AgentConfig], None]) -> None:
+    """listener(new, old) يُستدعى عند كل تغيير في الإعدادات (بالترتيب، خارج المسار الساخن)."""
+    with _config_lock:
+        _listeners.append(listener)
 
 
 def invalidate_cache() -> None:
-    """مسح الذاكرة المؤقتة لإجبار إعادة التحميل."""
-    global _config_cache
+    """إعادة قراءة config.json فوراً."""
+    load_config(force_reload=True)
+
+
+# ── Watcher ──
+
+def _check_file() -> None:
+    """إعادة التحميل إذا تغيّر config.json على القرص منذ آخر قراءة أو كتابة."""
+    stamp = _stamp()
+    if stamp is None or stamp == _file_stamp:
+        return
+    with _config_lock:
+        # Re-check: save_config may have written it meanwhile
+        if _stamp() != _file_stamp:
+            log.info("config.json changed on disk, reloading")
+            _reload()
+
+
+def _watch_loop():
+    while True:
+        time.sleep(CONFIG_POLL_INTERVAL)
+        _check_file()
+
+
+def start_config_watcher() -> None:
+    """مراقبة config.json (mtime + size) وتطبيق التعديلات اليدوية بدون إعادة تشغيل."""
+    global _watcher_started
     with _config_lock:
-        _config_cache = None
+        if _watcher_started:
+            return
+        _watcher_started = True
+    threading.Thread(target=_watch_loop, name="config-watcher", daemon=True).start()
@@ -1,10 +1,62 @@
 # dashboard.py
+import gzip
+import hashlib
 from config import APP_VERSION
 
+try:
+    import brotli
+except ImportError:  # optional: the page is served gzip-compressed without it
+    brotli = None
+
+# الترميزات بالترتيب المفضل (الأصغر أولاً)
+ENCODINGS = ("br", "gzip")
+
+
 def get_dashboard_html() -> str:
     return DASHBOARD_HTML.replace("{{VERSION}}", APP_VERSION)
 
 
+def _accepted_encodings(accept_encoding: str) -> dict[str, float]:
+    """تحليل ترويسة Accept-Encoding إلى {ترميز: q}."""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        name = name.strip()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+class DashboardAsset:
+    """صفحة لوحة التحكم مولّدة مرة واحدة عند التشغيل، مع نسخها المضغوطة و ETag لكل نسخة."""
+
+    def __init__(self, html: str):
+        body = html.encode("utf-8")
+        self._hash = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {"identity": body, "gzip": gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=11)
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self._hash}-{encoding}"'
+
+    def negotiate(self, accept_encoding: str) -> tuple[str, bytes]:
+        """أفضل نسخة يقبلها المتصفح. يرجع (الترميز، الجسم)."""
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ENCODINGS:
+            if encoding in self.variants and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+                return encoding, self.variants[encoding]
+        return "identity", self.variants["identity"]
+
+
 DASHBOARD_HTML = r"""<!DOCTYPE html>
 <html lang="ar" dir="rtl" x-data="app()" :class="{ 'dark': darkMode }">
 <head>
@@ -254,6 +306,13 @@ tailwind.config = {
           </div>
         </div>
 
+        <!-- Logo -->
+        <div>
+          <label class="block text-xs font-medium text-gray-500 dark:text-gray-400 mb-1" x-text="lang==='ar' ? 'مسار صورة الشعار (اختياري)' : 'Logo image path (optional)'"></label>
+          <input type="text" x-model="config.logo_path" dir="ltr" placeholder="C:\ProgramData\GeniusStep\logo.png"
+                 class="w-full border border-gray-200 dark:border-gray-600 rounded-lg px-3 py-2 text-sm bg-white dark:bg-gray-700 dark:text-white focus:ring-2 focus:ring-blue-500 focus:border-transparent transition-shadow font-mono">
+        </div>
+
         <!-- Drawer Pin + Pulse -->
         <div class="grid grid-cols-3 gap-4">
           <div>
@@ -403,9 +462,10 @@ function app() {
     drawerAnim: false,
     loadingPrinters: false,
     toasts: [],
+    pollTimer: null,
 
     // Data
-    config: { device_id: '', device_token: '', wss_url: '', printer_name: '', drawer_pin: 0, pulse_on: 60, pulse_off: 120 },
+    config: { device_id: '', device_token: '', wss_url: '', printer_name: '', drawer_pin: 0, pulse_on: 60, pulse_off: 120, logo_path: '' },
     printers: [],
     health: { ws_connected: false, uptime: '0s', uptime_seconds: 0, total_opens: 0, today_opens: 0, ws_reconnect_count: 0, ws_last_error: '' },
     history: [],
@@ -414,11 +474,41 @@ function app() {
     init() {
       this.loadConfig();
       this.loadPrinters();
+      this.connectEvents();
+    },
+
+    // Live updates over SSE; polling every 5 s only while the stream is down
+    connectEvents() {
+      if (!window.EventSource) {
+        this.startPolling();
+        return;
+      }
+      const es = new EventSource('/events');
+      es.addEventListener('health', (e) => {
+        this.health = { ...this.health, ...JSON.parse(e.data) };
+      });
+      es.addEventListener('history', (e) => {
+        const data = JSON.parse(e.data);
+        this.history = data.full ? data.entries : [...data.entries, ...this.history].slice(0, 50);
+      });
+      es.onopen = () => this.stopPolling();
+      // EventSource reconnects by itself; keep the page fresh meanwhile
+      es.onerror = () => this.startPolling();
+    },
+
+    startPolling() {
+      if (this.pollTimer) return;
       this.loadHealth();
       this.loadHistory();
-      // Auto-refresh
-      setInterval(() => this.loadHealth(), 5000);
-      setInterval(() => this.loadHistory(), 5000);
+      this.pollTimer = setInterval(() => {
+        this.loadHealth();
+        this.loadHistory();
+      }, 5000);
+    },
+
+    stopPolling() {
+      clearInterval(this.pollTimer);
+      this.pollTimer = null;
     },
 
     // Language
@@ -447,6 +537,7 @@ function app() {
           drawer_pin: data.drawer_pin ?? 0,
           pulse_on: data.pulse_on ?? 60,
           pulse_off: data.pulse_off ?? 120,
+          logo_path: data.logo_path || '',
         };
         // Show wizard if first run
         if (!data.printer_name && data.device_token === 'CHANGE_ME') {
@@ -569,3 +660,7 @@ function app() {
 </script>
 </body>
 </html>"""
+
+
+# ── Singleton ──
+dashboard_asset = DashboardAsset(get_dashboard_html())
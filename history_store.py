@@ -0,0 +1,288 @@
+# history_store.py
+import sqlite3
+import threading
+import time
+from config import APP_DIR, load_config
+from logger import get_logger
+
+log = get_logger("history_store")
+
+HISTORY_DB_PATH = APP_DIR / "history.db"
+
+# تجميع الكتابات: تُكتب الدفعة كل FLUSH_INTERVAL ثانية أو عند BATCH_SIZE إدخال
+FLUSH_INTERVAL = 0.5
+BATCH_SIZE = 200
+
+# دفعة فشلت كتابتها تُعاد مع الدفعة التالية حتى هذا العدد من المحاولات ثم تُهمل
+WRITE_ATTEMPTS = 3
+
+# فترة حذف الإدخالات الأقدم من history_retention_days (ثوانٍ)
+COMPACT_INTERVAL = 6 * 3600
+
+# العمليات التي تُحسب في العدادات (نفس منطق AppState.add_history)
+OPEN_ACTIONS = ("OPEN_DRAWER",)
+PRINT_ACTIONS = ("PRINT_RECEIPT", "PRINT_RAW", "TEST_PRINT")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    action TEXT NOT NULL,
+    source TEXT NOT NULL,
+    status TEXT NOT NULL,
+    detail TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_history_ts ON history (ts);
+CREATE INDEX IF NOT EXISTS idx_history_action ON history (action, id);
+CREATE INDEX IF NOT EXISTS idx_history_source ON history (source, id);
+CREATE INDEX IF NOT EXISTS idx_history_status ON history (status, id);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class HistoryStore:
+    """
+    سجل العمليات الدائم في SQLite (WAL) لتدقيق فتح الدرج على مدى أشهر.
+
+    add() لا يلمس القرص: الإدخالات تُجمع وتُكتب في معاملة واحدة من خيط منفصل.
+    الأرقام (id) تُعطى من AppState بالترتيب فتصلح مؤشراً للتصفح (cursor).
+    العدادات الإجمالية محفوظة في جدول خاص فلا تتأثر بحذف الإدخالات القديمة.
+    """
+
+    def __init__(self, path=HISTORY_DB_PATH):
+        self.path = path
+        self._pending: list[tuple] = []
+        # counter name -> increment not yet written
+        self._pending_counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._dirty = threading.Condition(self._lock)
+        self._flushed = threading.Condition(self._lock)
+        # Reads use their own connection; WAL lets them run beside the writer
+        self._read_lock = threading.Lock()
+        self._reader: sqlite3.Connection | None = None
+        self._writer: sqlite3.Connection | None = None
+        self._written = 0
+        self._queued = 0
+        self._flush_requested = False
+        self._started = False
+
+        # Stats
+        self.batches: int = 0
+        self.purged: int = 0
+
+    # ── Lifecycle ──
+
+    def start(self):
+        """فتح قاعدة البيانات وتشغيل خيط الكتابة."""
+        with self._lock:
+            if self._started:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._writer = self._connect(auto_vacuum=True)
+            self._writer.executescript(SCHEMA)
+            if self._writer.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                # File created without it (by an older version): VACUUM applies it once
+                log.info("Enabling incremental auto-vacuum on %s", self.path)
+                self._writer.execute("VACUUM")
+            self._reader = self._connect()
+            self._started = True
+        threading.Thread(target=self._write_loop, name="history-writer", daemon=True).start()
+        log.info("History store opened at %s", self.path)
+
+    def _connect(self, auto_vacuum: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        if auto_vacuum:
+            # Before journal_mode: switching a new file to WAL writes its header,
+            # after which auto_vacuum can only change through VACUUM
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def close(self):
+        """كتابة ما تبقى قبل إيقاف البرنامج."""
+        if self._started:
+            self.flush()
+
+    # ── Writes ──
+
+    def add(self, entry_id: int, ts: float, action: str, source: str, status: str, detail: str):
+        with self._lock:
+            self._pending.append((entry_id, ts, action, source, status, detail))
+            if status == "ok":
+                counter = _counter_name(action)
+                if counter:
+                    self._pending_counters[counter] = self._pending_counters.get(counter, 0) + 1
+            self._queued += 1
+            if len(self._pending) >= BATCH_SIZE:
+                self._dirty.notify()
+
+    def flush(self):
+        """انتظار كتابة كل الإدخالات المضافة حتى الآن."""
+        with self._lock:
+            if not self._started:
+                return
+            target = self._queued
+            self._flush_requested = True
+            self._dirty.notify()
+            while self._written < target:
+                self._flushed.wait()
+
+    def _write_loop(self):
+        next_compact = time.monotonic()
+        # A batch whose write failed, retried ahead of the next one
+        failed: list[tuple] = []
+        failed_counters: dict[str, int] = {}
+        attempts = 0
+        while True:
+            with self._lock:
+                if len(self._pending) < BATCH_SIZE and not self._flush_requested:
+                    self._dirty.wait(FLUSH_INTERVAL)
+                self._flush_requested = False
+                batch, self._pending = failed + self._pending, []
+                counters = dict(failed_counters)
+                for name, value in self._pending_counters.items():
+                    counters[name] = counters.get(name, 0) + value
+                self._pending_counters = {}
+            if batch:
+                if self._write(batch, counters):
+                    failed, failed_counters, attempts = [], {}, 0
+                else:
+                    attempts += 1
+                    if attempts < WRITE_ATTEMPTS:
+                        failed, failed_counters = batch, counters
+                    else:
+                        log.error("Dropping %d history entries after %d failed writes",
+                                  len(batch), attempts)
+                        failed, failed_counters, attempts = [], {}, 0
+                # Failed entries count as written only once dropped, so flush() waits for them
+                with self._lock:
+                    self._written += len(batch) - len(failed)
+                    self._flushed.notify_all()
+            if time.monotonic() >= next_compact:
+                self._compact()
+                next_compact = time.monotonic() + COMPACT_INTERVAL
+
+    def _write(self, batch: list[tuple], counters: dict[str, int]) -> bool:
+        try:
+            with self._writer:
+                self._writer.execute("BEGIN")
+                self._writer.executemany(
+                    "INSERT OR REPLACE INTO history (id, ts, action, source, status, detail) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", batch,
+                )
+                self._writer.executemany(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                    counters.items(),
+                )
+            self.batches += 1
+            return True
+        except sqlite3.Error as e:
+            # Retried with the next batch; a failing disk must not stop the agent
+            log.error("Could not write %d history entries: %s", len(batch), e)
+            return False
+
+    def _compact(self):
+        """حذف الإدخالات الأقدم من history_retention_days وتحرير مساحتها."""
+        cutoff = time.time() - load_config().history_retention_days * 86400
+        try:
+            deleted = self._writer.execute("DELETE FROM history WHERE ts < ?", (cutoff,)).rowcount
+            if deleted:
+                self._writer.execute("PRAGMA incremental_vacuum")
+                self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                self.purged += deleted
+                log.info("History compacted: %d entries older than %s removed",
+                         deleted, time.strftime("%Y-%m-%d", time.localtime(cutoff)))
+        except sqlite3.Error as e:
+            log.error("History compaction failed: %s", e)
+
+    # ── Reads ──
+
+    def last_id(self) -> int:
+        """أكبر id كُتب (حتى بعد حذف الإدخالات القديمة)، لمتابعة الترقيم بعد إعادة التشغيل."""
+        with self._read_lock:
+            row = self._reader.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'history'"
+            ).fetchone()
+        return row[0] if row else 0
+
+    def counters(self) -> dict[str, int]:
+        """العدادات الإجمالية وعدادات اليوم، لإعادة بنائها عند التشغيل."""
+        today = time.mktime(time.localtime()[:3] + (0, 0, 0, 0, 0, -1))
+        with self._read_lock:
+            totals = dict(self._reader.execute("SELECT name, value FROM counters"))
+            opens, prints = self._reader.execute(
+                "SELECT "
+                f"  SUM(action IN ({_placeholders(OPEN_ACTIONS)})), "
+                f"  SUM(action IN ({_placeholders(PRINT_ACTIONS)})) "
+                "FROM history WHERE status = 'ok' AND ts >= ?",
+                (*OPEN_ACTIONS, *PRINT_ACTIONS, today),
+            ).fetchone()
+        return {
+            "total_opens": totals.get("opens", 0),
+            "total_prints": totals.get("prints", 0),
+            "today_opens": opens or 0,
+            "today_prints": prints or 0,
+        }
+
+    def query(self, limit: int = 50, before: int | None = None,
+              action: str | None = None, source: str | None = None, status: str | None = None,
+              since: float | None = None, until: float | None = None) -> list[tuple]:
+        """
+        الإدخالات الأحدث أولاً مع التصفية. before هو id آخر إدخال في الصفحة السابقة
+        (cursor)، فالصفحة التالية لا تتأثر بالإدخالات الجديدة.
+        يرجع صفوف (id, ts, action, source, status, detail).
+        """
+        self.flush()
+        where, params = [], []
+        for column, value in (("action", action), ("source", source), ("status", status)):
+            if value:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if before is not None:
+            where.append("id < ?")
+            params.append(before)
+        if since is not None:
+            where.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("ts < ?")
+            params.append(until)
+        sql = "SELECT id, ts, action, source, status, detail FROM history"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        with self._read_lock:
+            return self._reader.execute(sql, (*params, limit)).fetchall()
+
+    def stats(self) -> dict:
+        with self._read_lock:
+            entries = self._reader.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "entries": entries,
+            "pending_writes": pending,
+            "batches": self.batches,
+            "purged": self.purged,
+        }
+
+
+def _counter_name(action: str) -> str | None:
+    if action in OPEN_ACTIONS:
+        return "opens"
+    if action in PRINT_ACTIONS:
+        return "prints"
+    return None
+
+
+def _placeholders(values: tuple) -> str:
+    return ", ".join("?" * len(values))
+
+
+# ── Singleton ──
+history_store = HistoryStore()
@@ -0,0 +1,172 @@
+# idempotency.py
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from config import APP_DIR
+from logger import get_logger
+
+log = get_logger("idempotency")
+
+IDEMPOTENCY_PATH = APP_DIR / "idempotency.json"
+
+# مدة الاحتفاظ بنتيجة الأمر (ثوانٍ) والحد الأقصى لعدد المفاتيح
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_ENTRIES = 1000
+
+# مفتاح "قيد التنفيذ" يُعتبر متروكاً بعد هذه المدة (مثلاً إذا توقف المعالج فجأة)
+PENDING_TIMEOUT = 120.0
+
+# تجميع عمليات الحفظ على القرص
+SAVE_DELAY = 1.0
+
+NEW = "new"
+PENDING = "pending"
+DONE = "done"
+
+
+# نتيجة مهمة اكتملت بعد انتهاء مهلة الطلب الأصلي (الرد الأصلي لم يُبنَ)
+LATE_RESULT = {"ok": True, "message": "Completed after the original request timed out"}
+
+
+def _scoped(cmd: str, key: str) -> str:
+    """المفتاح خاص بنوع الأمر: نفس المفتاح لأمرين مختلفين لا يُعيد رد الآخر."""
+    return f"{cmd}:{key}"
+
+
+class IdempotencyCache:
+    """
+    ذاكرة مفاتيح idempotency لأوامر الطباعة وفتح الدرج، لكل (أمر، مفتاح).
+    إعادة إرسال نفس المفتاح (بعد انقطاع الاتصال مثلاً) تُرجع الرد الأصلي
+    بدون لمس الطابعة. النتائج الناجحة فقط تُحفظ، وتبقى بعد إعادة التشغيل.
+    """
+
+    def __init__(self, path=IDEMPOTENCY_PATH, ttl: float = DEFAULT_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (completed_at, result)
+        self._done: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        # key -> started_at (monotonic)
+        self._pending: dict[str, float] = {}
+        # key -> مهمة انتهت مهلة طلبها وما زالت في قائمة الطابعة
+        self._jobs: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._save_timer: threading.Timer | None = None
+        self.replays: int = 0
+        self._load()
+
+    def _load(self):
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable idempotency file %s: %s", self.path, e)
+            return
+        now = time.time()
+        for key, completed_at, result in raw.get("entries", []):
+            if now - completed_at < self.ttl:
+                self._done[key] = (completed_at, result)
+        log.info("Loaded %d idempotency keys", len(self._done))
+
+    def _expire(self, now: float):
+        while self._done:
+            key, (completed_at, _) = next(iter(self._done.items()))
+            if now - completed_at < self.ttl and len(self._done) <= self.max_entries:
+                break
+            self._done.popitem(last=False)
+
+    def begin(self, cmd: str, key: str) -> tuple[str, dict | None]:
+        """
+        بدء أمر بمفتاح معيّن. يرجع:
+            (NEW, None)        أول مرة: نفّذ الأمر ثم استدعِ complete أو release أو hold
+            (DONE, result)     أمر مكرر: أعد النتيجة المحفوظة
+            (PENDING, None)    نفس المفتاح ما زال قيد التنفيذ
+        """
+        key = _scoped(cmd, key)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            done = self._done.get(key)
+            if done is not None:
+                self.replays += 1
+                return DONE, done[1]
+            if key in self._jobs:
+                return PENDING, None
+            started = self._pending.get(key)
+            if started is not None and time.monotonic() - started < PENDING_TIMEOUT:
+                return PENDING, None
+            self._pending[key] = time.monotonic()
+            return NEW, None
+
+    def complete(self, cmd: str, key: str, result: dict):
+        """حفظ نتيجة أمر ناجح لإعادتها عند التكرار."""
+        self._complete(_scoped(cmd, key), result)
+
+    def _complete(self, key: str, result: dict):
+        with self._lock:
+            self._pending.pop(key, None)
+            self._done[key] = (time.time(), result)
+            self._done.move_to_end(key)
+            self._expire(time.time())
+        self._schedule_save()
+
+    def release(self, cmd: str, key: str):
+        """تحرير مفتاح أمر فشل حتى يمكن إعادة المحاولة به."""
+        with self._lock:
+            self._pending.pop(_scoped(cmd, key), None)
+
+    def hold(self, cmd: str, key: str, future: Future):
+        """
+        انتهت مهلة الطلب والمهمة ما زالت في قائمة الطابعة: المفتاح يبقى PENDING حتى تنتهي
+        فعلاً، ثم يُحفظ كنجاح (فلا تُطبع مرة ثانية عند إعادة المحاولة) أو يُحرَّر إذا فشلت.
+        """
+        key = _scoped(cmd, key)
+        with self._lock:
+            self._pending.pop(key, None)
+            self._jobs[key] = future
+        future.add_done_callback(lambda f: self._job_finished(key, f))
+
+    def _job_finished(self, key: str, future: Future):
+        with self._lock:
+            self._jobs.pop(key, None)
+        if not future.cancelled() and future.exception() is None:
+            self._complete(key, dict(LATE_RESULT))
+
+    def _schedule_save(self):
+        with self._lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(SAVE_DELAY, self._save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _save(self):
+        with self._lock:
+            self._save_timer = None
+            entries = [[k, t, r] for k, (t, r) in self._done.items()]
+        try:
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"entries": entries}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning("Could not save idempotency keys: %s", e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "keys": len(self._done),
+                "pending": len(self._pending) + len(self._jobs),
+                "replays": self.replays,
+            }
+
+
+# ── Singleton ──
+idempotency_cache = IdempotencyCache()
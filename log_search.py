@@ -0,0 +1,182 @@
+# log_search.py
+import mmap
+import re
+import time
+from pathlib import Path
+from typing import Iterator
+from logger import LOG_FILE, LOG_BACKUPS, LOG_LEVELS
+
+# أقصى عدد سجلات في رد واحد
+MAX_LINES = 5000
+
+# حجم الدفعة المرسلة للعميل: سطور كثيرة في كتابة واحدة بدل كتابة لكل سطر
+CHUNK_SIZE = 16 * 1024
+
+# نافذة البحث بالنص: تُفحص بـ regex دفعة واحدة (في C) من النهاية إلى البداية
+SCAN_WINDOW = 256 * 1024
+
+# بداية سجل جديد: "[2026-01-31 12:00:00] INFO ..." أو '{"ts": "2026-01-31 12:00:00.123", ...'
+# (السطور الأخرى تكملة للسجل السابق، مثل traceback)
+_HEADER = re.compile(rb'(?:\[|\{"ts": ")(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)')
+_TEXT_LEVEL = re.compile(rb'\] (\w+)')
+_JSON_LEVEL = re.compile(rb'"level": "(\w+)"')
+_HEADER_PEEK = 64
+
+LEVEL_RANK = {name.encode(): rank for rank, name in enumerate(LOG_LEVELS)}
+
+
+def log_files() -> list[Path]:
+    """agent.log ثم النسخ الدوارة، من الأحدث إلى الأقدم."""
+    paths = [LOG_FILE] + [LOG_FILE.with_name(f"{LOG_FILE.name}.{i}") for i in range(1, LOG_BACKUPS + 1)]
+    return [p for p in paths if p.exists()]
+
+
+def _ts_bytes(epoch: float) -> bytes:
+    """الوقت بنفس صيغة السجل، فتكفي مقارنة البايتات بدل تحليل التاريخ لكل سطر."""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(epoch)).encode()
+
+
+def _header(mm: mmap.mmap, pos: int) -> re.Match | None:
+    return _HEADER.match(mm[pos:pos + _HEADER_PEEK])
+
+
+def _next_header(mm: mmap.mmap, pos: int) -> int:
+    """موضع أول سجل يبدأ عند pos أو بعده (len(mm) إذا لم يوجد)."""
+    size = len(mm)
+    if pos > 0 and mm[pos - 1] != 0x0A:
+        pos = mm.find(b"\n", pos) + 1 or size
+    while pos < size and _header(mm, pos) is None:
+        pos = mm.find(b"\n", pos) + 1 or size
+    return pos
+
+
+def _offset_at(mm: mmap.mmap, ts: bytes) -> int:
+    """بحث ثنائي: موضع أول سجل وقته >= ts (السجلات مرتبة زمنياً داخل الملف)."""
+    lo, hi = 0, len(mm)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        pos = _next_header(mm, mid)
+        if pos < len(mm) and _header(mm, pos).group(1) < ts:
+            lo = pos + 1
+        else:
+            hi = mid
+    return _next_header(mm, lo)
+
+
+def _reverse_records(mm: mmap.mmap, start: int, end: int) -> Iterator[list[bytes]]:
+    """السجلات بين start و end من الأحدث إلى الأقدم، كل سجل قائمة سطوره بالترتيب."""
+    tail: list[bytes] = []
+    while end > start:
+        nl = mm.rfind(b"\n", start, end - 1)
+        line_start = nl + 1 if nl >= 0 else start
+        line = mm[line_start:end].rstrip(b"\r\n")
+        end = line_start
+        tail.append(line)
+        if _HEADER.match(line):
+            tail.reverse()
+            yield tail
+            tail = []
+    # Lines before the first header continue a record from the older file: dropped
+
+
+def _line_start(mm: mmap.mmap, lo: int, pos: int) -> int:
+    return mm.rfind(b"\n", lo, pos) + 1 or lo
+
+
+def _matching_records(mm: mmap.mmap, start: int, end: int,
+                      pattern: re.Pattern) -> Iterator[list[bytes]]:
+    """
+    مثل _reverse_records لكن للسجلات التي تحتوي pattern فقط: كل نافذة تُفحص بـ finditer
+    ثم يُبنى السجل حول كل تطابق، فلا تمر السطور غير المطابقة عبر Python.
+    """
+    while end > start:
+        # Windows start on a record boundary so no record is split between two windows
+        window = _next_header(mm, max(start, end - SCAN_WINDOW))
+        if window >= end:  # a single record larger than the window
+            window = start
+        record_start = end
+        for pos in reversed([m.start() for m in pattern.finditer(mm, window, end)]):
+            if pos >= record_start:
+                continue  # another match inside a record already sent
+            line = _line_start(mm, window, pos)
+            while _header(mm, line) is None and line > window:
+                line = _line_start(mm, window, line - 1)
+            if _header(mm, line) is None:
+                break  # continuation of a record from the older file
+            record_end = min(_next_header(mm, pos + 1), end)
+            record_start = line
+            yield [part.rstrip(b"\r") for part in mm[line:record_end].rstrip(b"\r\n").split(b"\n")]
+        end = window
+
+
+def _level_rank(header: bytes) -> int:
+    match = _JSON_LEVEL.search(header) if header.startswith(b"{") else _TEXT_LEVEL.search(header)
+    return LEVEL_RANK.get(match.group(1), 0) if match else 0
+
+
+def _search_file(path: Path, pattern: re.Pattern | None, min_rank: int,
+                 since_ts: bytes | None, until_ts: bytes | None, limit: int) -> tuple[list[bytes], bool]:
+    """
+    السجلات المطابقة في ملف واحد (حتى limit)، منسوخة من الـ mmap قبل إغلاقه.
+    يرجع (السجلات، هل بدأ النطاق داخل هذا الملف: الملفات الأقدم لا تحتوي شيئاً بعده).
+    """
+    found: list[bytes] = []
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return found, False
+        with mm:
+            start = _offset_at(mm, since_ts) if since_ts else 0
+            end = _offset_at(mm, until_ts) if until_ts else len(mm)
+            if pattern is not None:
+                records = _matching_records(mm, start, end, pattern)
+            else:
+                records = _reverse_records(mm, start, end)
+            for record in records:
+                if min_rank and _level_rank(record[0]) < min_rank:
+                    continue
+                text = b"\n".join(record)
+                if pattern is not None and not pattern.search(text):
+                    continue
+                found.append(text)
+                if len(found) >= limit:
+                    break
+            # Lines before the first header continue a record from the older file
+            range_starts_here = start > _next_header(mm, 0)
+    return found, range_starts_here
+
+
+def search_logs(query: str | None = None, level: str | None = None,
+                since: float | None = None, until: float | None = None,
+                limit: int = 200) -> Iterator[bytes]:
+    """
+    البحث في agent.log والنسخ الدوارة من الأحدث إلى الأقدم، وإرجاع السجلات المطابقة فقط
+    على دفعات. الملفات تُقرأ عبر mmap من النهاية إلى البداية، والنطاق الزمني يُحدد ببحث
+    ثنائي، فلا يُقرأ إلى الذاكرة إلا ما يُفحص فعلاً ويتوقف البحث عند limit.
+    نتائج كل ملف تُنسخ ويُغلق الـ mmap قبل إرسالها، فلا يمنع عميل بطيء تدوير السجل
+    (إعادة تسمية ملف مفتوح بـ mmap تفشل على ويندوز).
+
+    level: الحد الأدنى (WARNING = WARNING + ERROR + CRITICAL). query: نص بدون حساسية لحالة الأحرف.
+    """
+    pattern = re.compile(re.escape(query.encode("utf-8")), re.IGNORECASE) if query else None
+    min_rank = LEVEL_RANK[level.upper().encode()] if level else 0
+    since_ts = _ts_bytes(since) if since is not None else None
+    until_ts = _ts_bytes(until) if until is not None else None
+    remaining = limit
+    chunk = bytearray()
+
+    for path in log_files():
+        found, range_starts_here = _search_file(path, pattern, min_rank, since_ts, until_ts, remaining)
+        for text in found:
+            chunk += text + b"\n"
+            if len(chunk) >= CHUNK_SIZE:
+                yield bytes(chunk)
+                chunk.clear()
+        remaining -= len(found)
+        # Older files hold only older records
+        if remaining <= 0 or range_starts_here:
+            break
+
+    if chunk:
+        yield bytes(chunk)
@@ -1,14 +1,131 @@
 # logger.py
+import atexit
+import contextvars
+import json
 import logging
+import queue
 import sys
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 APP_NAME = "GeniusStepCashDrawer"
 LOG_DIR = Path(r"C:\ProgramData\GeniusStep\CashDrawerAgent\logs")
+# الملف الحالي والنسخ الدوارة: agent.log.1 (الأحدث) ... agent.log.3 (الأقدم)
+LOG_FILE = LOG_DIR / "agent.log"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
 
-def setup_logging(level: int = logging.INFO) -> logging.Logger:
-    """تهيئة نظام التسجيل المركزي مع ملفات دوارة + console."""
+# حد قائمة السجلات بانتظار الكتابة؛ ما يزيد يُهمل بدل حجب الخيط المستدعي
+LOG_QUEUE_SIZE = 10000
+
+TEXT_FORMAT = "[%(asctime)s] %(levelname)-8s %(name)s.%(module)s: %(message)s%(context)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# المستويات المقبولة في الإعدادات و POST /logging
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+# معرّفات الطلب / المهمة الحالية، تُضاف تلقائياً لكل سطر سجل
+_request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="")
+_job_id: contextvars.ContextVar[str] = contextvars.ContextVar("job_id", default="")
+
+_queue_handler: "_DroppingQueueHandler | None" = None
+_listener: QueueListener | None = None
+_sampler: "SamplingFilter | None" = None
+
+
+class ContextFilter(logging.Filter):
+    """يضيف request_id و job_id من السياق الحالي (في خيط المستدعي، قبل دخول القائمة)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        record.job_id = _job_id.get()
+        parts = []
+        if record.request_id:
+            parts.append(f"request_id={record.request_id}")
+        if record.job_id:
+            parts.append(f"job_id={record.job_id}")
+        record.context = f" [{' '.join(parts)}]" if parts else ""
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    أخذ عينة من رسائل INFO/DEBUG المتكررة: لوحدة لها معدل N يُكتب سطر من كل N.
+    التحذيرات والأخطاء تُكتب دائماً.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.rates: dict[str, int] = {}
+        self._counts: dict[str, int] = {}
+        self.suppressed: int = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.name)
+        if rate is None or rate <= 1 or record.levelno >= logging.WARNING:
+            return True
+        count = self._counts.get(record.name, 0)
+        self._counts[record.name] = count + 1
+        if count % rate == 0:
+            return True
+        self.suppressed += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """سطر JSON لكل سجل (JSON lines) مع معرّفات الطلب / المهمة."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime(DATE_FORMAT, time.localtime(record.created))
+                  + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "msg": record.getMessage(),
+        }
+        for key in ("request_id", "job_id"):
+            value = getattr(record, key, "")
+            if value:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """لا يحجب المستدعي أبداً: إذا امتلأت القائمة يُهمل السجل ويُحسب."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped: int = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Freeze the message (args may change later); formatting happens in the writer thread
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _text_formatter() -> logging.Formatter:
+    return logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+
+
+def setup_logging(level: int = logging.INFO, json_format: bool = False) -> logging.Logger:
+    """
+    تهيئة نظام التسجيل المركزي: السجلات تُوضع في قائمة انتظار، وخيط خلفي يكتبها
+    إلى console وملفات دوارة، فلا ينتظر خيط الطلب أو WebSocket كتابة القرص.
+    """
+    global _queue_handler, _listener, _sampler
     try:
         LOG_DIR.mkdir(parents=True, exist_ok=True)
     except OSError:
@@ -19,33 +136,123 @@ def setup_logging(level: int = logging.INFO) -> logging.Logger:
         return logger
 
     logger.setLevel(level)
-    fmt = logging.Formatter(
-        "[%(asctime)s] %(levelname)-8s %(name)s.%(module)s: %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
+    handlers: list[logging.Handler] = []
 
     # Console handler
     console = logging.StreamHandler(sys.stdout)
-    console.setLevel(level)
-    console.setFormatter(fmt)
-    logger.addHandler(console)
+    handlers.append(console)
 
     # File handler (rotating: 5 MB x 3 files)
+    file_error = None
     try:
-        log_file = LOG_DIR / "agent.log"
         fh = RotatingFileHandler(
-            log_file, maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8"
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8"
         )
-        fh.setLevel(level)
-        fh.setFormatter(fmt)
-        logger.addHandler(fh)
-    except OSError:
-        logger.warning("Could not create log file, using console only")
+        handlers.append(fh)
+    except OSError as e:
+        file_error = e
+
+    for handler in handlers:
+        handler.setFormatter(JsonFormatter() if json_format else _text_formatter())
+
+    # Context and sampling run in the caller's thread, before the record is queued
+    _sampler = SamplingFilter()
+    _queue_handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(ContextFilter())
+    _queue_handler.addFilter(_sampler)
+    logger.addHandler(_queue_handler)
+
+    _listener = QueueListener(_queue_handler.queue, *handlers)
+    _listener.start()
+    atexit.register(shutdown_logging)
 
+    if file_error is not None:
+        logger.warning("Could not create log file, using console only")
     return logger
 
 
+def shutdown_logging():
+    """كتابة ما تبقى في القائمة وإيقاف خيط الكتابة."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
 def get_logger(module: str = "") -> logging.Logger:
     """إرجاع logger فرعي لوحدة معينة."""
     name = f"{APP_NAME}.{module}" if module else APP_NAME
     return logging.getLogger(name)
+
+
+# ── Request / job context ──
+
+@contextmanager
+def log_context(request_id: str | None = None, job_id: str | None = None):
+    """كل السجلات داخل هذا السياق (وفي المهام التي تُنشأ منه) تحمل المعرّفات."""
+    tokens = []
+    if request_id is not None:
+        tokens.append((_request_id, _request_id.set(str(request_id))))
+    if job_id is not None:
+        tokens.append((_job_id, _job_id.set(str(job_id))))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+# ── Runtime control ──
+
+def set_level(module: str, level: str):
+    """
+    تغيير مستوى وحدة (أو الكل إذا كان module فارغاً) أثناء التشغيل.
+    NOTSET لوحدة يعيدها إلى مستوى البرنامج العام.
+    """
+    level = level.upper()
+    if level not in LOG_LEVELS and not (module and level == "NOTSET"):
+        raise ValueError(f"Unknown log level: {level}")
+    get_logger(module).setLevel(level)
+
+
+def set_sampling(module: str, every: int):
+    """كتابة سطر INFO/DEBUG واحد من كل every لهذه الوحدة (1 = الكل)."""
+    if every < 1:
+        raise ValueError("sampling rate must be >= 1")
+    if _sampler is None:
+        return
+    name = get_logger(module).name
+    if every == 1:
+        _sampler.rates.pop(name, None)
+    else:
+        _sampler.rates[name] = every
+
+
+def set_json_output(enabled: bool):
+    """التبديل بين السطور النصية و JSON lines."""
+    if _listener is None:
+        return
+    for handler in _listener.handlers:
+        handler.setFormatter(JsonFormatter() if enabled else _text_formatter())
+
+
+def logging_stats() -> dict:
+    """المستويات الحالية ومعدلات العينة وعدد السجلات المُهملة."""
+    root = logging.getLogger(APP_NAME)
+    prefix = APP_NAME + "."
+    loggers = {
+        name[len(prefix):]: logging.getLevelName(lg.level)
+        for name, lg in logging.Logger.manager.loggerDict.items()
+        if name.startswith(prefix) and isinstance(lg, logging.Logger) and lg.level
+    }
+    return {
+        "level": logging.getLevelName(root.level),
+        "loggers": loggers,
+        "sampling": {
+            name[len(prefix):]: rate for name, rate in (_sampler.rates if _sampler else {}).items()
+        },
+        "json": bool(_listener and isinstance(_listener.handlers[0].formatter, JsonFormatter)),
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "sampled_out": _sampler.suppressed if _sampler else 0,
+    }
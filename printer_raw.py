@@ -1,42 +1,129 @@
 # printer_raw.py
-import win32print
 import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator
 from logger import get_logger
+from raster import logo_cache
+from spool_store import durable_spool
+from state import app_state
+from transports import transport_pool, PartialWriteError
 
 log = get_logger("printer")
 
 
-def send_raw(printer_name: str, data: bytes, job_name: str = "GeniusStep CashDrawer"):
-    """إرسال بيانات RAW مباشرة إلى الطابعة."""
+def send_raw(printer_name: str, data: bytes | Iterable[bytes],
+             job_name: str = "GeniusStep CashDrawer") -> int:
+    """
+    إرسال بيانات RAW مباشرة إلى الطابعة.
+    تقبل bytes أو مولّد دفعات (تُرسل كل دفعة فور توليدها). يرجع عدد البايتات.
+    """
     if not printer_name:
         raise RuntimeError("Printer name is empty. اختر طابعة أولاً.")
-    log.debug("Sending %d bytes to printer '%s'", len(data), printer_name)
-    hPrinter = win32print.OpenPrinter(printer_name)
+    total = transport_pool.send(printer_name, data, job_name)
+    log.info("Data sent to printer '%s' OK (%d bytes)", printer_name, total)
+    return total
+
+
+class _RecordedChunks:
+    """تمرير الدفعات إلى الطابعة مع الاحتفاظ بها لحفظ المهمة في الـ spool عند الفشل."""
+
+    __slots__ = ("_chunks", "sent", "render_failed")
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self.sent: list[bytes] = []
+        self.render_failed = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                return
+            except Exception:
+                self.render_failed = True
+                raise
+            self.sent.append(chunk)
+            yield chunk
+
+    def rendered(self) -> bytes:
+        """المهمة كاملة: ما أُرسل بالفعل + ما تبقى دون إرسال."""
+        return b"".join(self.sent) + b"".join(self._chunks)
+
+
+def send_or_spool(printer_name: str, chunks: Iterable[bytes], job_name: str) -> str | None:
+    """
+    إرسال مهمة، وعند فشل الطابعة (غير متصلة، نفد الورق...) حفظها جاهزة على القرص
+    لإعادة إرسالها تلقائياً. يرجع رقم المهمة في الـ spool، أو None إذا طُبعت مباشرة.
+    أخطاء البيانات نفسها (ValueError أو فشل توليد الإيصال) لا تُحفظ وتُرفع كما هي.
+    """
+    if not printer_name:
+        raise RuntimeError("Printer name is empty. اختر طابعة أولاً.")
+    # Earlier jobs are still waiting: queue behind them to keep print order
+    if durable_spool.has_pending(printer_name):
+        return durable_spool.add(printer_name, b"".join(chunks), job_name)
+
+    recorded = _RecordedChunks(chunks)
     try:
-        win32print.StartDocPrinter(hPrinter, 1, (job_name, None, "RAW"))
-        try:
-            win32print.StartPagePrinter(hPrinter)
-            win32print.WritePrinter(hPrinter, data)
-            win32print.EndPagePrinter(hPrinter)
-        finally:
-            win32print.EndDocPrinter(hPrinter)
-    finally:
-        win32print.ClosePrinter(hPrinter)
-    log.info("Data sent to printer '%s' OK", printer_name)
+        send_raw(printer_name, recorded, job_name=job_name)
+        return None
+    except ValueError:
+        raise
+    except Exception as e:
+        if recorded.render_failed:
+            raise
+        if isinstance(e, PartialWriteError):
+            # The head may already be on paper: cut it off and mark the full copy as a reprint
+            log.warning("Printer '%s' failed mid-job (%s), spooling '%s' as a reprint",
+                        printer_name, e, job_name)
+            return durable_spool.add(printer_name, _reprint_notice() + recorded.rendered(),
+                                     job_name, partial=True)
+        log.warning("Printer '%s' unavailable (%s), spooling '%s'", printer_name, e, job_name)
+        return durable_spool.add(printer_name, recorded.rendered(), job_name)
+
 
+def _reprint_notice() -> bytes:
+    """قص الجزء المطبوع من مهمة انقطعت، ثم عنوان يوضح أن ما يليه نسخة معادة."""
+    return (escpos_feed(3) + escpos_cut(partial=True) + INIT_PRINTER + ALIGN_CENTER
+            + BOLD_ON + b"*** REPRINT ***\n" + BOLD_OFF
+            + b"Previous copy was interrupted\n" + ALIGN_LEFT)
 
+
+@lru_cache(maxsize=16)
 def escpos_open_drawer(pin: int = 0, t1: int = 60, t2: int = 120) -> bytes:
-    """توليد أمر ESC/POS لفتح درج النقدية."""
+    """توليد أمر ESC/POS لفتح درج النقدية (مخزّن مسبقاً لكل pin/pulse)."""
     # ESC p m t1 t2
     return bytes([0x1B, 0x70, pin & 0xFF, t1 & 0xFF, t2 & 0xFF])
 
 
-def open_drawer(printer_name: str, pin: int = 0, t1: int = 60, t2: int = 120):
-    """فتح درج النقدية عبر الطابعة."""
-    log.info("Opening drawer: printer='%s', pin=%d, t1=%d, t2=%d", printer_name, pin, t1, t2)
+def open_drawer(printer_name: str, pin: int = 0, t1: int = 60, t2: int = 120) -> float:
+    """فتح درج النقدية عبر الطابعة. يرجع زمن التنفيذ بالميلي ثانية."""
     data = escpos_open_drawer(pin, t1, t2)
+    started = time.perf_counter()
     send_raw(printer_name, data, job_name="Open Cash Drawer")
-    log.info("Drawer opened successfully")
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    app_state.record_drawer_kick(elapsed_ms)
+    log.info("Drawer opened: printer='%s', pin=%d (%.1f ms)", printer_name, pin, elapsed_ms)
+    return elapsed_ms
+
+
+def prepare_drawer(printer_name: str, pin: int = 0, t1: int = 60, t2: int = 120):
+    """
+    تجهيز المسار السريع لفتح الدرج: توليد الأمر مسبقاً وفتح الاتصال بالطابعة
+    حتى لا يدفع أول أمر فتح تكلفة OpenPrinter / الاتصال.
+    """
+    escpos_open_drawer(pin, t1, t2)
+    if not printer_name:
+        return
+    try:
+        transport_pool.warm(printer_name)
+        log.info("Drawer channel ready for printer '%s'", printer_name)
+    except Exception as e:
+        log.warning("Could not pre-open printer '%s': %s", printer_name, e)
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -112,82 +199,137 @@ def escpos_set_encoding(codepage: int = 0) -> bytes:
     return bytes([ESC, 0x74, codepage])
 
 
-def build_receipt_commands(
-    receipt_data: dict,
-    paper_width: int = 48,
-    encoding: str = "cp437",
-    include_logo: bool = False,
-    cut_after: bool = True,
-    open_drawer_after: bool = False,
-    drawer_pin: int = 0,
-) -> bytes:
-    """
-    بناء أوامر ESC/POS لطباعة إيصال POS كامل.
-    
-    Args:
-        receipt_data: بيانات الإيصال من Odoo POS (export_for_printing)
-        paper_width: عرض الورقة بالأحرف (32, 42, 48)
-        encoding: ترميز النص
-        include_logo: هل يتم طباعة الشعار (غير مدعوم حالياً)
-        cut_after: قص الورقة بعد الطباعة
-        open_drawer_after: فتح الدرج بعد الطباعة
-        drawer_pin: منفذ الدرج (0 أو 1)
-    
-    Returns:
-        bytes: أوامر ESC/POS للطباعة
-    """
-    commands = bytearray()
-    
-    # Initialize printer
-    commands.extend(INIT_PRINTER)
-    
-    # Set encoding if needed
-    if encoding == "cp1256":
-        commands.extend(escpos_set_encoding(22))  # Arabic
-    
-    def add_text(text: str, align: bytes = ALIGN_LEFT, bold: bool = False, 
-                 double: bool = False, newline: bool = True):
-        """Helper to add formatted text."""
-        commands.extend(align)
+# ══════════════════════════════════════════════════════════════════════════════
+#  Compiled Receipt Layout
+#  الأقسام الثابتة (رأس الإيصال وتذييله) تُولَّد مرة واحدة وتُخزَّن كـ bytes
+#  حسب (hash المحتوى، عرض الورقة، الترميز). أقسام الطلب فقط تُولَّد لكل إيصال.
+# ══════════════════════════════════════════════════════════════════════════════
+
+# عدد الكتل الثابتة المخزنة قبل حذف الأقدم استخداماً
+LAYOUT_CACHE_SIZE = 64
+
+# حجم الدفعة التقريبي عند بث الإيصال إلى الطابعة
+STREAM_CHUNK_SIZE = 1024
+
+THANK_YOU_LINES = ("Thank you for your purchase!", "شكراً لتسوقكم معنا")
+
+
+class ReceiptWriter:
+    """كاتب أوامر ESC/POS لقسم من الإيصال."""
+
+    __slots__ = ("buf", "paper_width", "encoding")
+
+    def __init__(self, paper_width: int = 48, encoding: str = "cp437"):
+        self.buf = bytearray()
+        self.paper_width = paper_width
+        self.encoding = encoding
+
+    def text(self, text: str, align: bytes = ALIGN_LEFT, bold: bool = False,
+             double: bool = False, newline: bool = True):
+        """إضافة نص منسّق."""
+        buf = self.buf
+        buf.extend(align)
         if bold:
-            commands.extend(BOLD_ON)
+            buf.extend(BOLD_ON)
         if double:
-            commands.extend(DOUBLE_SIZE_ON)
-        commands.extend(escpos_text(text, encoding))
+            buf.extend(DOUBLE_SIZE_ON)
+        buf.extend(escpos_text(text, self.encoding))
         if newline:
-            commands.append(LF)
+            buf.append(LF)
         if double:
-            commands.extend(NORMAL_SIZE)
+            buf.extend(NORMAL_SIZE)
         if bold:
-            commands.extend(BOLD_OFF)
-    
-    def add_line(char: str = "-"):
-        commands.extend(escpos_line(char, paper_width))
-    
-    def format_currency(amount, symbol="", position="after"):
-        """تنسيق المبلغ."""
-        if position == "before":
-            return f"{symbol}{amount:.2f}"
-        return f"{amount:.2f} {symbol}"
-    
-    # ═══════════════════════════════════════════════════════════════════════
-    # Header - معلومات المتجر
-    # ═══════════════════════════════════════════════════════════════════════
-    
+            buf.extend(BOLD_OFF)
+
+    def line(self, char: str = "-"):
+        self.buf.extend(escpos_line(char, self.paper_width))
+
+    def feed(self):
+        self.buf.append(LF)
+
+    def take(self) -> bytearray:
+        """تسليم المحتوى الحالي كدفعة والبدء في buffer جديد (بدون نسخ)."""
+        chunk = self.buf
+        self.buf = bytearray()
+        return chunk
+
+
+class LayoutCache:
+    """تخزين LRU للكتل الثابتة المولّدة مسبقاً (thread-safe)."""
+
+    def __init__(self, maxsize: int = LAYOUT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._blocks: OrderedDict[tuple, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, section: str, content: tuple, paper_width: int, encoding: str,
+            render: Callable[[ReceiptWriter, tuple], None]) -> bytes:
+        digest = hashlib.sha1(repr(content).encode("utf-8")).digest()
+        key = (section, digest, paper_width, encoding)
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                return block
+            self.misses += 1
+
+        writer = ReceiptWriter(paper_width, encoding)
+        render(writer, content)
+        block = bytes(writer.buf)
+        with self._lock:
+            self._blocks[key] = block
+            self._blocks.move_to_end(key)
+            while len(self._blocks) > self.maxsize:
+                self._blocks.popitem(last=False)
+        return block
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"blocks": len(self._blocks), "hits": self.hits, "misses": self.misses}
+
+
+layout_cache = LayoutCache()
+
+
+def _format_currency(amount, symbol="", position="after"):
+    """تنسيق المبلغ."""
+    if position == "before":
+        return f"{symbol}{amount:.2f}"
+    return f"{amount:.2f} {symbol}"
+
+
+def _prelude(encoding: str) -> bytes:
+    """تهيئة الطابعة وتعيين Code Page في بداية كل إيصال."""
+    # Set encoding if needed
+    if encoding == "cp1256":
+        return INIT_PRINTER + escpos_set_encoding(22)  # Arabic
+    return INIT_PRINTER
+
+
+def _logo_block(logo_path: str, paper_width: int) -> bytes:
+    """أوامر الشعار الجاهزة من logo_cache. أي خطأ يُسجَّل ويُطبع الإيصال بدون شعار."""
+    try:
+        return ALIGN_CENTER + logo_cache.get(logo_path, paper_width)
+    except Exception as e:
+        log.warning("Logo skipped (%s): %s", logo_path, e)
+        return b""
+
+
+def _header_content(receipt_data: dict) -> tuple:
+    """استخراج بيانات رأس الإيصال (المتجر) التي نادراً ما تتغير."""
     company = receipt_data.get("company", {})
     header = receipt_data.get("headerData", {})
-    
-    # اسم الشركة
+
     company_name = company.get("name") or header.get("company", {}).get("name", "")
-    if company_name:
-        add_text(company_name, ALIGN_CENTER, bold=True, double=True)
-    
-    # عنوان نقطة البيع
     pos_name = header.get("header", "") or receipt_data.get("pos", {}).get("name", "")
-    if pos_name:
-        add_text(pos_name, ALIGN_CENTER, bold=True)
-    
-    # عنوان الشركة
+
     address_parts = []
     if company.get("street"):
         address_parts.append(company["street"])
@@ -198,100 +340,148 @@ def build_receipt_commands(
         address_parts.append(city_line)
     if company.get("country", {}).get("name"):
         address_parts.append(company["country"]["name"])
-    
+
+    return (
+        company_name,
+        pos_name,
+        tuple(address_parts),
+        company.get("phone") or "",
+        company.get("vat") or "",
+    )
+
+
+def _render_header(w: ReceiptWriter, content: tuple):
+    company_name, pos_name, address_parts, phone, vat = content
+
+    # اسم الشركة
+    if company_name:
+        w.text(company_name, ALIGN_CENTER, bold=True, double=True)
+
+    # عنوان نقطة البيع
+    if pos_name:
+        w.text(pos_name, ALIGN_CENTER, bold=True)
+
+    # عنوان الشركة
     for addr_line in address_parts:
-        add_text(addr_line, ALIGN_CENTER)
-    
+        w.text(addr_line, ALIGN_CENTER)
+
     # معلومات الاتصال
-    if company.get("phone"):
-        add_text(f"Tel: {company['phone']}", ALIGN_CENTER)
-    if company.get("vat"):
-        add_text(f"VAT: {company['vat']}", ALIGN_CENTER)
-    
-    add_line("=")
-    
+    if phone:
+        w.text(f"Tel: {phone}", ALIGN_CENTER)
+    if vat:
+        w.text(f"VAT: {vat}", ALIGN_CENTER)
+
+    w.line("=")
+
+
+def _footer_content(receipt_data: dict) -> tuple:
+    header = receipt_data.get("headerData", {})
+    footer = header.get("footer", "") or receipt_data.get("footer", "")
+    return (footer,) + THANK_YOU_LINES
+
+
+def _render_footer(w: ReceiptWriter, content: tuple):
+    footer, *thank_you = content
+    if footer:
+        w.feed()
+        w.text(footer, ALIGN_CENTER)
+
+    # Thank you message
+    w.feed()
+    for line in thank_you:
+        w.text(line, ALIGN_CENTER)
+
+
+def _render_order(w: ReceiptWriter, receipt_data: dict) -> Iterator[bytearray]:
+    """توليد الأقسام الخاصة بكل طلب كدفعات: معلومات الطلب، الخطوط، المجاميع، المدفوعات."""
+    paper_width = w.paper_width
+    add_text = w.text
+
     # ═══════════════════════════════════════════════════════════════════════
     # Order Info - معلومات الطلب
     # ═══════════════════════════════════════════════════════════════════════
-    
+
     order_name = receipt_data.get("name", "")
     if order_name:
         add_text(f"Order: {order_name}", ALIGN_CENTER, bold=True)
-    
+
     # التاريخ والوقت
     date_str = receipt_data.get("date", {})
     if isinstance(date_str, dict):
         date_str = date_str.get("localestring", "")
     if date_str:
         add_text(f"Date: {date_str}", ALIGN_CENTER)
-    
+
     # الموظف
     employee = receipt_data.get("employee", "")
     if employee:
         add_text(f"Cashier: {employee}", ALIGN_CENTER)
-    
+
     # العميل
     client = receipt_data.get("client")
     if client:
         client_name = client.get("name", "") if isinstance(client, dict) else str(client)
         if client_name:
             add_text(f"Customer: {client_name}", ALIGN_CENTER)
-    
-    add_line("-")
-    
+
+    w.line("-")
+
     # ═══════════════════════════════════════════════════════════════════════
     # Order Lines - خطوط الطلب
     # ═══════════════════════════════════════════════════════════════════════
-    
+
     orderlines = receipt_data.get("orderlines", [])
     currency = receipt_data.get("currency", {})
     currency_symbol = currency.get("symbol", "")
     currency_position = currency.get("position", "after")
-    
+
     for line in orderlines:
         product_name = line.get("product_name", line.get("productName", "Unknown"))
         quantity = line.get("quantity", line.get("qty", 1))
         unit_price = line.get("price", line.get("unit_price", 0))
         price_display = line.get("price_display", "")
         discount = line.get("discount", 0)
-        
+
         # Product name (may wrap)
         if len(product_name) > paper_width - 12:
             add_text(product_name[:paper_width - 3] + "...", ALIGN_LEFT)
         else:
             add_text(product_name, ALIGN_LEFT)
-        
+
         # Quantity x Price = Total (right aligned)
         if price_display:
             line_total = price_display
         else:
             total = line.get("price_display_one", quantity * unit_price)
             if isinstance(total, (int, float)):
-                line_total = format_currency(total, currency_symbol, currency_position)
+                line_total = _format_currency(total, currency_symbol, currency_position)
             else:
                 line_total = str(total)
-        
-        qty_price = f"  {quantity} x {format_currency(unit_price, currency_symbol, currency_position)}"
+
+        qty_price = f"  {quantity} x {_format_currency(unit_price, currency_symbol, currency_position)}"
         spacing = paper_width - len(qty_price) - len(line_total)
         if spacing < 1:
             spacing = 1
         detail_line = qty_price + " " * spacing + line_total
         add_text(detail_line, ALIGN_LEFT)
-        
+
         # Discount if any
         if discount and discount > 0:
             add_text(f"  Discount: {discount}%", ALIGN_LEFT)
-    
-    add_line("-")
-    
+
+        if len(w.buf) >= STREAM_CHUNK_SIZE:
+            yield w.take()
+
+    w.line("-")
+
     # ═══════════════════════════════════════════════════════════════════════
     # Totals - المجاميع
     # ═══════════════════════════════════════════════════════════════════════
-    
+
     def add_total_line(label: str, amount, bold: bool = False, double: bool = False):
         """Add a total line with label and amount."""
         if isinstance(amount, (int, float)):
-            amount_str = format_currency(amount, currency_symbol, currency_position)
+            amount_str = _format_currency(amount, currency_symbol, currency_position)
         else:
             amount_str = str(amount)
         spacing = paper_width - len(label) - len(amount_str)
@@ -299,40 +489,40 @@ def build_receipt_commands(
             spacing = 1
         total_line = label + " " * spacing + amount_str
         add_text(total_line, ALIGN_LEFT, bold=bold, double=double)
-    
+
     # Subtotal
     subtotal = receipt_data.get("subtotal", receipt_data.get("total_without_tax", 0))
     if subtotal:
         add_total_line("Subtotal:", subtotal)
-    
+
     # Taxes
     tax_details = receipt_data.get("tax_details", [])
     for tax in tax_details:
         tax_name = tax.get("name", "Tax")
         tax_amount = tax.get("amount", 0)
         add_total_line(f"  {tax_name}:", tax_amount)
-    
+
     total_tax = receipt_data.get("total_tax", 0)
     if total_tax and not tax_details:
         add_total_line("Tax:", total_tax)
-    
+
     # Discount total
     total_discount = receipt_data.get("total_discount", 0)
     if total_discount and total_discount > 0:
         add_total_line("Discount:", -total_discount)
-    
-    add_line("=")
-    
+
+    w.line("=")
+
     # Grand Total
     total = receipt_data.get("total_with_tax", receipt_data.get("amount_total", 0))
     add_total_line("TOTAL:", total, bold=True, double=True)
-    
-    add_line("=")
-    
+
+    w.line("=")
+
     # ═══════════════════════════════════════════════════════════════════════
     # Payments - المدفوعات
     # ═══════════════════════════════════════════════════════════════════════
-    
+
     paymentlines = receipt_data.get("paymentlines", [])
     if paymentlines:
         add_text("PAYMENT:", ALIGN_LEFT, bold=True)
@@ -340,44 +530,99 @@ def build_receipt_commands(
             pm_name = payment.get("name", payment.get("journal", "Payment"))
             pm_amount = payment.get("amount", 0)
             add_total_line(f"  {pm_name}:", pm_amount)
-    
+
     # Change
     change = receipt_data.get("change", 0)
     if change and change > 0:
         add_total_line("CHANGE:", change, bold=True)
-    
-    add_line("-")
-    
-    # ═══════════════════════════════════════════════════════════════════════
-    # Footer - تذييل
-    # ═══════════════════════════════════════════════════════════════════════
-    
-    footer = header.get("footer", "") or receipt_data.get("footer", "")
-    if footer:
-        commands.append(LF)
-        add_text(footer, ALIGN_CENTER)
-    
-    # Thank you message
-    commands.append(LF)
-    add_text("Thank you for your purchase!", ALIGN_CENTER)
-    add_text("شكراً لتسوقكم معنا", ALIGN_CENTER)
-    
+
+    w.line("-")
+    yield w.take()
+
+
+def iter_receipt_commands(
+    receipt_data: dict,
+    paper_width: int = 48,
+    encoding: str = "cp437",
+    include_logo: bool = False,
+    cut_after: bool = True,
+    open_drawer_after: bool = False,
+    drawer_pin: int = 0,
+    logo_path: str = "",
+) -> Iterator[bytes]:
+    """
+    توليد أوامر ESC/POS للإيصال كدفعات متتالية حتى تبدأ الطابعة قبل انتهاء التوليد.
+    رأس الإيصال وتذييله يُؤخذان من layout_cache، وأقسام الطلب تُولَّد لكل طلب.
+    نفس معاملات build_receipt_commands.
+    """
+    yield _prelude(encoding)
+
+    # Logo (GS v 0 raster, pre-rendered per image and paper width)
+    if include_logo and logo_path:
+        yield _logo_block(logo_path, paper_width)
+
+    yield layout_cache.get(
+        "header", _header_content(receipt_data), paper_width, encoding, _render_header,
+    )
+
+    yield from _render_order(ReceiptWriter(paper_width, encoding), receipt_data)
+
+    yield layout_cache.get(
+        "footer", _footer_content(receipt_data), paper_width, encoding, _render_footer,
+    )
+
     # ═══════════════════════════════════════════════════════════════════════
     # Final operations
     # ═══════════════════════════════════════════════════════════════════════
-    
+
     # Feed paper
-    commands.extend(escpos_feed(4))
-    
+    yield escpos_feed(4)
+
     # Cut paper
     if cut_after:
-        commands.extend(escpos_cut(partial=True))
-    
+        yield escpos_cut(partial=True)
+
     # Open drawer
     if open_drawer_after:
-        commands.extend(escpos_open_drawer(drawer_pin))
+        yield escpos_open_drawer(drawer_pin)
+
+
+def build_receipt_commands(
+    receipt_data: dict,
+    paper_width: int = 48,
+    encoding: str = "cp437",
+    include_logo: bool = False,
+    cut_after: bool = True,
+    open_drawer_after: bool = False,
+    drawer_pin: int = 0,
+    logo_path: str = "",
+) -> bytes:
+    """
+    بناء أوامر ESC/POS لطباعة إيصال POS كامل.
     
-    return bytes(commands)
+    Args:
+        receipt_data: بيانات الإيصال من Odoo POS (export_for_printing)
+        paper_width: عرض الورقة بالأحرف (32, 42, 48)
+        encoding: ترميز النص
+        include_logo: هل يتم طباعة الشعار (يتطلب logo_path)
+        cut_after: قص الورقة بعد الطباعة
+        open_drawer_after: فتح الدرج بعد الطباعة
+        drawer_pin: منفذ الدرج (0 أو 1)
+        logo_path: مسار صورة الشعار (PNG/JPG/BMP)
+    
+    Returns:
+        bytes: أوامر ESC/POS للطباعة
+    """
+    return b"".join(iter_receipt_commands(
+        receipt_data,
+        paper_width=paper_width,
+        encoding=encoding,
+        include_logo=include_logo,
+        cut_after=cut_after,
+        open_drawer_after=open_drawer_after,
+        drawer_pin=drawer_pin,
+        logo_path=logo_path,
+    ))
 
 
 def print_receipt(
@@ -388,6 +633,7 @@ def print_receipt(
     cut_after: bool = True,
     open_drawer: bool = False,
     drawer_pin: int = 0,
+    logo_path: str = "",
 ):
     """
     طباعة إيصال POS كامل.
@@ -400,33 +646,165 @@ def print_receipt(
         cut_after: قص الورقة
         open_drawer: فتح الدرج بعد الطباعة
         drawer_pin: منفذ الدرج
+        logo_path: مسار صورة الشعار (فارغ = بدون شعار)
+
+    Returns:
+        رقم المهمة في الـ spool إذا تأجلت الطباعة، أو None إذا طُبعت مباشرة
     """
     log.info("Printing receipt to '%s' (width=%d, encoding=%s)", printer_name, paper_width, encoding)
     
     try:
-        commands = build_receipt_commands(
+        chunks = iter_receipt_commands(
             receipt_data=receipt_data,
             paper_width=paper_width,
             encoding=encoding,
             cut_after=cut_after,
             open_drawer_after=open_drawer,
             drawer_pin=drawer_pin,
+            include_logo=bool(logo_path),
+            logo_path=logo_path,
         )
         
-        send_raw(printer_name, commands, job_name="POS Receipt")
-        log.info("Receipt printed successfully (%d bytes)", len(commands))
-        return True
+        # Chunks are written as they are rendered: no full-receipt buffer
+        spool_id = send_or_spool(printer_name, chunks, job_name="POS Receipt")
+        if spool_id is None:
+            log.info("Receipt printed successfully")
+        return spool_id
         
     except Exception as e:
         log.error("Receipt printing failed: %s", e)
         raise
 
 
+def iter_ticket_commands(
+    ticket_data: dict,
+    station: str = "",
+    paper_width: int = 48,
+    encoding: str = "cp437",
+    cut_after: bool = True,
+) -> Iterator[bytes]:
+    """
+    توليد تذكرة تحضير لمحطة (مطبخ / بار): رقم الطلب والأصناف بالكميات والملاحظات، بدون أسعار.
+    ticket_data بنفس صيغة بيانات الإيصال، ويحتوي فقط على خطوط هذه المحطة.
+    """
+    yield _prelude(encoding)
+    w = ReceiptWriter(paper_width, encoding)
+
+    if station:
+        w.text(station.upper(), ALIGN_CENTER, bold=True, double=True)
+    order_name = ticket_data.get("name", "")
+    if order_name:
+        w.text(f"Order: {order_name}", ALIGN_CENTER, bold=True)
+    table = ticket_data.get("table", "")
+    if isinstance(table, dict):
+        table = table.get("name", "")
+    if table:
+        w.text(f"Table: {table}", ALIGN_CENTER, bold=True, double=True)
+    date_str = ticket_data.get("date", {})
+    if isinstance(date_str, dict):
+        date_str = date_str.get("localestring", "")
+    if date_str:
+        w.text(date_str, ALIGN_CENTER)
+    w.line("=")
+
+    for line in ticket_data.get("orderlines", []):
+        product_name = line.get("product_name", line.get("productName", "Unknown"))
+        quantity = line.get("quantity", line.get("qty", 1))
+        w.text(f"{quantity:g} x {product_name}" if isinstance(quantity, (int, float))
+               else f"{quantity} x {product_name}", ALIGN_LEFT, bold=True)
+        note = line.get("note") or line.get("customer_note") or ""
+        if note:
+            w.text(f"   * {note}", ALIGN_LEFT)
+
+    w.line("=")
+    if cut_after:
+        w.buf.extend(escpos_feed(3) + escpos_cut(partial=True))
+    yield w.take()
+
+
+def print_ticket(
+    printer_name: str,
+    ticket_data: dict,
+    station: str = "",
+    paper_width: int = 48,
+    encoding: str = "cp437",
+    cut_after: bool = True,
+):
+    """
+    طباعة تذكرة تحضير على طابعة محطة (مطبخ / بار).
+
+    Returns:
+        رقم المهمة في الـ spool إذا تأجلت الطباعة، أو None إذا طُبعت مباشرة
+    """
+    log.info("Printing %s ticket to '%s'", station or "station", printer_name)
+    chunks = iter_ticket_commands(
+        ticket_data, station=station, paper_width=paper_width,
+        encoding=encoding, cut_after=cut_after,
+    )
+    return send_or_spool(printer_name, chunks, job_name=f"{station or 'Station'} Ticket")
+
+
+def decode_raw_data(raw_data: str, data_format: str = "auto", encoding: str = "utf-8") -> bytes:
+    """
+    تحويل البيانات الخام القادمة كنص إلى bytes.
+
+    data_format:
+        "base64" البيانات مرمّزة base64 (خطأ إذا لم تكن صالحة)
+        "text"   نص عادي يُرمَّز بـ encoding
+        "auto"   السلوك القديم: base64 إن أمكن وإلا نص (للتوافق فقط)
+    """
+    if data_format == "text":
+        return raw_data.encode(encoding, errors="replace")
+    if data_format == "base64":
+        try:
+            return base64.b64decode(raw_data, validate=True)
+        except ValueError as e:
+            raise ValueError(f"Invalid base64 data: {e}")
+    if data_format != "auto":
+        raise ValueError(f"Unknown data format: {data_format}")
+    # Legacy guess: plain text that happens to be valid base64 is decoded
+    try:
+        return base64.b64decode(raw_data)
+    except Exception:
+        # Not base64, treat as text
+        return raw_data.encode(encoding, errors="replace")
+
+
+def print_raw_bytes(
+    printer_name: str,
+    data: bytes | memoryview,
+    cut_after: bool = True,
+    job_name: str = "Raw Receipt",
+):
+    """
+    طباعة أوامر ESC/POS جاهزة كما هي (بدون فك ترميز أو نسخ).
+    
+    Args:
+        printer_name: اسم الطابعة
+        data: البيانات (bytes أو memoryview على إطار WebSocket ثنائي)
+        cut_after: قص الورقة
+        job_name: اسم المهمة في spooler
+
+    Returns:
+        رقم المهمة في الـ spool إذا تأجلت الطباعة، أو None إذا طُبعت مباشرة
+    """
+    # Add cut command if needed (sent as a second chunk instead of concatenating)
+    chunks = [data]
+    if cut_after:
+        chunks.append(escpos_feed(3) + escpos_cut(partial=True))
+    
+    spool_id = send_or_spool(printer_name, chunks, job_name=job_name)
+    if spool_id is None:
+        log.info("Raw receipt printed successfully (%d bytes)", len(data))
+    return spool_id
+
+
 def print_raw_receipt(
     printer_name: str,
     raw_data: str,
     encoding: str = "utf-8",
     cut_after: bool = True,
+    data_format: str = "auto",
 ):
     """
     طباعة بيانات خام (نص عادي أو base64).
@@ -436,25 +814,21 @@ def print_raw_receipt(
         raw_data: البيانات (نص عادي أو base64)
         encoding: ترميز النص
         cut_after: قص الورقة
+        data_format: "base64" أو "text" أو "auto" (انظر decode_raw_data)
+
+    Returns:
+        رقم المهمة في الـ spool إذا تأجلت الطباعة، أو None إذا طُبعت مباشرة
     """
     log.info("Printing raw data to '%s'", printer_name)
     
     try:
-        # Check if base64 encoded
-        try:
-            data = base64.b64decode(raw_data)
-        except Exception:
-            # Not base64, treat as text
-            data = raw_data.encode(encoding, errors="replace")
-        
-        # Add cut command if needed
-        if cut_after:
-            data += escpos_feed(3) + escpos_cut(partial=True)
-        
-        send_raw(printer_name, data, job_name="Raw Receipt")
-        log.info("Raw receipt printed successfully (%d bytes)", len(data))
-        return True
+        data = decode_raw_data(raw_data, data_format, encoding)
+        return print_raw_bytes(printer_name, data, cut_after=cut_after)
         
     except Exception as e:
         log.error("Raw receipt printing failed: %s", e)
         raise
+
+
+# Jobs of these functions are journaled on admission and resubmitted after a crash
+durable_spool.register(print_receipt, print_ticket, print_raw_receipt, print_raw_bytes)
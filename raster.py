@@ -0,0 +1,148 @@
+# raster.py
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from config import APP_DIR
+from logger import get_logger
+
+log = get_logger("raster")
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:  # optional: logo printing is disabled without them
+    np = None
+    Image = None
+
+CACHE_DIR = APP_DIR / "cache"
+
+# عرض منطقة الطباعة بالنقاط حسب عرض الورقة بالأحرف (203 dpi)
+PAPER_DOTS = {32: 384, 42: 512, 48: 576}
+
+# أقصى ارتفاع لكل أمر GS v 0 (بعض الطابعات ترفض الصور الأطول)
+MAX_BAND_HEIGHT = 960
+
+# عدد الشعارات المخزنة في الذاكرة
+MEMORY_CACHE_SIZE = 8
+
+GS = 0x1D
+
+# Bayer 8x8 threshold map, scaled to 0..255: ordered dithering is a pure
+# element-wise comparison, so the whole image is dithered in one NumPy op.
+_BAYER_8 = (
+    (0, 32, 8, 40, 2, 34, 10, 42),
+    (48, 16, 56, 24, 50, 18, 58, 26),
+    (12, 44, 4, 36, 14, 46, 6, 38),
+    (60, 28, 52, 20, 62, 30, 54, 22),
+    (3, 35, 11, 43, 1, 33, 9, 41),
+    (51, 19, 59, 27, 49, 17, 57, 25),
+    (15, 47, 7, 39, 13, 45, 5, 37),
+    (63, 31, 55, 23, 61, 29, 53, 21),
+)
+
+
+def paper_dots(paper_width: int) -> int:
+    """عرض منطقة الطباعة بالنقاط لعرض ورقة معيّن (بالأحرف)."""
+    return PAPER_DOTS.get(paper_width, paper_width * 12)
+
+
+def _rasterize(path: str, max_width: int) -> bytes:
+    """تحجيم الصورة وتحويلها إلى أبيض/أسود وتجميعها كأوامر GS v 0."""
+    if np is None:
+        raise RuntimeError("Logo printing requires numpy and Pillow")
+
+    with Image.open(path) as img:
+        img.load()
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGBA", img.size, (255, 255, 255, 255))
+            img = Image.alpha_composite(background, img)
+        img = img.convert("L")
+        if img.width > max_width:
+            height = max(1, round(img.height * max_width / img.width))
+            img = img.resize((max_width, height), Image.LANCZOS)
+        gray = np.asarray(img, dtype=np.uint8)
+
+    height, width = gray.shape
+    # Pad to a whole number of bytes per row with white
+    padded_width = (width + 7) // 8 * 8
+    if padded_width != width:
+        gray = np.pad(gray, ((0, 0), (0, padded_width - width)), constant_values=255)
+
+    bayer = (np.array(_BAYER_8, dtype=np.uint16) * 4 + 2).astype(np.uint8)
+    thresholds = np.tile(bayer, (height // 8 + 1, padded_width // 8))[:height, :padded_width]
+    dots = gray < thresholds  # True = black dot
+    packed = np.packbits(dots, axis=1)
+
+    row_bytes = padded_width // 8
+    out = bytearray()
+    for top in range(0, height, MAX_BAND_HEIGHT):
+        band = packed[top:top + MAX_BAND_HEIGHT]
+        rows = band.shape[0]
+        # GS v 0 m xL xH yL yH d1...dk
+        out.extend((GS, 0x76, 0x30, 0x00,
+                    row_bytes & 0xFF, row_bytes >> 8, rows & 0xFF, rows >> 8))
+        out.extend(band.tobytes())
+    return bytes(out)
+
+
+class LogoCache:
+    """
+    تخزين أوامر الشعار الجاهزة حسب (hash الصورة، عرض الورقة) في الذاكرة وعلى القرص،
+    حتى تكون تكلفة كل إيصال مجرد إضافة bytes جاهزة.
+    """
+
+    def __init__(self, cache_dir: Path = CACHE_DIR, maxsize: int = MEMORY_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.maxsize = maxsize
+        self._raster: OrderedDict[tuple[str, int], bytes] = OrderedDict()
+        # (path, mtime_ns, size) -> content hash, so unchanged files are not re-read
+        self._hashes: dict[tuple[str, int, int], str] = {}
+        self._lock = threading.Lock()
+
+    def _image_hash(self, path: str) -> str:
+        st = os.stat(path)
+        stat_key = (path, st.st_mtime_ns, st.st_size)
+        digest = self._hashes.get(stat_key)
+        if digest is None:
+            digest = hashlib.sha1(Path(path).read_bytes()).hexdigest()
+            with self._lock:
+                self._hashes = {k: v for k, v in self._hashes.items() if k[0] != path}
+                self._hashes[stat_key] = digest
+        return digest
+
+    def get(self, path: str, paper_width: int) -> bytes:
+        """إرجاع أوامر GS v 0 للشعار (من الذاكرة أو القرص أو بتوليدها)."""
+        dots = paper_dots(paper_width)
+        key = (self._image_hash(path), dots)
+        with self._lock:
+            raster = self._raster.get(key)
+            if raster is not None:
+                self._raster.move_to_end(key)
+                return raster
+
+        disk_path = self.cache_dir / f"logo_{key[0][:16]}_{dots}.bin"
+        try:
+            raster = disk_path.read_bytes()
+        except OSError:
+            raster = _rasterize(path, dots)
+            log.info("Logo rasterized: %s (%d dots, %d bytes)", path, dots, len(raster))
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                tmp = disk_path.with_suffix(".tmp")
+                tmp.write_bytes(raster)
+                os.replace(tmp, disk_path)
+            except OSError as e:
+                log.warning("Could not write logo cache %s: %s", disk_path, e)
+
+        with self._lock:
+            self._raster[key] = raster
+            while len(self._raster) > self.maxsize:
+                self._raster.popitem(last=False)
+        return raster
+
+
+# ── Singleton ──
+logo_cache = LogoCache()
@@ -0,0 +1,157 @@
+# routing.py
+import asyncio
+from concurrent.futures import Future, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable
+from config import AgentConfig
+from logger import get_logger
+from printer_raw import print_receipt, print_ticket
+from spooler import print_spooler, JOB_TIMEOUT
+
+log = get_logger("routing")
+
+# اسم الطابعة الرئيسية (printer_name) في قواعد التوجيه
+RECEIPT_TARGET = "receipt"
+
+# الحقول المحتملة لفئة المنتج في خطوط الطلب القادمة من Odoo POS
+CATEGORY_KEYS = ("pos_categ", "pos_categ_id", "category", "product_category", "categ_id")
+
+
+def resolve_printer(cfg: AgentConfig, target: str | None = None) -> str:
+    """تحويل هدف الأمر ("receipt" / "kitchen" / ...) إلى اسم الطابعة الفعلي."""
+    if not target or target == RECEIPT_TARGET:
+        return cfg.printer_name
+    try:
+        return cfg.printers[target]
+    except KeyError:
+        raise ValueError(f"Unknown printer target: {target}")
+
+
+def configured_printers(cfg: AgentConfig) -> set[str]:
+    """كل أسماء الطابعات المضبوطة (الرئيسية + المحطات)."""
+    return {name for name in (cfg.printer_name, *cfg.printers.values()) if name}
+
+
+def line_category(line: dict) -> str:
+    """فئة المنتج لخط طلب (تقبل الاسم، أو [id, name] من Odoo، أو {"name": ...})."""
+    for key in CATEGORY_KEYS:
+        value = line.get(key)
+        if isinstance(value, (list, tuple)):
+            value = value[-1] if value else ""
+        elif isinstance(value, dict):
+            value = value.get("name", "")
+        if value:
+            return str(value).strip().lower()
+    return ""
+
+
+def route_order_lines(cfg: AgentConfig, receipt_data: dict) -> dict[str, list[dict]]:
+    """تقسيم خطوط الطلب على المحطات حسب category_routes. الأصناف بدون قاعدة لا تُرسل لأي محطة."""
+    routes = {category.strip().lower(): target for category, target in cfg.category_routes.items()}
+    tickets: dict[str, list[dict]] = {}
+    for line in receipt_data.get("orderlines", []):
+        target = routes.get(line_category(line))
+        if target:
+            tickets.setdefault(target, []).append(line)
+    return tickets
+
+
+@dataclass
+class RoutedJob:
+    """مهمة طباعة موجهة إلى طابعة واحدة ضمن أمر موزّع على عدة طابعات."""
+    target: str
+    printer_name: str
+    action: str
+    func: Callable[..., Any]
+    kwargs: dict = field(default_factory=dict)
+
+
+def _submit(job: RoutedJob) -> Future:
+    try:
+        return print_spooler.submit(job.printer_name, job.action, job.func, **job.kwargs)
+    except Exception as e:
+        future = Future()
+        future.set_exception(e)
+        return future
+
+
+def _result(job: RoutedJob, future: Future) -> dict:
+    result = {"printer": job.printer_name, **print_spooler.load(job.printer_name)}
+    if not future.done():
+        return {**result, "ok": False, "error": f"{job.action} timed out after {JOB_TIMEOUT:.0f}s"}
+    error = future.exception()
+    if error is not None:
+        log.error("%s on '%s' (%s) failed: %s", job.action, job.target, job.printer_name, error)
+        return {**result, "ok": False, "error": str(error)}
+    spool_id = future.result()
+    if spool_id:
+        return {**result, "ok": True, "spooled": True, "spool_id": spool_id}
+    return {**result, "ok": True}
+
+
+def fan_out(jobs: list[RoutedJob]) -> dict[str, dict]:
+    """
+    تنفيذ المهام على طابعاتها بالتوازي (لكل طابعة عاملها الخاص) وانتظارها جميعاً،
+    فيستغرق الطلب زمن أبطأ طابعة بدل مجموع الأزمنة. يرجع النتيجة لكل هدف.
+    """
+    futures = [_submit(job) for job in jobs]
+    wait(futures, timeout=JOB_TIMEOUT)
+    return {job.target: _result(job, f) for job, f in zip(jobs, futures)}
+
+
+async def fan_out_async(jobs: list[RoutedJob]) -> dict[str, dict]:
+    """نفس fan_out من داخل event loop دون حجبه."""
+    futures = [_submit(job) for job in jobs]
+    await asyncio.wait(
+        [asyncio.wrap_future(f) for f in futures], timeout=JOB_TIMEOUT,
+    )
+    return {job.target: _result(job, f) for job, f in zip(jobs, futures)}
+
+
+def order_jobs(
+    cfg: AgentConfig,
+    receipt_data: dict,
+    include_receipt: bool = True,
+    paper_width: int = 48,
+    encoding: str = "cp437",
+    cut_after: bool = True,
+    open_drawer: bool = False,
+    include_logo: bool = True,
+) -> list[RoutedJob]:
+    """مهام طلب كامل: الإيصال على الطابعة الرئيسية + تذكرة لكل محطة حسب فئات الأصناف."""
+    jobs = []
+    if include_receipt:
+        jobs.append(RoutedJob(
+            target=RECEIPT_TARGET,
+            printer_name=cfg.printer_name,
+            action="PRINT_RECEIPT",
+            func=print_receipt,
+            kwargs=dict(
+                printer_name=cfg.printer_name,
+                receipt_data=receipt_data,
+                paper_width=paper_width,
+                encoding=encoding,
+                cut_after=cut_after,
+                open_drawer=open_drawer,
+                drawer_pin=cfg.drawer_pin,
+                logo_path=cfg.logo_path if include_logo else "",
+            ),
+        ))
+    for target, lines in route_order_lines(cfg, receipt_data).items():
+        printer_name = resolve_printer(cfg, target)
+        jobs.append(RoutedJob(
+            # A ticket routed to the main printer must not overwrite the receipt's result
+            target=f"{target}_ticket" if target == RECEIPT_TARGET and include_receipt else target,
+            printer_name=printer_name,
+            action="PRINT_TICKET",
+            func=print_ticket,
+            kwargs=dict(
+                printer_name=printer_name,
+                ticket_data={**receipt_data, "orderlines": lines},
+                station=target,
+                paper_width=paper_width,
+                encoding=encoding,
+                cut_after=cut_after,
+            ),
+        ))
+    return jobs
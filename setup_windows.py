@@ -33,8 +33,18 @@ build_exe_options = {
         "logger",
         "state",
         "dashboard",
+        "log_search",
+        "history_store",
+        "throughput",
+        "routing",
+        "breaker",
+        "spool_store",
+        "idempotency",
+        "raster",
+        "spooler",
+        "transports",
     ],
-    "excludes": ["tkinter", "matplotlib", "numpy", "pandas"],
+    "excludes": ["tkinter", "matplotlib", "pandas"],
     "include_files": [],
     "optimize": 2,
 }
@@ -0,0 +1,534 @@
+# spool_store.py
+import base64
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable
+from breaker import printer_breakers, CLOSED
+from config import APP_DIR
+from logger import get_logger
+from spooler import print_spooler, PrintJob, SpoolerFullError
+from state import app_state
+from transports import transport_pool
+
+log = get_logger("spool_store")
+
+SPOOL_PATH = APP_DIR / "spool.jsonl"
+
+# إعادة المحاولة: تأخير أُسّي لكل طابعة (ثوانٍ)
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 60.0
+
+# إعادة كتابة السجل بالمهام المعلقة فقط عند تجاوز هذا الحجم
+COMPACT_BYTES = 1024 * 1024
+
+# رقم المهمة في السجل للمهمة الجارية (يُضبط في سياقها عند قبولها في قائمة الطابعة)
+_admission: contextvars.ContextVar[str | None] = contextvars.ContextVar("spool_admission", default=None)
+
+
+@dataclass
+class SpoolJob:
+    id: str
+    printer_name: str
+    job_name: str
+    data: bytes
+    created_at: float
+    attempts: int = 0
+    last_error: str = ""
+    # جزء من المهمة وصل للطابعة قبل الفشل: الإعادة تطبع نسخة ثانية من هذا الجزء
+    partial: bool = False
+    # مهمة مقبولة لم تنتهِ بعد: الدالة ومعاملاتها لإعادة تقديمها بعد توقف مفاجئ
+    action: str = ""
+    func: str = ""
+    kwargs: dict | None = None
+
+    def record(self) -> dict:
+        if self.kwargs is not None:
+            return {
+                "op": "admit",
+                "id": self.id,
+                "printer": self.printer_name,
+                "ts": self.created_at,
+                "action": self.action,
+                "func": self.func,
+                "kwargs": {key: _encode_arg(value) for key, value in self.kwargs.items()},
+            }
+        return {
+            "op": "add",
+            "id": self.id,
+            "printer": self.printer_name,
+            "job": self.job_name,
+            "ts": self.created_at,
+            "attempts": self.attempts,
+            "partial": self.partial,
+            "data": base64.b64encode(self.data).decode("ascii"),
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "printer_name": self.printer_name,
+            "job_name": self.job_name,
+            "bytes": len(self.data),
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.created_at)),
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "partial": self.partial,
+        }
+
+
+class DurableSpool:
+    """
+    قائمة انتظار على القرص للمهام التي فشل إرسالها (ورق منتهٍ، طابعة مطفأة...).
+
+    السجل append-only بصيغة JSON lines. كل مهمة طباعة مسجلة (register) تُكتب فيه
+    عند قبولها في قائمة الطابعة ("admit": الدالة ومعاملاتها) وتُعلَّم "done" عند
+    انتهائها، فالمهام التي كانت تنتظر في الذاكرة تُعاد بعد توقف مفاجئ. إذا فشل
+    إرسالها تُحفظ أوامر ESC/POS الجاهزة ("add")، فلا يُعاد توليد الإيصال عند إعادة
+    المحاولة. السجلات تُضاف لقائمة في الذاكرة بدون ترميز، وخيط fsync واحد يرمّزها
+    ويكتبها ويثبّتها معاً، فلا ينتظر القرصَ خيطُ الطابعة ولا event loop المستدعي.
+    المهام تُعاد لكل طابعة بالترتيب مع تأخير أُسّي، وتبقى بعد إعادة التشغيل.
+    """
+
+    def __init__(self, path=SPOOL_PATH):
+        self.path = path
+        # Insertion order is FIFO order per printer
+        self._jobs: dict[str, SpoolJob] = {}
+        # Admitted jobs still on a printer's in-memory queue (not retried from here)
+        self._admitted: dict[str, SpoolJob] = {}
+        # name -> job function whose jobs are journaled on admission (see register)
+        self._functions: dict[str, Callable[..., Any]] = {}
+        # printer -> monotonic time of the next attempt
+        self._next_retry: dict[str, float] = {}
+        # printers with a retry currently on their print queue
+        self._busy: set[str] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._dirty = threading.Condition(self._lock)
+        self._synced = threading.Condition(self._lock)
+        # Records not yet written: encoded and appended by the fsync thread, its only writer
+        self._pending: deque[SpoolJob | dict] = deque()
+        self._listeners: list[Callable[[], None]] = []
+        self._fh = None
+        self._written = 0
+        self._flushed = 0
+        self._started = False
+
+        # Stats
+        self.jobs_spooled: int = 0
+        self.jobs_recovered: int = 0
+        self.jobs_printed: int = 0
+        self.jobs_dropped: int = 0
+        self.fsyncs: int = 0
+
+    # ── Lifecycle ──
+
+    def start(self):
+        """تحميل المهام المعلقة من القرص وتشغيل خيوط fsync وإعادة المحاولة."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._load()
+            now = time.monotonic()
+            for job in self._jobs.values():
+                self._next_retry.setdefault(job.printer_name, now)
+            interrupted = list(self._admitted.values())
+        self._compact()
+        printer_breakers.subscribe(self._on_breaker_change)
+        print_spooler.subscribe(self._on_admit)
+        threading.Thread(target=self._flush_loop, name="spool-fsync", daemon=True).start()
+        threading.Thread(target=self._retry_loop, name="spool-retry", daemon=True).start()
+        for job in interrupted:
+            self._resubmit(job)
+
+    def subscribe(self, listener: Callable[[], None]):
+        """تسجيل دالة تُستدعى كلما تغيّر عدد المهام المعلقة (إضافة، طباعة، حذف)."""
+        self._listeners.append(listener)
+
+    def _changed(self):
+        """إبلاغ المشتركين (يُستدعى بعد تحرير _lock)."""
+        for listener in list(self._listeners):
+            try:
+                listener()
+            except Exception as e:
+                log.error("Spool listener failed: %s", e)
+
+    def register(self, *funcs: Callable[..., Any]):
+        """
+        دوال الطباعة التي تُكتب مهامها في السجل عند قبولها وتُعاد بعد توقف مفاجئ.
+        معاملاتها يجب أن تكون keyword و JSON (أو bytes).
+        """
+        for func in funcs:
+            self._functions[func.__name__] = func
+
+    def _load(self):
+        try:
+            fh = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with fh:
+            for lineno, line in enumerate(fh, 1):
+                try:
+                    rec = json.loads(line)
+                    op, job_id = rec["op"], rec["id"]
+                    if op == "admit":
+                        self._admitted[job_id] = SpoolJob(
+                            id=job_id,
+                            printer_name=rec["printer"],
+                            job_name=rec["action"],
+                            data=b"",
+                            created_at=rec["ts"],
+                            action=rec["action"],
+                            func=rec["func"],
+                            kwargs={key: _decode_arg(value) for key, value in rec["kwargs"].items()},
+                        )
+                    elif op == "add":
+                        self._admitted.pop(job_id, None)
+                        self._jobs[job_id] = SpoolJob(
+                            id=job_id,
+                            printer_name=rec["printer"],
+                            job_name=rec["job"],
+                            data=base64.b64decode(rec["data"]),
+                            created_at=rec["ts"],
+                            attempts=rec.get("attempts", 0),
+                            partial=rec.get("partial", False),
+                        )
+                    elif op == "retry" and job_id in self._jobs:
+                        self._jobs[job_id].attempts = rec["attempts"]
+                        self._jobs[job_id].last_error = rec.get("error", "")
+                    elif op in ("done", "drop"):
+                        self._jobs.pop(job_id, None)
+                        self._admitted.pop(job_id, None)
+                except (ValueError, KeyError, TypeError) as e:
+                    # A torn last line from a crash mid-append is expected
+                    log.warning("Skipping corrupt spool record at line %d: %s", lineno, e)
+        if self._jobs or self._admitted:
+            self.jobs_recovered = len(self._jobs) + len(self._admitted)
+            log.warning("Recovered %d unprinted job(s) from %s (%d never started)",
+                        self.jobs_recovered, self.path, len(self._admitted))
+
+    def _compact(self):
+        """إعادة كتابة السجل بالمهام المعلقة فقط (في خيط fsync، أو قبل تشغيله)."""
+        with self._lock:
+            jobs = [*self._admitted.values(), *self._jobs.values()]
+            # The snapshot already holds the effect of every record not yet written
+            self._pending.clear()
+            target = self._written
+        if self._fh is not None:
+            self._fh.close()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "wb") as fh:
+            fh.write(b"".join(filter(None, map(self._encode_record, jobs))))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self.path)
+        self._fh = open(self.path, "ab", buffering=0)
+        with self._lock:
+            self._flushed = max(self._flushed, target)
+            self._synced.notify_all()
+
+    # ── Journal ──
+
+    def _append(self, record: SpoolJob | dict) -> int:
+        """إضافة سجل لقائمة الكتابة (يُستدعى مع _lock، بدون ترميز). يرجع رقمه التسلسلي."""
+        self._pending.append(record)
+        self._written += 1
+        self._dirty.notify()
+        return self._written
+
+    def _encode_record(self, record: SpoolJob | dict) -> bytes | None:
+        if isinstance(record, dict):
+            return _encode(record)
+        try:
+            return _encode(record.record())
+        except (TypeError, ValueError) as e:
+            # Arguments that are not JSON: the job still prints, it just is not replayed
+            log.debug("%s for '%s' not journaled: %s", record.action, record.printer_name, e)
+            with self._lock:
+                if self._admitted.get(record.id) is record:
+                    del self._admitted[record.id]
+            return None
+
+    def _flush(self):
+        """ترميز السجلات المنتظرة وكتابتها بـ write واحد ثم fsync واحد (في خيط fsync)."""
+        with self._lock:
+            records = list(self._pending)
+            self._pending.clear()
+            target = self._written
+        if records:
+            try:
+                self._fh.write(b"".join(filter(None, map(self._encode_record, records))))
+                os.fsync(self._fh.fileno())
+            except OSError as e:
+                log.error("Spool journal write failed: %s", e)
+        with self._lock:
+            self._flushed = max(self._flushed, target)
+            self.fsyncs += 1
+            self._synced.notify_all()
+        # Compaction fsyncs too: done here, never on a printer's worker thread
+        if self._fh.tell() > COMPACT_BYTES:
+            self._compact()
+            log.info("Spool journal compacted (%d pending jobs, %d queued)",
+                     len(self._jobs), len(self._admitted))
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                while self._flushed >= self._written:
+                    self._dirty.wait()
+            self._flush()
+
+    # ── Admission ──
+
+    def _on_admit(self, printer_name: str, job: PrintJob):
+        """
+        تسجيل مهمة طباعة مسجلة قبل دخولها قائمة الطابعة. تُستدعى في خيط المستدعي
+        (غالباً event loop)، فلا ترميز ولا نسخ للبيانات هنا: خيط fsync يكتبها.
+        """
+        name = getattr(job.func, "__name__", "")
+        if job.args or self._functions.get(name) is not job.func:
+            return
+        entry = SpoolJob(
+            id=uuid.uuid4().hex[:12],
+            printer_name=printer_name,
+            job_name=job.action,
+            data=b"",
+            created_at=time.time(),
+            action=job.action,
+            func=name,
+            kwargs=job.kwargs,
+        )
+        with self._lock:
+            self._admitted[entry.id] = entry
+            self._append(entry)
+        job.context.run(_admission.set, entry.id)
+        job.future.add_done_callback(lambda f: self._settle(entry.id))
+
+    def _settle(self, job_id: str):
+        """المهمة المقبولة انتهت (طُبعت أو فشلت أو رُفضت) دون أن تُحفظ في الـ spool."""
+        with self._lock:
+            if self._admitted.pop(job_id, None) is None:
+                return  # spooled by add(): the retry loop owns it now
+            self._append({"op": "done", "id": job_id})
+
+    def _resubmit(self, entry: SpoolJob):
+        """إعادة مهمة كانت تنتظر في الذاكرة عند التوقف المفاجئ إلى قائمة طابعتها."""
+        func = self._functions.get(entry.func)
+        if func is None:
+            log.error("Cannot resubmit interrupted job %s: unknown function %s", entry.id, entry.func)
+            return
+        try:
+            print_spooler.submit(entry.printer_name, entry.action, func, **entry.kwargs)
+        except SpoolerFullError as e:
+            log.error("Cannot resubmit interrupted job %s: %s", entry.id, e)
+            return
+        # Journaled again under a new id by _on_admit
+        self._settle(entry.id)
+        log.warning("Interrupted %s %s resubmitted to '%s'", entry.action, entry.id, entry.printer_name)
+
+    # ── Public API ──
+
+    def add(self, printer_name: str, data: bytes, job_name: str, partial: bool = False) -> str:
+        """
+        حفظ مهمة جاهزة على القرص لإعادة إرسالها لاحقاً. يرجع رقمها.
+        مهمة مقبولة (admit) مسجلة مسبقاً فلا تنتظر fsync؛ غيرها ينتظره قبل الرجوع.
+        partial: جزء منها وصل للطابعة (يظهر في jobs() ويُسجَّل عند الإعادة).
+        """
+        self.start()
+        admitted = _admission.get()
+        with self._lock:
+            origin = self._admitted.pop(admitted, None) if admitted else None
+            job = SpoolJob(
+                id=origin.id if origin else uuid.uuid4().hex[:12],
+                printer_name=printer_name,
+                job_name=job_name,
+                data=bytes(data),
+                created_at=origin.created_at if origin else time.time(),
+                partial=partial,
+            )
+            self._jobs[job.id] = job
+            self._next_retry.setdefault(printer_name, time.monotonic() + RETRY_BASE_DELAY)
+            seq = self._append(job)
+            self.jobs_spooled += 1
+            if origin is None:
+                while self._flushed < seq:
+                    self._synced.wait()
+            self._wake.notify()
+        self._changed()
+        log.warning("Job '%s' for printer '%s' spooled to disk as %s (%d bytes%s)",
+                    job_name, printer_name, job.id, len(job.data),
+                    ", partially printed" if partial else "")
+        return job.id
+
+    def has_pending(self, printer_name: str) -> bool:
+        """هل توجد مهام سابقة لهذه الطابعة؟ (المهام الجديدة تنتظر خلفها للحفاظ على الترتيب)"""
+        self.start()
+        with self._lock:
+            return printer_name in self._next_retry
+
+    def drop(self, job_id: str) -> bool:
+        """حذف مهمة من القائمة بدون طباعتها."""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                return False
+            self._append({"op": "drop", "id": job_id})
+            self.jobs_dropped += 1
+            self._forget_printer_if_idle(job.printer_name)
+        self._changed()
+        log.info("Spooled job %s dropped", job_id)
+        return True
+
+    def retry_now(self):
+        """إعادة المحاولة فوراً لكل الطابعات بدل انتظار التأخير."""
+        with self._lock:
+            for printer_name in self._next_retry:
+                self._next_retry[printer_name] = 0.0
+            self._wake.notify()
+
+    def _on_breaker_change(self, printer_name: str, state: str):
+        # The status probe saw the printer come back: skip the remaining backoff
+        if state == CLOSED:
+            with self._lock:
+                if printer_name in self._next_retry:
+                    self._next_retry[printer_name] = 0.0
+                    self._wake.notify()
+
+    @property
+    def version(self) -> int:
+        """عدد السجلات المكتوبة: يتغير مع كل إضافة أو إعادة محاولة أو حذف."""
+        return self._written
+
+    def jobs(self) -> list[dict]:
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            printers = {}
+            for job in self._jobs.values():
+                p = printers.setdefault(job.printer_name, {"pending": 0})
+                p["pending"] += 1
+            for name, p in printers.items():
+                p["retrying"] = name in self._busy
+                p["next_retry_in"] = round(max(0.0, self._next_retry.get(name, now) - now), 1)
+            return {
+                "pending": len(self._jobs),
+                "queued": len(self._admitted),
+                "printers": printers,
+                "jobs_spooled": self.jobs_spooled,
+                "jobs_recovered": self.jobs_recovered,
+                "jobs_printed": self.jobs_printed,
+                "jobs_dropped": self.jobs_dropped,
+                "fsyncs": self.fsyncs,
+            }
+
+    # ── Retry ──
+
+    def _forget_printer_if_idle(self, printer_name: str):
+        if not any(j.printer_name == printer_name for j in self._jobs.values()):
+            self._next_retry.pop(printer_name, None)
+
+    def _retry_loop(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                due: list[SpoolJob] = []
+                next_at = None
+                for job in self._jobs.values():
+                    name = job.printer_name
+                    if name in self._busy or any(j.printer_name == name for j in due):
+                        continue
+                    at = self._next_retry.get(name, now)
+                    if at <= now:
+                        due.append(job)
+                        self._busy.add(name)
+                    elif next_at is None or at < next_at:
+                        next_at = at
+                if not due:
+                    self._wake.wait(None if next_at is None else next_at - now)
+                    continue
+            for job in due:
+                self._submit(job)
+
+    def _submit(self, job: SpoolJob):
+        """إعادة إرسال أقدم مهمة للطابعة عبر قائمة انتظارها (بدون إعادة توليد)."""
+        if job.partial and job.attempts == 0:
+            log.warning("Spooled job %s was cut off mid-print on '%s': reprinting it in full",
+                        job.id, job.printer_name)
+        try:
+            future = print_spooler.submit(
+                job.printer_name, "SPOOL_RETRY", transport_pool.send,
+                job.printer_name, job.data, job.job_name,
+            )
+        except SpoolerFullError as e:
+            self._finish(job, e)
+            return
+        future.add_done_callback(lambda f: self._finish(job, f.exception()))
+
+    def _finish(self, job: SpoolJob, error: BaseException | None):
+        printer_name = job.printer_name
+        with self._lock:
+            self._busy.discard(printer_name)
+            if job.id in self._jobs:
+                if error is None:
+                    del self._jobs[job.id]
+                    self._append({"op": "done", "id": job.id})
+                    self.jobs_printed += 1
+                    # The printer is back: send the next job right away
+                    self._next_retry[printer_name] = 0.0
+                else:
+                    job.attempts += 1
+                    job.last_error = str(error)
+                    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (job.attempts - 1))
+                    self._next_retry[printer_name] = (
+                        time.monotonic() + delay * random.uniform(0.8, 1.2)
+                    )
+                    self._append({
+                        "op": "retry", "id": job.id,
+                        "attempts": job.attempts, "error": job.last_error,
+                    })
+            self._forget_printer_if_idle(printer_name)
+            self._wake.notify()
+
+        if error is None:
+            self._changed()
+            log.info("Spooled job %s printed on '%s' after %d failed attempt(s)",
+                     job.id, printer_name, job.attempts)
+            app_state.add_history(
+                action="SPOOL_RETRY", source="spool", status="ok",
+                detail=f"{job.job_name} ({job.id})",
+            )
+        else:
+            log.warning("Retry of spooled job %s on '%s' failed (attempt %d): %s",
+                        job.id, printer_name, job.attempts, error)
+
+
+def _encode(record: dict) -> bytes:
+    return (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def _encode_arg(value):
+    # ESC/POS payloads (bytes / memoryview of a WebSocket frame) are not JSON
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"__b64__": base64.b64encode(value).decode("ascii")}
+    return value
+
+
+def _decode_arg(value):
+    if isinstance(value, dict) and value.keys() == {"__b64__"}:
+        return base64.b64decode(value["__b64__"])
+    return value
+
+
+# ── Singleton ──
+durable_spool = DurableSpool()
@@ -0,0 +1,404 @@
+# spooler.py
+import asyncio
+import contextvars
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import Any, Callable
+from logger import get_logger, log_context
+from throughput import printer_throughput
+
+log = get_logger("spooler")
+
+# أقصى مدة انتظار لنتيجة المهمة من الكود المتزامن (REST)
+JOB_TIMEOUT = 60.0
+
+# فئات الأولوية: الرقم الأصغر يُنفَّذ أولاً
+PRIORITY_DRAWER = 0
+PRIORITY_RECEIPT = 1
+PRIORITY_RAW = 2
+PRIORITY_NAMES = ("drawer", "receipt", "raw")
+
+# فئة كل نوع مهمة (غير المذكور = receipt)
+ACTION_PRIORITY = {
+    "OPEN_DRAWER": PRIORITY_DRAWER,
+    "PREPARE_DRAWER": PRIORITY_DRAWER,
+    "PRINT_RAW": PRIORITY_RAW,
+}
+
+# حد قائمة الانتظار لكل فئة، لكل طابعة (None = بدون حد: فتح الدرج لا يُرفض أبداً،
+# وحدّه الفعلي هو rate limiting على الطلبات)
+CLASS_LIMITS: tuple[int | None, ...] = (None, 32, 8)
+
+# رفض المهام (غير فتح الدرج) التي يُتوقع أن تنتظر أكثر من هذه المدة (ثوانٍ)،
+# حسب سرعة الطابعة المقاسة فعلياً: حجم المهمة / bytes/sec إذا كان حجمها معروفاً،
+# وإلا متوسط مدة مهام فئتها
+MAX_QUEUE_SECONDS = 30.0
+
+# كل AGING_STEP ثانية انتظار ترفع المهمة فئة واحدة حتى لا تُحرم المهام المنخفضة
+# (بين receipt و raw فقط: فتح الدرج يسبق دائماً)
+AGING_STEP = 5.0
+
+
+def action_priority(action: str) -> int:
+    return ACTION_PRIORITY.get(action, PRIORITY_RECEIPT)
+
+
+def payload_size(args: tuple, kwargs: dict) -> int:
+    """حجم بيانات المهمة الجاهزة (bytes في المعاملات)، 0 إذا كانت تُولَّد في العامل."""
+    return sum(
+        len(value) for value in (*args, *kwargs.values())
+        if isinstance(value, (bytes, bytearray, memoryview))
+    )
+
+
+class SpoolerFullError(RuntimeError):
+    """قائمة انتظار الطابعة ممتلئة."""
+
+
+class SpoolerBusyError(SpoolerFullError):
+    """الطابعة متأخرة أكثر من MAX_QUEUE_SECONDS: أعد المحاولة بعد retry_after ثانية."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobTimeoutError(RuntimeError):
+    """انتهت مهلة انتظار النتيجة والمهمة ما زالت في قائمة الطابعة (future ما زال قائماً)."""
+
+    def __init__(self, message: str, future: Future):
+        super().__init__(message)
+        self.future = future
+
+
+# ترقيم المهام لربط سطور السجل بمهمتها (job_id)
+_job_ids = itertools.count(1)
+
+
+@dataclass
+class PrintJob:
+    action: str
+    func: Callable[..., Any]
+    args: tuple
+    kwargs: dict
+    priority: int = PRIORITY_RECEIPT
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.monotonic)
+    job_id: int = field(default_factory=lambda: next(_job_ids))
+    # Payload size when known before running (raw bytes, spool retries), else 0
+    nbytes: int = 0
+    # Context of the submitter (request_id for logs), restored on the worker thread
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+
+    def execute(self) -> Any:
+        with log_context(job_id=self.job_id):
+            return self.func(*self.args, **self.kwargs)
+
+
+class ClassStats:
+    """إحصائيات زمن الانتظار لفئة أولوية واحدة."""
+
+    __slots__ = ("jobs", "rejected", "aged", "last_wait_ms", "avg_wait_ms", "max_wait_ms")
+
+    def __init__(self):
+        self.jobs = 0
+        self.rejected = 0
+        self.aged = 0
+        self.last_wait_ms = 0.0
+        self.avg_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def record_wait(self, wait_ms: float):
+        self.last_wait_ms = wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        # EWMA keeps the average cheap and biased to recent load
+        if self.jobs == 0:
+            self.avg_wait_ms = wait_ms
+        else:
+            self.avg_wait_ms = self.avg_wait_ms * 0.8 + wait_ms * 0.2
+        self.jobs += 1
+
+
+class PrinterWorker:
+    """
+    عامل مخصص لطابعة واحدة مع قائمة انتظار لكل فئة أولوية (drawer > receipt > raw).
+    فتح الدرج يُنفَّذ دائماً أولاً؛ وبين الباقي المهمة التالية هي صاحبة أفضل أولوية فعلية
+    = الفئة - (زمن الانتظار / AGING_STEP)، فتقرير طويل ينتظر خلف الإيصالات لكنه لا يُحرم
+    إلى الأبد.
+    """
+
+    def __init__(self, printer_name: str, class_limits: tuple[int | None, ...] = CLASS_LIMITS,
+                 on_change: Callable[[str], None] | None = None):
+        self.printer_name = printer_name
+        self.class_limits = class_limits
+        self._on_change = on_change
+        self._queues: tuple[deque[PrintJob], ...] = tuple(deque() for _ in PRIORITY_NAMES)
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+
+        # Stats
+        self.jobs_done: int = 0
+        self.jobs_failed: int = 0
+        self.busy: bool = False
+        # The running job (for the ETA)
+        self._running: PrintJob | None = None
+        self.last_run_ms: float = 0.0
+        # Grows on every change visible in stats_dict (for ETags)
+        self.version: int = 0
+        self._class_stats = tuple(ClassStats() for _ in PRIORITY_NAMES)
+
+        self._thread = threading.Thread(
+            target=self._run, name=f"spool-{printer_name}", daemon=True,
+        )
+        self._thread.start()
+
+    def _rates(self) -> tuple[list[float], float]:
+        """
+        مدة المهمة المتوقعة لكل فئة على هذه الطابعة (مقاسة لكل فئة على حدة)،
+        وسرعة الإرسال بالبايت في الثانية (0 قبل أول قياس).
+        """
+        job_seconds = [printer_throughput.job_seconds(self.printer_name, kind) for kind in PRIORITY_NAMES]
+        return job_seconds, printer_throughput.bytes_per_second(self.printer_name)
+
+    @staticmethod
+    def _estimate(job: PrintJob, rates: tuple[list[float], float]) -> float:
+        job_seconds, bytes_per_second = rates
+        if job.nbytes and bytes_per_second:
+            return job.nbytes / bytes_per_second
+        return job_seconds[job.priority]
+
+    def _backlog_seconds(self, rates: tuple[list[float], float], classes: int) -> float:
+        """الزمن المتوقع لإنهاء المهمة الجارية والمنتظرة في أول classes فئات (يُستدعى مع _lock)."""
+        wait_s = sum(self._estimate(job, rates) for q in self._queues[:classes] for job in q)
+        if self._running is not None:
+            wait_s += self._estimate(self._running, rates)
+        return wait_s
+
+    def submit(self, job: PrintJob) -> Future:
+        rates = self._rates()
+        with self._lock:
+            queue = self._queues[job.priority]
+            self.version += 1
+            limit = self.class_limits[job.priority]
+            if limit is not None and len(queue) >= limit:
+                self._class_stats[job.priority].rejected += 1
+                raise SpoolerFullError(
+                    f"Print queue for '{self.printer_name}' is full "
+                    f"({limit} {PRIORITY_NAMES[job.priority]} jobs)"
+                )
+            if job.priority > PRIORITY_DRAWER:
+                # Jobs of the same or a higher class run first
+                wait_s = self._backlog_seconds(rates, job.priority + 1)
+                if wait_s > MAX_QUEUE_SECONDS:
+                    self._class_stats[job.priority].rejected += 1
+                    raise SpoolerBusyError(
+                        f"Printer '{self.printer_name}' is backlogged "
+                        f"(~{wait_s:.0f}s of work queued)",
+                        retry_after=round(wait_s - MAX_QUEUE_SECONDS, 1),
+                    )
+            queue.append(job)
+            self._ready.notify()
+        self._changed()
+        return job.future
+
+    def _changed(self):
+        """إبلاغ PrintSpooler بتغيّر عمق القائمة أو حالة العمل (بعد تحرير _lock)."""
+        if self._on_change is not None:
+            self._on_change(self.printer_name)
+
+    def _next_job(self) -> PrintJob:
+        """اختيار المهمة التالية حسب الأولوية الفعلية (يُستدعى مع _lock)."""
+        while True:
+            # The drawer never waits behind aged jobs
+            if self._queues[PRIORITY_DRAWER]:
+                return self._queues[PRIORITY_DRAWER].popleft()
+            now = time.monotonic()
+            best = None
+            best_score = 0.0
+            for priority, queue in enumerate(self._queues):
+                if priority == PRIORITY_DRAWER or not queue:
+                    continue
+                # Only queue heads compete: FIFO order holds within a class
+                score = priority - (now - queue[0].enqueued_at) / AGING_STEP
+                if best is None or score < best_score:
+                    best, best_score = priority, score
+            if best is not None:
+                job = self._queues[best].popleft()
+                if any(self._queues[p] for p in range(best)):
+                    # Picked ahead of a higher class because it waited long enough
+                    self._class_stats[best].aged += 1
+                return job
+            self._ready.wait()
+
+    def _run(self):
+        log.info("Spooler worker started for printer '%s'", self.printer_name)
+        while True:
+            with self._lock:
+                job = self._next_job()
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            started = time.monotonic()
+            wait_ms = (started - job.enqueued_at) * 1000
+            with self._lock:
+                self.busy = True
+                self._running = job
+                self.version += 1
+                self._class_stats[job.priority].record_wait(wait_ms)
+            self._changed()
+            try:
+                result = job.context.run(job.execute)
+            except BaseException as e:
+                with self._lock:
+                    self.jobs_failed += 1
+                job.future.set_exception(e)
+            else:
+                with self._lock:
+                    self.jobs_done += 1
+                printer_throughput.record_job(
+                    self.printer_name, PRIORITY_NAMES[job.priority], time.monotonic() - started,
+                )
+                job.future.set_result(result)
+            finally:
+                with self._lock:
+                    self.busy = False
+                    self._running = None
+                    self.version += 1
+                    self.last_run_ms = (time.monotonic() - started) * 1000
+                self._changed()
+            if wait_ms > 1000:
+                log.warning(
+                    "%s waited %.0f ms in queue for '%s'",
+                    job.action, wait_ms, self.printer_name,
+                )
+
+    def load(self) -> dict:
+        """عمق القائمة والزمن المتوقع لإنهائها، للإرسال مع ACK."""
+        rates = self._rates()
+        with self._lock:
+            depth = sum(len(q) for q in self._queues)
+            eta_s = self._backlog_seconds(rates, len(self._queues))
+        return {"queue_depth": depth, "eta_s": round(eta_s, 2)}
+
+    def stats_dict(self) -> dict:
+        with self._lock:
+            classes = {}
+            for priority, name in enumerate(PRIORITY_NAMES):
+                st = self._class_stats[priority]
+                classes[name] = {
+                    "queue_depth": len(self._queues[priority]),
+                    "limit": self.class_limits[priority],
+                    "jobs": st.jobs,
+                    "rejected": st.rejected,
+                    "aged": st.aged,
+                    "last_wait_ms": round(st.last_wait_ms, 1),
+                    "avg_wait_ms": round(st.avg_wait_ms, 1),
+                    "max_wait_ms": round(st.max_wait_ms, 1),
+                }
+            return {
+                "queue_depth": sum(len(q) for q in self._queues),
+                "busy": self.busy,
+                "jobs_done": self.jobs_done,
+                "jobs_failed": self.jobs_failed,
+                "jobs_rejected": sum(st.rejected for st in self._class_stats),
+                "last_run_ms": round(self.last_run_ms, 1),
+                "classes": classes,
+            }
+
+
+class PrintSpooler:
+    """موزّع مهام الطباعة: عامل وقائمة انتظار مستقلة لكل طابعة."""
+
+    def __init__(self, class_limits: tuple[int | None, ...] = CLASS_LIMITS):
+        self.class_limits = class_limits
+        self._workers: dict[str, PrinterWorker] = {}
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[str, PrintJob], None]] = []
+        self._change_listeners: list[Callable[[str], None]] = []
+
+    def _worker(self, printer_name: str) -> PrinterWorker:
+        with self._lock:
+            worker = self._workers.get(printer_name)
+            if worker is None:
+                worker = PrinterWorker(printer_name, self.class_limits, self._notify_change)
+                self._workers[printer_name] = worker
+            return worker
+
+    def subscribe(self, listener: Callable[[str, PrintJob], None]):
+        """listener(printer_name, job) لكل مهمة قبل دخولها القائمة، في خيط المستدعي."""
+        self._listeners.append(listener)
+
+    def on_change(self, listener: Callable[[str], None]):
+        """listener(printer_name) كلما تغيّر عمق قائمة طابعة أو بدأت / انتهت مهمة."""
+        self._change_listeners.append(listener)
+
+    def _notify_change(self, printer_name: str):
+        for listener in list(self._change_listeners):
+            try:
+                listener(printer_name)
+            except Exception as e:
+                log.error("Spooler listener failed: %s", e)
+
+    def submit(self, printer_name: str, action: str,
+               func: Callable[..., Any], /, *args, **kwargs) -> Future:
+        """إضافة مهمة إلى قائمة انتظار الطابعة وإرجاع Future بالنتيجة."""
+        if not printer_name:
+            raise RuntimeError("Printer name is empty. اختر طابعة أولاً.")
+        job = PrintJob(action=action, func=func, args=args, kwargs=kwargs,
+                       priority=action_priority(action), nbytes=payload_size(args, kwargs))
+        worker = self._worker(printer_name)
+        # Listeners run before the worker can pick the job up (they may touch job.context)
+        for listener in self._listeners:
+            listener(printer_name, job)
+        try:
+            return worker.submit(job)
+        except BaseException as e:
+            # Rejected: listeners waiting on the future see it end too
+            job.future.set_exception(e)
+            raise
+
+    async def run(self, printer_name: str, action: str,
+                  func: Callable[..., Any], /, *args, **kwargs) -> Any:
+        """تنفيذ مهمة من داخل event loop دون حجبه."""
+        return await asyncio.wrap_future(
+            self.submit(printer_name, action, func, *args, **kwargs)
+        )
+
+    def run_sync(self, printer_name: str, action: str,
+                 func: Callable[..., Any], /, *args, **kwargs) -> Any:
+        """تنفيذ مهمة من كود متزامن (REST) مع انتظار النتيجة."""
+        future = self.submit(printer_name, action, func, *args, **kwargs)
+        try:
+            return future.result(timeout=JOB_TIMEOUT)
+        except FutureTimeoutError:
+            raise JobTimeoutError(f"{action} timed out after {JOB_TIMEOUT:.0f}s", future)
+
+    def load(self, printer_name: str) -> dict:
+        """عمق قائمة الطابعة والزمن المتوقع لإنهائها (بالثواني)."""
+        with self._lock:
+            worker = self._workers.get(printer_name)
+        if worker is None:
+            return {"queue_depth": 0, "eta_s": 0.0}
+        return worker.load()
+
+    def version(self) -> int:
+        """مجموع عدادات التغيير لكل العمال: يتغير كلما تغيرت stats()."""
+        with self._lock:
+            workers = list(self._workers.values())
+        return sum(w.version for w in workers) + len(workers)
+
+    def stats(self) -> dict:
+        with self._lock:
+            workers = list(self._workers.values())
+        throughput = printer_throughput.stats()
+        return {
+            w.printer_name: {**w.stats_dict(), "throughput": throughput.get(w.printer_name)}
+            for w in workers
+        }
+
+
+# ── Singleton ──
+print_spooler = PrintSpooler()
@@ -1,59 +1,193 @@
 # state.py
+import itertools
+import json
 import time
 import threading
-from collections import deque
-from dataclasses import dataclass, field
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Iterator
+from config import AgentConfig
+from history_store import HistoryStore
 from logger import get_logger
 
 log = get_logger("state")
 
 
-@dataclass
-class HistoryEntry:
-    timestamp: float
-    action: str
-    source: str  # "websocket" | "rest_api" | "test"
-    status: str  # "ok" | "error"
-    detail: str = ""
+# سطر السجل: (id, timestamp, action, source, status, detail)
+# source: "websocket" | "rest_api" | "test" ...، status: "ok" | "error"
+HistoryRow = tuple[int, float, str, str, str, str]
 
-    def to_dict(self) -> dict:
-        return {
-            "timestamp": self.timestamp,
-            "time_str": time.strftime("%H:%M:%S", time.localtime(self.timestamp)),
-            "date_str": time.strftime("%Y-%m-%d", time.localtime(self.timestamp)),
-            "action": self.action,
-            "source": self.source,
-            "status": self.status,
-            "detail": self.detail,
-        }
+
+@lru_cache(maxsize=4096)
+def _clock(second: int) -> tuple[str, str]:
+    """(HH:MM:SS, YYYY-MM-DD) لثانية معيّنة: العمليات في نفس الثانية تشترك في نفس النصوص."""
+    t = time.localtime(second)
+    return time.strftime("%H:%M:%S", t), time.strftime("%Y-%m-%d", t)
+
+
+def history_dict(row: HistoryRow) -> dict:
+    entry_id, ts, action, source, status, detail = row
+    time_str, date_str = _clock(int(ts))
+    return {
+        "id": entry_id,
+        "timestamp": ts,
+        "time_str": time_str,
+        "date_str": date_str,
+        "action": action,
+        "source": source,
+        "status": status,
+        "detail": detail,
+    }
+
+
+# جدول النصوص المشترك لـ action / source / status (قيم قليلة تتكرر دائماً)
+_code_ids: dict[str, int] = {"": 0}
+_code_strings: list[str] = [""]
+
+
+def _code(value: str) -> int:
+    code = _code_ids.get(value)
+    if code is None:
+        code = _code_ids.setdefault(value, len(_code_strings))
+        if code == len(_code_strings):
+            _code_strings.append(value)
+    return code
+
+
+class HistoryRing:
+    """
+    آخر العمليات في مصفوفات ثابتة الحجم بدل كائن لكل عملية. action/source/status
+    تُخزن كأرقام في جدول نصوص مشترك، والقراءة تمشي من الأحدث بدون نسخ الحلقة كاملة.
+    ليست thread-safe: AppState يستدعيها مع _lock.
+    """
+
+    __slots__ = ("capacity", "_ids", "_ts", "_codes", "_details", "_head", "_size")
+
+    def __init__(self, capacity: int = 200):
+        self.capacity = capacity
+        self._ids = array("q", bytes(8 * capacity))
+        self._ts = array("d", bytes(8 * capacity))
+        # action, source, status codes of slot i at 3*i .. 3*i+2
+        self._codes = array("H", bytes(2 * 3 * capacity))
+        self._details: list[str] = [""] * capacity
+        self._head = 0  # next slot to write
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, entry_id: int, ts: float, action: str, source: str, status: str, detail: str):
+        i = self._head
+        self._ids[i] = entry_id
+        self._ts[i] = ts
+        # Known strings resolve with one dict lookup; code 0 is ""
+        known, codes, c = _code_ids, self._codes, 3 * i
+        codes[c] = known.get(action) or _code(action)
+        codes[c + 1] = known.get(source) or _code(source)
+        codes[c + 2] = known.get(status) or _code(status)
+        self._details[i] = detail
+        i += 1
+        self._head = i if i < self.capacity else 0
+        if self._size < self.capacity:
+            self._size += 1
+
+    def newest(self, limit: int) -> Iterator[HistoryRow]:
+        """أحدث limit سطر، الأحدث أولاً."""
+        strings, codes = _code_strings, self._codes
+        i = self._head
+        for _ in range(min(limit, self._size)):
+            i = (i - 1) % self.capacity
+            c = 3 * i
+            yield (self._ids[i], self._ts[i], strings[codes[c]], strings[codes[c + 1]],
+                   strings[codes[c + 2]], self._details[i])
+
+
+class TokenBucket:
+    """دلو رموز: سعة burst تُملأ بمعدل ثابت. كل عملية تستهلك رمزاً واحداً."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """استهلاك رمز. يرجع 0 إذا سُمح، وإلا عدد الثواني حتى يتوفر رمز."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
 
 
 class RateLimiter:
-    """حد أقصى لعدد العمليات خلال فترة زمنية."""
+    """
+    حدود معدل بـ token bucket مستقل لكل (source, client)، حتى لا يستهلك
+    تبويب متصفح خارج عن السيطرة حصة أوامر الخادم. كل عملية O(1).
+    الحدود تُضبط بـ configure() عند تغيير الإعدادات وتسري فوراً على كل العملاء.
+    """
 
-    def __init__(self, max_calls: int = 10, period_seconds: float = 60.0):
-        self.max_calls = max_calls
-        self.period = period_seconds
-        self._calls: deque[float] = deque()
+    def __init__(self, rate_per_minute: float = 10, burst: int = 10, max_keys: int = 1024):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[tuple[str, str], TokenBucket] = OrderedDict()
         self._lock = threading.Lock()
+        self.rejected: int = 0
+        # Grows when stats() changes (new client or rejection)
+        self.version: int = 0
 
-    def allow(self) -> bool:
-        now = time.time()
+    def acquire(self, source: str = "", client: str = "",
+                rate_per_minute: float | None = None, burst: int | None = None) -> float:
+        """محاولة تنفيذ عملية. يرجع 0 إذا سُمح بها، وإلا مدة الانتظار (retry-after) بالثواني."""
+        rate = (rate_per_minute or self.rate_per_minute) / 60.0
+        capacity = float(burst or self.burst)
+        key = (source, client)
+        now = time.monotonic()
         with self._lock:
-            while self._calls and now - self._calls[0] > self.period:
-                self._calls.popleft()
-            if len(self._calls) >= self.max_calls:
-                return False
-            self._calls.append(now)
-            return True
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(rate, capacity, now)
+                self._buckets[key] = bucket
+                self.version += 1
+                # Bounded: forget the least recently seen clients
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                if rate_per_minute or burst:
+                    bucket.rate, bucket.capacity = rate, capacity
+            retry_after = bucket.take(now)
+            if retry_after:
+                self.rejected += 1
+                self.version += 1
+            return retry_after
 
-    @property
-    def remaining(self) -> int:
-        now = time.time()
+    def configure(self, rate_per_minute: float, burst: int):
+        """تطبيق حدود جديدة على العملاء الحاليين والجدد."""
+        with self._lock:
+            self.rate_per_minute, self.burst = rate_per_minute, burst
+            for bucket in self._buckets.values():
+                bucket.rate, bucket.capacity = rate_per_minute / 60.0, float(burst)
+
+    def allow(self, source: str = "", client: str = "") -> bool:
+        return self.acquire(source, client) == 0.0
+
+    def remaining(self, source: str = "", client: str = "") -> int:
+        with self._lock:
+            bucket = self._buckets.get((source, client))
+            if bucket is None:
+                return int(self.burst)
+            now = time.monotonic()
+            return int(min(bucket.capacity, bucket.tokens + (now - bucket.updated) * bucket.rate))
+
+    def stats(self) -> dict:
         with self._lock:
-            while self._calls and now - self._calls[0] > self.period:
-                self._calls.popleft()
-            return max(0, self.max_calls - len(self._calls))
+            return {"clients": len(self._buckets), "rejected": self.rejected}
 
 
 class AppState:
@@ -68,14 +202,17 @@ class AppState:
         self.ws_last_error: str = ""
         self.ws_reconnect_count: int = 0
 
-        # Operation history
-        self._history: deque[HistoryEntry] = deque(maxlen=200)
+        # Recent operations in memory; history_seq is the id of the newest entry
+        self._history = HistoryRing(200)
+        self.history_seq: int = 0
+        # Persistent history (attach_history); None keeps history in memory only
+        self._store: HistoryStore | None = None
+        # limit -> (history_seq, serialized /history body)
+        self._history_cache: dict[int, tuple[int, bytes]] = {}
 
-        # Rate limiter: 10 drawer opens per minute
-        self.drawer_rate_limiter = RateLimiter(max_calls=10, period_seconds=60.0)
-        
-        # Rate limiter: 30 receipt prints per minute (more generous)
-        self.receipt_rate_limiter = RateLimiter(max_calls=30, period_seconds=60.0)
+        # Rate limiters per (source, client); limits come from AgentConfig (configure_limits)
+        self.drawer_rate_limiter = RateLimiter(rate_per_minute=10, burst=10)
+        self.receipt_rate_limiter = RateLimiter(rate_per_minute=30, burst=30)
 
         # Counters
         self.total_opens: int = 0
@@ -84,6 +221,34 @@ class AppState:
         self.today_prints: int = 0
         self._today_date: str = time.strftime("%Y-%m-%d")
 
+        # Drawer kick latency (send time only, excluding queue wait)
+        self.drawer_kick_count: int = 0
+        self.drawer_kick_last_ms: float = 0.0
+        self.drawer_kick_avg_ms: float = 0.0
+        self.drawer_kick_max_ms: float = 0.0
+
+        # Change notification: version grows on every change, listeners get the kind
+        self.version: int = 0
+        self._listeners: list[Callable[[str], None]] = []
+
+    def subscribe(self, listener: Callable[[str], None]):
+        """تسجيل دالة تُستدعى بنوع التغيير ("ws" / "history" / "drawer_kick") بعد كل تغيّر."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def configure_limits(self, cfg: AgentConfig):
+        """ضبط حدود المعدل من الإعدادات (عند التشغيل وعند كل تغيير)."""
+        self.drawer_rate_limiter.configure(cfg.drawer_rate_per_minute, cfg.drawer_burst)
+        self.receipt_rate_limiter.configure(cfg.receipt_rate_per_minute, cfg.receipt_burst)
+
+    def _changed(self, kind: str):
+        """إبلاغ المشتركين (يُستدعى بعد تحرير _lock)."""
+        for listener in list(self._listeners):
+            try:
+                listener(kind)
+            except Exception as e:
+                log.error("State listener failed: %s", e)
+
     @property
     def uptime_seconds(self) -> float:
         return time.time() - self.start_time
@@ -103,17 +268,38 @@ class AppState:
         parts.append(f"{s}s")
         return " ".join(parts)
 
+    def attach_history(self, store: HistoryStore):
+        """
+        ربط السجل الدائم عند التشغيل: استعادة العدادات وآخر العمليات من القرص،
+        ثم حفظ كل عملية جديدة فيه.
+        """
+        store.start()
+        counters = store.counters()
+        last_id = store.last_id()
+        rows = store.query(limit=self._history.capacity)
+        with self._lock:
+            self._store = store
+            self._history = HistoryRing(self._history.capacity)
+            for row in reversed(rows):
+                self._history.append(*row)
+            self.history_seq = max(self.history_seq, last_id)
+            self._history_cache.clear()
+            self.total_opens = counters["total_opens"]
+            self.today_opens = counters["today_opens"]
+            self.total_prints = counters["total_prints"]
+            self.today_prints = counters["today_prints"]
+            self.version += 1
+        log.info("History restored: %d recent entries, %d opens / %d prints in total",
+                 len(rows), self.total_opens, self.total_prints)
+
     def add_history(self, action: str, source: str, status: str, detail: str = ""):
-        entry = HistoryEntry(
-            timestamp=time.time(),
-            action=action,
-            source=source,
-            status=status,
-            detail=detail,
-        )
+        ts = time.time()
         with self._lock:
-            self._history.appendleft(entry)
-            today = time.strftime("%Y-%m-%d")
+            self.history_seq += 1
+            self._history.append(self.history_seq, ts, action, source, status, detail)
+            if self._store is not None:
+                self._store.add(self.history_seq, ts, action, source, status, detail)
+            today = _clock(int(ts))[1]
             if today != self._today_date:
                 self._today_date = today
                 self.today_opens = 0
@@ -126,12 +312,82 @@ class AppState:
                 elif action in ("PRINT_RECEIPT", "PRINT_RAW", "TEST_PRINT"):
                     self.total_prints += 1
                     self.today_prints += 1
+            self.version += 1
         log.info("History: %s | %s | %s | %s", action, source, status, detail)
+        self._changed("history")
+
+    def record_drawer_kick(self, elapsed_ms: float):
+        with self._lock:
+            self.drawer_kick_count += 1
+            self.drawer_kick_last_ms = elapsed_ms
+            self.drawer_kick_max_ms = max(self.drawer_kick_max_ms, elapsed_ms)
+            if self.drawer_kick_count == 1:
+                self.drawer_kick_avg_ms = elapsed_ms
+            else:
+                self.drawer_kick_avg_ms = self.drawer_kick_avg_ms * 0.8 + elapsed_ms * 0.2
+            self.version += 1
+        self._changed("drawer_kick")
 
     def get_history(self, limit: int = 50) -> list[dict]:
         with self._lock:
-            items = list(self._history)[:limit]
-        return [e.to_dict() for e in items]
+            rows = list(self._history.newest(limit))
+        return [history_dict(row) for row in rows]
+
+    def query_history(self, limit: int = 50, before: int | None = None,
+                      action: str | None = None, source: str | None = None,
+                      status: str | None = None, since: float | None = None,
+                      until: float | None = None) -> list[dict]:
+        """
+        البحث في السجل مع التصفية، الأحدث أولاً. before هو id آخر إدخال في الصفحة السابقة.
+        يستخدم السجل الدائم إن وُجد، وإلا العمليات الموجودة في الذاكرة.
+        """
+        if self._store is not None:
+            rows = self._store.query(limit, before, action, source, status, since, until)
+            return [history_dict(row) for row in rows]
+        with self._lock:
+            rows = list(self._history.newest(self._history.capacity))
+        matches = (
+            row for row in rows
+            if (before is None or row[0] < before)
+            and (not action or row[2] == action)
+            and (not source or row[3] == source)
+            and (not status or row[4] == status)
+            and (since is None or row[1] >= since)
+            and (until is None or row[1] < until)
+        )
+        return [history_dict(row) for row in itertools.islice(matches, limit)]
+
+    def history_payload(self, limit: int = 50) -> tuple[int, bytes]:
+        """
+        جسم /history مسلسلاً JSON مع رقم آخر إدخال. يُبنى مرة واحدة لكل حد
+        ويُعاد من الذاكرة ما دام لم يُضف إدخال جديد.
+        """
+        with self._lock:
+            seq = self.history_seq
+            cached = self._history_cache.get(limit)
+            if cached is not None and cached[0] == seq:
+                return cached
+            rows = list(self._history.newest(limit))
+        payload = {
+            "history": [history_dict(row) for row in rows],
+            "next_cursor": rows[-1][0] if rows and len(rows) == limit else None,
+        }
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        with self._lock:
+            self._history_cache[limit] = (seq, body)
+        return seq, body
+
+    def health_version(self) -> tuple[int, ...]:
+        """ما يغيّر health_dict (عدا وقت التشغيل)، للمقارنة بدون بنائه."""
+        return (self.version, self.drawer_rate_limiter.version, self.receipt_rate_limiter.version)
+
+    def history_since(self, seq: int, limit: int = 50) -> tuple[int, list[dict]]:
+        """الإدخالات المضافة بعد seq (الأحدث أولاً)، مع رقم آخر إدخال."""
+        with self._lock:
+            current = self.history_seq
+            count = max(0, min(current - seq, limit))
+            rows = list(self._history.newest(count))
+        return current, [history_dict(row) for row in rows]
 
     def set_ws_connected(self, connected: bool, error: str = ""):
         with self._lock:
@@ -139,10 +395,13 @@ class AppState:
                 self.ws_reconnect_count += 1
             self.ws_connected = connected
             self.ws_last_error = error
+            self.version += 1
+        self._changed("ws")
 
     def health_dict(self) -> dict:
         with self._lock:
-            last_entry = self._history[0].to_dict() if self._history else None
+            last = next(self._history.newest(1), None)
+        last_entry = history_dict(last) if last is not None else None
         return {
             "status": "healthy",
             "ws_connected": self.ws_connected,
@@ -155,6 +414,16 @@ class AppState:
             "total_prints": self.total_prints,
             "today_prints": self.today_prints,
             "last_operation": last_entry,
+            "rate_limits": {
+                "drawer": self.drawer_rate_limiter.stats(),
+                "receipt": self.receipt_rate_limiter.stats(),
+            },
+            "drawer_kick": {
+                "count": self.drawer_kick_count,
+                "last_ms": round(self.drawer_kick_last_ms, 2),
+                "avg_ms": round(self.drawer_kick_avg_ms, 2),
+                "max_ms": round(self.drawer_kick_max_ms, 2),
+            },
         }
 
 
@@ -0,0 +1,106 @@
+# tests/test_config.py
+import json
+import os
+
+import pytest
+from pydantic import ValidationError
+
+import config
+from config import AgentConfig
+
+
+@pytest.fixture
+def cfg_path(tmp_path, monkeypatch):
+    path = tmp_path / "config.json"
+    monkeypatch.setattr(config, "CFG_PATH", path)
+    monkeypatch.setattr(config, "_snapshot", None)
+    monkeypatch.setattr(config, "_file_stamp", None)
+    monkeypatch.setattr(config, "_listeners", [])
+    return path
+
+
+def _changes() -> list[tuple[AgentConfig, AgentConfig]]:
+    seen = []
+    config.subscribe(lambda new, old: seen.append((new, old)))
+    return seen
+
+
+def test_write_atomic_replaces_the_file(cfg_path):
+    config._write_atomic(AgentConfig(printer_name="EPSON"))
+    assert json.loads(cfg_path.read_text(encoding="utf-8"))["printer_name"] == "EPSON"
+    assert list(cfg_path.parent.iterdir()) == [cfg_path]
+
+
+def test_write_atomic_keeps_the_old_file_on_failure(cfg_path, monkeypatch):
+    config._write_atomic(AgentConfig(printer_name="EPSON"))
+
+    def crash(src, dst):
+        raise OSError("power cut")
+
+    monkeypatch.setattr(config.os, "replace", crash)
+    with pytest.raises(OSError):
+        config._write_atomic(AgentConfig(printer_name="OTHER"))
+    assert json.loads(cfg_path.read_text(encoding="utf-8"))["printer_name"] == "EPSON"
+
+
+def test_missing_file_creates_defaults(cfg_path):
+    assert config.load_config() == AgentConfig()
+    assert AgentConfig(**json.loads(cfg_path.read_text(encoding="utf-8"))) == AgentConfig()
+
+
+def test_update_config_merges_into_the_current_snapshot(cfg_path):
+    config.load_config()
+    seen = _changes()
+    config.update_config({"printer_name": "EPSON"})
+    cfg = config.update_config({"drawer_pin": 1, "printers": {"bar": "tcp://10.0.0.9"}})
+    assert (cfg.printer_name, cfg.drawer_pin, cfg.printers) == ("EPSON", 1, {"bar": "tcp://10.0.0.9"})
+    assert config.load_config() is cfg
+    assert AgentConfig(**json.loads(cfg_path.read_text(encoding="utf-8"))) == cfg
+    assert [new.drawer_pin for new, _ in seen] == [0, 1]
+    assert seen[1][1].printer_name == "EPSON"
+
+    version, _ = config.config_snapshot()
+    # An invalid merge is rejected as a whole: nothing saved or published
+    with pytest.raises(ValidationError):
+        config.update_config({"printer_name": "X", "drawer_pin": 5})
+    assert config.config_snapshot() == (version, cfg)
+    # No change, no new version
+    config.update_config({"printer_name": "EPSON"})
+    assert config.config_snapshot()[0] == version and len(seen) == 2
+
+
+def _edit_by_hand(path, **changes):
+    data = json.loads(path.read_text(encoding="utf-8"))
+    data.update(changes)
+    stat = path.stat()
+    path.write_text(json.dumps(data), encoding="utf-8")
+    # Coarse mtime clocks: make sure the stamp moves
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_watcher_reloads_when_the_file_changes(cfg_path):
+    config.load_config()
+    seen = _changes()
+    config._check_file()
+    assert seen == []  # unchanged stamp: no reload
+
+    _edit_by_hand(cfg_path, printer_name="tcp://10.0.0.5")
+    config._check_file()
+    assert config.load_config().printer_name == "tcp://10.0.0.5"
+    assert len(seen) == 1
+
+    # A broken edit keeps the last good config and is not reloaded again on every poll
+    stamp = cfg_path.stat()
+    cfg_path.write_text("{not json", encoding="utf-8")
+    os.utime(cfg_path, ns=(stamp.st_atime_ns, stamp.st_mtime_ns + 1_000_000_000))
+    config._check_file()
+    assert config.load_config().printer_name == "tcp://10.0.0.5"
+    assert config._file_stamp == config._stamp()
+
+
+def test_own_saves_do_not_trigger_a_reload(cfg_path):
+    config.load_config()
+    config.update_config({"printer_name": "EPSON"})
+    seen = _changes()
+    config._check_file()
+    assert seen == []
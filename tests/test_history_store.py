@@ -0,0 +1,130 @@
+# tests/test_history_store.py
+import time
+
+import pytest
+
+import history_store
+from config import AgentConfig
+from history_store import HistoryStore, BATCH_SIZE, WRITE_ATTEMPTS
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_store, "load_config", lambda: AgentConfig(history_retention_days=30))
+    store = HistoryStore(tmp_path / "history.db")
+    yield store
+    store.close()
+
+
+def _add(store: HistoryStore, entry_id: int, action="OPEN_DRAWER", status="ok",
+         source="websocket", ts: float | None = None):
+    store.add(entry_id, time.time() if ts is None else ts, action, source, status, f"#{entry_id}")
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_writes_are_batched(store, monkeypatch):
+    monkeypatch.setattr(history_store, "FLUSH_INTERVAL", 60.0)
+    store.start()
+    for i in range(1, BATCH_SIZE):
+        _add(store, i)
+    time.sleep(0.1)
+    assert store.stats() == {"entries": 0, "pending_writes": BATCH_SIZE - 1, "batches": 0, "purged": 0}
+
+    # A full batch goes out without waiting for the interval, in one transaction
+    _add(store, BATCH_SIZE)
+    _wait_for(lambda: store.batches == 1)
+    assert store.stats()["entries"] == BATCH_SIZE
+
+    _add(store, BATCH_SIZE + 1)
+    store.flush()
+    assert store.stats()["entries"] == BATCH_SIZE + 1 and store.batches == 2
+    assert store.last_id() == BATCH_SIZE + 1
+
+
+def test_cursor_pagination_and_filters(store):
+    store.start()
+    base = time.time() - 100
+    for i in range(1, 26):
+        _add(store, i, action="OPEN_DRAWER" if i % 2 else "PRINT_RECEIPT",
+             source="rest_api" if i % 5 == 0 else "websocket", ts=base + i)
+
+    page = store.query(limit=10)
+    assert [row[0] for row in page] == list(range(25, 15, -1))
+    page = store.query(limit=10, before=page[-1][0])
+    assert [row[0] for row in page] == list(range(15, 5, -1))
+    # New entries do not shift a page that is already being read
+    _add(store, 26)
+    page = store.query(limit=10, before=page[-1][0])
+    assert [row[0] for row in page] == [5, 4, 3, 2, 1]
+
+    assert [row[0] for row in store.query(action="PRINT_RECEIPT", source="rest_api")] == [20, 10]
+    assert [row[0] for row in store.query(since=base + 10, until=base + 13)] == [12, 11, 10]
+    assert store.query(limit=1)[0] == (26, pytest.approx(time.time(), abs=5), "OPEN_DRAWER",
+                                       "websocket", "ok", "#26")
+
+
+def test_counters_survive_purging_old_entries(store):
+    old = time.time() - 90 * 86400
+    _add(store, 1, ts=old)
+    _add(store, 2, action="PRINT_RAW", ts=old)
+    _add(store, 3)
+    _add(store, 4, status="error")
+    _add(store, 5, action="PRINT_RECEIPT")
+    _add(store, 6, action="STATUS")
+    # The writer compacts right after its first batch (retention is 30 days)
+    store.start()
+    store.flush()
+    _wait_for(lambda: store.purged == 2)
+    assert [row[0] for row in store.query()] == [6, 5, 4, 3]
+    assert store.counters() == {"total_opens": 2, "total_prints": 2, "today_opens": 1, "today_prints": 1}
+    assert store.last_id() == 6
+
+
+def test_failed_write_is_retried_with_its_counters(store):
+    real_write = store._write
+    calls = []
+
+    def flaky_write(batch, counters):
+        calls.append((len(batch), dict(counters)))
+        if len(calls) == 1:
+            return False
+        return real_write(batch, counters)
+
+    store._write = flaky_write
+    _add(store, 1)
+    _add(store, 2, action="PRINT_RECEIPT")
+    store.start()
+    store.flush()
+    assert store.stats()["entries"] == 2
+    assert store.counters()["total_opens"] == 1 and store.counters()["total_prints"] == 1
+    # The retry carried the failed batch once, not on top of a second copy
+    assert calls[-1] == (2, {"opens": 1, "prints": 1})
+
+
+def test_batch_is_dropped_after_too_many_failed_writes(store):
+    real_write = store._write
+    failures = []
+
+    def failing_write(batch, counters):
+        if len(failures) < WRITE_ATTEMPTS:
+            failures.append(len(batch))
+            return False
+        return real_write(batch, counters)
+
+    store._write = failing_write
+    _add(store, 1)
+    store.start()
+    store.flush()  # returns once the batch is dropped
+    assert failures == [1] * WRITE_ATTEMPTS
+    assert store.stats()["entries"] == 0
+
+    _add(store, 2)
+    store.flush()
+    assert [row[0] for row in store.query()] == [2]
+    assert store.counters()["total_opens"] == 1
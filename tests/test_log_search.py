@@ -0,0 +1,99 @@
+# tests/test_log_search.py
+import mmap
+import re
+import time
+
+import pytest
+
+import log_search
+
+BASE = time.mktime((2026, 1, 31, 12, 0, 0, 0, 0, -1))
+
+
+def _ts(offset: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(BASE + offset))
+
+
+def _record(offset: int, level: str, msg: str, extra: tuple[str, ...] = ()) -> list[str]:
+    return [f"[{_ts(offset)}] {level:<8} GeniusStepCashDrawer.spooler: {msg}", *extra]
+
+
+def _write(path, records: list[list[str]]):
+    path.write_bytes(("\n".join(line for r in records for line in r) + "\n").encode("utf-8"))
+
+
+@pytest.fixture
+def mapped(tmp_path):
+    def open_map(records):
+        path = tmp_path / "single.log"
+        _write(path, records)
+        f = open(path, "rb")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        opened.append((f, mm))
+        return mm
+    opened = []
+    yield open_map
+    for f, mm in opened:
+        mm.close()
+        f.close()
+
+
+def test_offset_at_finds_first_record_at_or_after_timestamp(mapped):
+    records = [
+        _record(0, "INFO", "first"),
+        _record(10, "ERROR", "boom", ("Traceback (most recent call last):", "  ValueError: x")),
+        _record(20, "INFO", "third"),
+    ]
+    mm = mapped(records)
+    starts = [m.start() for m in re.finditer(rb"^\[", mm, re.M)]
+
+    assert log_search._offset_at(mm, log_search._ts_bytes(BASE - 5)) == 0
+    assert log_search._offset_at(mm, log_search._ts_bytes(BASE)) == starts[0]
+    # Between records (and past a multi-line traceback): the next record's header
+    assert log_search._offset_at(mm, log_search._ts_bytes(BASE + 5)) == starts[1]
+    assert log_search._offset_at(mm, log_search._ts_bytes(BASE + 15)) == starts[2]
+    assert log_search._offset_at(mm, log_search._ts_bytes(BASE + 30)) == len(mm)
+
+
+def test_matching_records_across_scan_windows(mapped, monkeypatch):
+    # Small windows so records and matches straddle window boundaries
+    monkeypatch.setattr(log_search, "SCAN_WINDOW", 64)
+    records = [
+        _record(i, "INFO", f"job {i} {'printer offline' if i % 3 == 0 else 'ok'}",
+                ("  detail line",) if i % 4 == 0 else ())
+        for i in range(40)
+    ]
+    mm = mapped(records)
+    pattern = re.compile(rb"OFFLINE", re.IGNORECASE)
+
+    found = [b"\n".join(r).decode() for r in log_search._matching_records(mm, 0, len(mm), pattern)]
+    expected = ["\n".join(r) for r in reversed(records) if "offline" in r[0]]
+    assert found == expected
+
+
+def test_search_logs_spans_rotation_boundary(tmp_path, monkeypatch):
+    log_file = tmp_path / "agent.log"
+    monkeypatch.setattr(log_search, "LOG_FILE", log_file)
+    older = [_record(i, "WARNING" if i % 2 else "INFO", f"old {i}") for i in range(10)]
+    newer = [_record(100 + i, "WARNING" if i % 2 else "INFO", f"new {i}") for i in range(10)]
+    _write(tmp_path / "agent.log.1", older)
+    # The live file starts with the tail of a record that began before rotation: not a record
+    log_file.write_bytes(b"  continued from agent.log.1\n")
+    with open(log_file, "ab") as f:
+        f.write(("\n".join(line for r in newer for line in r) + "\n").encode("utf-8"))
+
+    def lines(**kwargs):
+        return b"".join(log_search.search_logs(**kwargs)).decode().splitlines()
+
+    everything = lines(limit=100)
+    assert everything == [r[0] for r in reversed(older + newer)]
+
+    # The limit stops inside the older file, newest first
+    assert lines(limit=12) == everything[:12]
+
+    # A since inside agent.log.1 and a level filter spanning both files
+    warnings = lines(level="WARNING", since=BASE + 5, limit=100)
+    assert warnings == [r[0] for r in reversed(older[5:] + newer) if "WARNING" in r[0]]
+
+    # A query matching only the older file
+    assert lines(query="OLD 3") == [older[3][0]]
@@ -0,0 +1,95 @@
+# tests/test_rate_limit.py
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import state
+from state import RateLimiter
+from web_ui import _check_rate
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(state, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def _request(origin: str | None = None, host: str = "127.0.0.1", **headers) -> Request:
+    raw = [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]
+    if origin is not None:
+        raw.append((b"origin", origin.encode()))
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": raw,
+                    "client": (host, 50000)})
+
+
+def test_burst_then_reject(clock):
+    limiter = RateLimiter(rate_per_minute=60, burst=3)
+    assert [limiter.acquire("ws", "server") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("ws", "server") == pytest.approx(1.0)
+    assert limiter.rejected == 1
+
+
+def test_refill_at_the_configured_rate(clock):
+    limiter = RateLimiter(rate_per_minute=60, burst=2)
+    limiter.acquire("ws", "server")
+    limiter.acquire("ws", "server")
+    clock.now += 0.5
+    assert limiter.acquire("ws", "server") == pytest.approx(0.5)
+    clock.now += 0.5
+    assert limiter.acquire("ws", "server") == 0.0
+    # A long pause refills up to the burst, never beyond it
+    clock.now += 3600
+    assert limiter.remaining("ws", "server") == 2
+    assert [limiter.allow("ws", "server") for _ in range(3)] == [True, True, False]
+
+
+def test_buckets_are_per_source_and_client(clock):
+    limiter = RateLimiter(rate_per_minute=60, burst=1)
+    assert limiter.allow("rest_api", "http://runaway-tab")
+    assert not limiter.allow("rest_api", "http://runaway-tab")
+    # Other clients and the server's own commands keep their quota
+    assert limiter.allow("rest_api", "http://pos")
+    assert limiter.allow("websocket", "http://runaway-tab")
+    assert limiter.allow("websocket", "")
+
+
+def test_configure_applies_to_existing_clients(clock):
+    limiter = RateLimiter(rate_per_minute=60, burst=1)
+    limiter.acquire("ws", "server")
+    limiter.configure(rate_per_minute=6, burst=5)
+    clock.now += 10
+    assert limiter.allow("ws", "server")
+    assert limiter.acquire("ws", "server") == pytest.approx(10.0)
+
+
+def test_least_recently_seen_clients_are_forgotten(clock):
+    limiter = RateLimiter(rate_per_minute=60, burst=1, max_keys=2)
+    limiter.acquire("rest_api", "a")
+    limiter.acquire("rest_api", "b")
+    limiter.acquire("rest_api", "a")  # a is now the most recent
+    limiter.acquire("rest_api", "c")
+    assert limiter.remaining("rest_api", "b") == 1  # b was dropped: a fresh bucket
+    assert limiter.remaining("rest_api", "a") == 0
+
+
+def test_check_rate_keys_on_origin_then_peer_address(clock):
+    limiter = RateLimiter(rate_per_minute=60, burst=1)
+    _check_rate(limiter, "rest_api", _request(origin="http://tab-a"), "drawer")
+    _check_rate(limiter, "rest_api", _request(origin="http://tab-b"), "drawer")
+    _check_rate(limiter, "rest_api", _request(host="10.0.0.7"), "drawer")
+    # Same peer, a client-chosen id does not buy a new bucket
+    with pytest.raises(HTTPException) as rejected:
+        _check_rate(limiter, "rest_api", _request(host="10.0.0.7", x_client_id="other"), "drawer")
+    assert rejected.value.status_code == 429
+    assert rejected.value.headers["Retry-After"] == "1"
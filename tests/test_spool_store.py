@@ -0,0 +1,151 @@
+# tests/test_spool_store.py
+from concurrent.futures import Future
+
+import pytest
+
+import spool_store
+from spool_store import DurableSpool, SpoolJob, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+from spooler import PrintJob, SpoolerFullError
+
+
+def print_bytes(*, data, copies=1):
+    return len(data) * copies
+
+
+class FakeSpooler:
+    def __init__(self, full=False):
+        self.full = full
+        self.submitted = []
+
+    def submit(self, printer_name, action, func, /, *args, **kwargs):
+        if self.full:
+            raise SpoolerFullError("full")
+        future = Future()
+        self.submitted.append((printer_name, action, func, args, kwargs, future))
+        return future
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = DurableSpool(tmp_path / "spool.jsonl")
+    spool.register(print_bytes)
+    # Open the journal without the fsync / retry threads: tests call _flush() themselves
+    spool._started = True
+    spool._compact()
+    yield spool
+    spool._fh.close()
+
+
+def _reload(spool: DurableSpool) -> DurableSpool:
+    recovered = DurableSpool(spool.path)
+    recovered.register(print_bytes)
+    recovered._load()
+    return recovered
+
+
+def _admit(spool: DurableSpool, printer_name: str, **kwargs) -> PrintJob:
+    job = PrintJob(action="PRINT_RAW", func=print_bytes, args=(), kwargs=kwargs)
+    spool._on_admit(printer_name, job)
+    return job
+
+
+def test_admit_is_encoded_on_the_fsync_thread(spool):
+    frame = bytearray(b"\x1b@hello\x1dV\x00")
+    view = memoryview(frame)
+    _admit(spool, "P1", data=view, copies=2)
+
+    # Nothing encoded, copied or written in the submitter's thread
+    assert spool._pending[0].kwargs["data"] is view
+    assert spool.path.stat().st_size == 0
+
+    spool._flush()
+    assert not spool._pending
+    (entry,) = _reload(spool)._admitted.values()
+    assert entry.kwargs == {"data": bytes(frame), "copies": 2}
+    assert entry.printer_name == "P1" and entry.func == "print_bytes"
+
+
+def test_unencodable_arguments_are_not_journaled(spool):
+    job = _admit(spool, "P1", data=b"x", copies=object())
+    spool._flush()
+    assert not spool._admitted
+    assert not _reload(spool)._admitted
+    job.future.set_result(None)  # settling an unjournaled job writes nothing
+    assert not spool._pending
+
+
+def test_journal_replay_after_crash(spool, monkeypatch):
+    _admit(spool, "P1", data=b"first")
+    printed = _admit(spool, "P1", data=b"second")
+    failed = _admit(spool, "P2", data=b"third")
+    printed.future.set_result(3)
+    # The third job failed to send: printer_raw spools the rendered bytes in its context
+    spooled_id = failed.context.run(spool.add, "P2", b"\x1b@third", "Receipt")
+    failed.future.set_exception(OSError("offline"))
+    spool._flush()
+    with open(spool.path, "ab") as fh:
+        fh.write(b'{"op":"done","id":"')  # torn line: crashed mid-append
+
+    recovered = _reload(spool)
+    assert recovered.jobs_recovered == 2
+    (interrupted,) = recovered._admitted.values()
+    assert interrupted.kwargs == {"data": b"first"}
+    (job,) = recovered._jobs.values()
+    assert (job.id, job.printer_name, job.data) == (spooled_id, "P2", b"\x1b@third")
+
+    # The interrupted job goes back to its printer and its old entry is closed
+    fake = FakeSpooler()
+    monkeypatch.setattr(spool_store, "print_spooler", fake)
+    recovered._compact()
+    recovered._resubmit(interrupted)
+    recovered._flush()
+    recovered._fh.close()
+    ((printer_name, action, func, args, kwargs, _),) = fake.submitted
+    assert (printer_name, action, func, kwargs) == ("P1", "PRINT_RAW", print_bytes, {"data": b"first"})
+    assert not _reload(recovered)._admitted
+
+
+def test_retry_backoff_and_recovery(spool, monkeypatch):
+    monkeypatch.setattr(spool_store.random, "uniform", lambda a, b: 1.0)
+    monkeypatch.setattr(spool_store.time, "monotonic", lambda: 1000.0)
+    fake = FakeSpooler()
+    monkeypatch.setattr(spool_store, "print_spooler", fake)
+    job = SpoolJob(id="j1", printer_name="P1", job_name="Receipt", data=b"abc", created_at=0.0)
+    with spool._lock:
+        spool._jobs[job.id] = job
+        spool._append(job)
+    spool._next_retry["P1"] = 1000.0
+
+    delays = []
+    for attempt in range(1, 8):
+        spool._busy.add("P1")
+        spool._submit(job)
+        assert spool.stats()["printers"]["P1"]["retrying"]
+        fake.submitted[-1][-1].set_exception(OSError("paper out"))
+        assert job.attempts == attempt and job.last_error == "paper out"
+        stats = spool.stats()["printers"]["P1"]
+        assert not stats["retrying"]
+        delays.append(stats["next_retry_in"])
+    assert delays == [min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** i) for i in range(7)]
+
+    # Attempts survive a restart
+    spool._flush()
+    assert _reload(spool)._jobs["j1"].attempts == 7
+
+    spool._busy.add("P1")
+    spool._submit(job)
+    fake.submitted[-1][-1].set_result(3)
+    assert not spool._jobs and "P1" not in spool._next_retry
+    assert spool.stats()["jobs_printed"] == 1
+    spool._flush()
+    assert not _reload(spool)._jobs
+
+
+def test_full_print_queue_counts_as_failed_attempt(spool, monkeypatch):
+    monkeypatch.setattr(spool_store, "print_spooler", FakeSpooler(full=True))
+    job = SpoolJob(id="j1", printer_name="P1", job_name="Receipt", data=b"abc", created_at=0.0)
+    spool._jobs[job.id] = job
+    spool._busy.add("P1")
+    spool._submit(job)
+    assert job.attempts == 1 and "P1" not in spool._busy
+    assert spool.stats()["printers"]["P1"]["next_retry_in"] > 0
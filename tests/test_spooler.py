@@ -0,0 +1,132 @@
+# tests/test_spooler.py
+import threading
+import time
+import uuid
+
+import pytest
+
+from spooler import (
+    PrinterWorker, PrintJob, SpoolerFullError, SpoolerBusyError,
+    AGING_STEP, PRIORITY_DRAWER, PRIORITY_RECEIPT, PRIORITY_RAW, payload_size,
+)
+from throughput import printer_throughput
+
+
+def _printer() -> str:
+    # Throughput is measured per printer name: keep tests apart
+    return f"test-{uuid.uuid4().hex[:8]}"
+
+
+def _job(name: str, order: list, priority: int, waited: float = 0.0, nbytes: int = 0) -> PrintJob:
+    return PrintJob(
+        action=name, func=order.append, args=(name,), kwargs={},
+        priority=priority, enqueued_at=time.monotonic() - waited, nbytes=nbytes,
+    )
+
+
+def _executed(worker: PrinterWorker, jobs: list[PrintJob], order: list) -> list[str]:
+    """يحجب العامل بمهمة جارية، يضيف jobs خلفها دفعة واحدة، ثم يرجع ترتيب تنفيذها."""
+    gate = threading.Event()
+    started = threading.Event()
+    worker.submit(PrintJob(action="BLOCK", func=lambda: (started.set(), gate.wait(5)),
+                           args=(), kwargs={}))
+    assert started.wait(5)
+    for job in jobs:
+        worker.submit(job)
+    gate.set()
+    for job in jobs:
+        job.future.result(timeout=5)
+    return order
+
+
+def test_classes_run_in_priority_order():
+    order = []
+    jobs = [
+        _job("raw", order, PRIORITY_RAW),
+        _job("r0", order, PRIORITY_RECEIPT),
+        _job("r1", order, PRIORITY_RECEIPT),
+        _job("DRAWER", order, PRIORITY_DRAWER),
+    ]
+    assert _executed(PrinterWorker(_printer()), jobs, order) == ["DRAWER", "r0", "r1", "raw"]
+
+
+def test_drawer_is_never_overtaken_by_aged_jobs():
+    order = []
+    jobs = [_job(f"r{i}", order, PRIORITY_RECEIPT, waited=3 * AGING_STEP) for i in range(5)]
+    jobs.append(_job("raw", order, PRIORITY_RAW, waited=5 * AGING_STEP))
+    jobs.append(_job("DRAWER", order, PRIORITY_DRAWER))
+    assert _executed(PrinterWorker(_printer()), jobs, order) == [
+        "DRAWER", "raw", "r0", "r1", "r2", "r3", "r4",
+    ]
+
+
+def test_raw_job_ages_past_fresh_receipts():
+    order = []
+    worker = PrinterWorker(_printer())
+    jobs = [
+        _job("r0", order, PRIORITY_RECEIPT),
+        _job("r1", order, PRIORITY_RECEIPT),
+        # One class below the receipts, but waited two steps: it goes first
+        _job("old-raw", order, PRIORITY_RAW, waited=2 * AGING_STEP),
+        _job("new-raw", order, PRIORITY_RAW),
+    ]
+    assert _executed(worker, jobs, order) == ["old-raw", "r0", "r1", "new-raw"]
+    assert worker.stats_dict()["classes"]["raw"]["aged"] == 1
+
+
+def test_class_limits():
+    worker = PrinterWorker(_printer(), class_limits=(None, 2, 1))
+    gate = threading.Event()
+    started = threading.Event()
+    worker.submit(PrintJob(action="BLOCK", func=lambda: (started.set(), gate.wait(5)),
+                           args=(), kwargs={}))
+    assert started.wait(5)
+    try:
+        order = []
+        for i in range(2):
+            worker.submit(_job(f"r{i}", order, PRIORITY_RECEIPT))
+        worker.submit(_job("raw", order, PRIORITY_RAW))
+        with pytest.raises(SpoolerFullError):
+            worker.submit(_job("r2", order, PRIORITY_RECEIPT))
+        with pytest.raises(SpoolerFullError):
+            worker.submit(_job("raw2", order, PRIORITY_RAW))
+        # The drawer class has no cap
+        for i in range(50):
+            worker.submit(_job(f"d{i}", order, PRIORITY_DRAWER))
+        classes = worker.stats_dict()["classes"]
+        assert classes["receipt"]["rejected"] == 1 and classes["raw"]["rejected"] == 1
+        assert classes["drawer"]["queue_depth"] == 50
+    finally:
+        gate.set()
+
+
+
+def test_backlog_over_max_queue_seconds_is_rejected():
+    printer_name = _printer()
+    printer_throughput.record(printer_name, 1000, 1.0)  # 1000 bytes/s
+    worker = PrinterWorker(printer_name)
+    gate = threading.Event()
+    started = threading.Event()
+    # Running drawer job: no payload size, estimated at the drawer class average
+    worker.submit(PrintJob(action="BLOCK", func=lambda: (started.set(), gate.wait(5)),
+                           args=(), kwargs={}, priority=PRIORITY_DRAWER))
+    assert started.wait(5)
+    try:
+        order = []
+        # 10 KB raw jobs: 10s each at the measured rate, not the class average
+        for i in range(3):
+            worker.submit(_job(f"raw{i}", order, PRIORITY_RAW, nbytes=10_000))
+        assert worker.load()["eta_s"] == pytest.approx(30.5, abs=0.01)
+        with pytest.raises(SpoolerBusyError) as rejected:
+            worker.submit(_job("raw3", order, PRIORITY_RAW, nbytes=10_000))
+        assert rejected.value.retry_after == pytest.approx(0.5)
+        # Receipts only wait behind the running job: the raw backlog is not ahead of them
+        worker.submit(_job("r0", order, PRIORITY_RECEIPT))
+        assert worker.stats_dict()["classes"]["raw"]["rejected"] == 1
+    finally:
+        gate.set()
+
+
+def test_payload_size_counts_ready_bytes_only():
+    assert payload_size(("printer", b"abc"), {"data": memoryview(b"12345"), "cut": True}) == 8
+    assert payload_size(("printer",), {"receipt_data": {"items": []}}) == 0
@@ -0,0 +1,207 @@
+# tests/test_transports.py
+import socket
+import threading
+import time
+import uuid
+
+import pytest
+
+import transports
+from transports import (
+    TransportPool, PrinterTransport, PartialWriteError, POOLED_PROBE_TIMEOUT, DLE_EOT,
+)
+
+# Scheduling slack on top of the probe budget
+SLACK = 0.15
+
+
+class FakePrinter:
+    """طابعة شبكة وهمية على 127.0.0.1: تسجل ما يصلها وترد على DLE EOT من status (None = لا ترد)."""
+
+    def __init__(self, status: dict[int, int] | None = None):
+        self.status = status
+        self.received = bytearray()
+        self.connections = 0
+        self._conns: list[socket.socket] = []
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.name = f"tcp://127.0.0.1:{self._server.getsockname()[1]}"
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            self._conns.append(conn)
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: socket.socket):
+        with conn:
+            while data := conn.recv(4096):
+                self.received += data
+                if self.status is None:
+                    continue
+                pos = data.find(DLE_EOT)
+                while pos >= 0 and pos + 2 < len(data):
+                    conn.sendall(bytes([self.status[data[pos + 2]]]))
+                    pos = data.find(DLE_EOT, pos + 3)
+
+    def drop_connections(self):
+        """الطابعة تغلق الاتصالات المفتوحة (مثلاً بعد خمول طويل)."""
+        for conn in self._conns:
+            conn.shutdown(socket.SHUT_RDWR)
+        self._conns.clear()
+
+    def close(self):
+        self._server.close()
+
+
+@pytest.fixture
+def pool():
+    pool = TransportPool()
+    yield pool
+    pool.close_all()
+
+
+def test_probe_decodes_status(pool):
+    printer = FakePrinter({1: 0x12, 2: 0x12, 4: 0x12})
+    pool.send(printer.name, b"\x1b@", "init")
+    status = pool.probe(printer.name)
+    assert status.online
+
+    printer.status = {1: 0x12, 2: 0x12, 4: 0x72}
+    status = pool.probe(printer.name)
+    assert not status.online and status.reason == "paper out"
+    # Both probes ran on the pooled connection
+    assert printer.connections == 1
+    printer.close()
+
+
+def test_pooled_probe_is_bounded(pool):
+    printer = FakePrinter(status=None)  # never answers DLE EOT
+    pool.send(printer.name, b"\x1b@", "init")
+    started = time.monotonic()
+    assert pool.probe(printer.name) is None
+    assert time.monotonic() - started < POOLED_PROBE_TIMEOUT + SLACK
+    printer.close()
+
+
+def test_drawer_kick_waits_at_most_the_probe_budget(pool):
+    printer = FakePrinter(status=None)
+    pool.send(printer.name, b"\x1b@", "init")
+    probing = threading.Thread(target=pool.probe, args=(printer.name,))
+    probing.start()
+    time.sleep(0.02)
+    started = time.monotonic()
+    pool.send(printer.name, b"\x1bp\x00\x3c\x78", "Open Cash Drawer")
+    assert time.monotonic() - started < POOLED_PROBE_TIMEOUT + SLACK
+    probing.join()
+    assert printer.received.endswith(b"\x1bp\x00\x3c\x78")
+    printer.close()
+
+
+def test_probe_without_pooled_connection_is_short_lived(pool):
+    printer = FakePrinter({1: 0x12, 2: 0x12, 4: 0x12})
+    assert pool.probe(printer.name).online
+    # The probe connection is not kept: a closed channel stays closed
+    assert pool.stats()["open_connections"] == []
+    assert printer.connections == 1
+    printer.close()
+
+
+def test_idle_connections_are_closed_but_the_drawer_channel_stays_warm():
+    pool = TransportPool(idle_timeout=0.05)
+    drawer, receipts = FakePrinter(), FakePrinter()
+    pool.warm(drawer.name)
+    pool.send(receipts.name, b"\x1b@", "init")
+    time.sleep(0.1)
+    pool.evict_idle()
+    assert pool.stats()["open_connections"] == [drawer.name]
+
+    # The printer dropped the idle channel: the janitor reopens it before the next kick
+    drawer.drop_connections()
+    time.sleep(0.05)
+    opens = pool.stats()["opens"]
+    pool.evict_idle()
+    assert pool.stats()["opens"] == opens + 1
+    pool.send(drawer.name, b"\x1bp\x00\x3c\x78", "Open Cash Drawer")
+    assert pool.stats()["reuses"] == 1
+    pool.close_all()
+    drawer.close()
+    receipts.close()
+
+
+def test_probe_does_not_recreate_a_discarded_printer(pool):
+    printer = FakePrinter({1: 0x12, 2: 0x12, 4: 0x12})
+    pool.send(printer.name, b"\x1b@", "init")
+    pool.discard(printer.name)
+    assert pool.probe(printer.name).online
+    assert printer.name not in pool._entries
+    assert pool.stats()["open_connections"] == []
+    printer.close()
+
+
+class FailingTransport(PrinterTransport):
+    """يكتب الدفعات في written ويفشل عند الدفعة رقم fail_at في المحاولة الأولى فقط."""
+
+    def __init__(self, target: str, fail_at: int | None, discards_failed_jobs: bool = False):
+        super().__init__(target)
+        self.fail_at = fail_at
+        self.discards_failed_jobs = discards_failed_jobs
+        self.written: list[bytes] = []
+
+    def open(self) -> None:
+        pass
+
+    def write_chunks(self, chunks, job_name: str) -> int:
+        total = 0
+        for i, chunk in enumerate(chunks):
+            if i == self.fail_at:
+                self.fail_at = None
+                raise OSError("write failed")
+            self.written.append(bytes(chunk))
+            total += len(chunk)
+        return total
+
+    def close(self) -> None:
+        pass
+
+
+def _failing(monkeypatch, fail_at, discards_failed_jobs=False) -> tuple[str, FailingTransport]:
+    name = f"fake-{uuid.uuid4().hex[:8]}"
+    transport = FailingTransport(name, fail_at, discards_failed_jobs)
+    monkeypatch.setattr(transports, "get_transport", lambda printer_name: transport)
+    return name, transport
+
+
+def test_failed_first_write_is_not_partial(pool, monkeypatch):
+    name, transport = _failing(monkeypatch, fail_at=0)
+    with pytest.raises(OSError) as failed:
+        pool.send(name, iter([b"head", b"tail"]), "Receipt")
+    assert not isinstance(failed.value, PartialWriteError)
+    assert transport.written == []
+
+
+def test_failure_after_a_written_chunk_is_partial(pool, monkeypatch):
+    name, transport = _failing(monkeypatch, fail_at=1)
+    with pytest.raises(PartialWriteError):
+        pool.send(name, iter([b"head", b"tail"]), "Receipt")
+    assert transport.written == [b"head"]
+
+
+def test_aborted_document_is_not_partial(pool, monkeypatch):
+    name, _ = _failing(monkeypatch, fail_at=1, discards_failed_jobs=True)
+    with pytest.raises(OSError) as failed:
+        pool.send(name, iter([b"head", b"tail"]), "Receipt")
+    assert not isinstance(failed.value, PartialWriteError)
+
+
+def test_cached_connection_failing_before_any_write_is_retried(pool, monkeypatch):
+    name, transport = _failing(monkeypatch, fail_at=None)
+    pool.send(name, b"init", "init")
+    transport.fail_at = 0  # the cached handle went stale
+    assert pool.send(name, iter([b"head", b"tail"]), "Receipt") == 8
+    assert transport.written == [b"init", b"head", b"tail"]
+    assert pool.stats()["reopens"] == 1
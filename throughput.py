@@ -0,0 +1,93 @@
+# throughput.py
+import threading
+
+# تقدير مدة المهمة قبل أول قياس فعلي (ثوانٍ)
+DEFAULT_JOB_SECONDS = 0.5
+
+# وزن القياس الجديد في المتوسط المتحرك (EWMA)
+ALPHA = 0.2
+
+
+class ThroughputMeter:
+    """
+    سرعة طابعة واحدة: bytes/sec من أزمنة الإرسال الفعلية، ومدة المهمة لكل فئة أولوية
+    (أمر فتح درج من 5 بايت وإيصال بشعار لا يُخلطان في متوسط واحد).
+    """
+
+    __slots__ = ("jobs", "total_bytes", "bytes_per_second", "job_seconds")
+
+    def __init__(self):
+        self.jobs = 0
+        self.total_bytes = 0
+        self.bytes_per_second = 0.0
+        # priority class -> EWMA of the job duration
+        self.job_seconds: dict[str, float] = {}
+
+    def record(self, nbytes: int, seconds: float):
+        rate = nbytes / max(seconds, 1e-4)
+        if self.jobs == 0:
+            self.bytes_per_second = rate
+        else:
+            self.bytes_per_second += ALPHA * (rate - self.bytes_per_second)
+        self.jobs += 1
+        self.total_bytes += nbytes
+
+    def record_job(self, kind: str, seconds: float):
+        current = self.job_seconds.get(kind)
+        if current is None:
+            self.job_seconds[kind] = seconds
+        else:
+            self.job_seconds[kind] = current + ALPHA * (seconds - current)
+
+    def to_dict(self) -> dict:
+        return {
+            "jobs_measured": self.jobs,
+            "bytes_per_s": round(self.bytes_per_second),
+            "avg_job_ms": {kind: round(s * 1000, 1) for kind, s in self.job_seconds.items()},
+        }
+
+
+class ThroughputRegistry:
+    """قياسات السرعة لكل الطابعات، تُغذّى من TransportPool.send وعامل كل طابعة."""
+
+    def __init__(self):
+        self._meters: dict[str, ThroughputMeter] = {}
+        self._lock = threading.Lock()
+
+    def _meter(self, printer_name: str) -> ThroughputMeter:
+        meter = self._meters.get(printer_name)
+        if meter is None:
+            meter = self._meters[printer_name] = ThroughputMeter()
+        return meter
+
+    def record(self, printer_name: str, nbytes: int, seconds: float):
+        """زمن إرسال مهمة (من TransportPool.send)."""
+        with self._lock:
+            self._meter(printer_name).record(nbytes, seconds)
+
+    def record_job(self, printer_name: str, kind: str, seconds: float):
+        """مدة تنفيذ مهمة ناجحة من فئة kind (من عامل الطابعة)."""
+        with self._lock:
+            self._meter(printer_name).record_job(kind, seconds)
+
+    def job_seconds(self, printer_name: str, kind: str) -> float:
+        """المدة المتوقعة لمهمة واحدة من فئة kind على هذه الطابعة."""
+        with self._lock:
+            meter = self._meters.get(printer_name)
+            if meter is None:
+                return DEFAULT_JOB_SECONDS
+            return meter.job_seconds.get(kind, DEFAULT_JOB_SECONDS)
+
+    def bytes_per_second(self, printer_name: str) -> float:
+        """سرعة الإرسال المقاسة لهذه الطابعة (0 قبل أول قياس)."""
+        with self._lock:
+            meter = self._meters.get(printer_name)
+            return meter.bytes_per_second if meter is not None else 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {name: m.to_dict() for name, m in self._meters.items()}
+
+
+# ── Singleton ──
+printer_throughput = ThroughputRegistry()
@@ -0,0 +1,644 @@
+# transports.py
+import os
+import select
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Iterable, Iterator
+from urllib.parse import urlsplit, parse_qs
+from breaker import printer_breakers, PrinterStatus
+from logger import get_logger
+from throughput import printer_throughput
+
+log = get_logger("transport")
+
+# منفذ الطباعة الخام الافتراضي (JetDirect / AppSocket)
+DEFAULT_TCP_PORT = 9100
+TCP_TIMEOUT = 10.0
+
+# إغلاق الاتصالات غير المستخدمة بعد هذه المدة (ثوانٍ)
+IDLE_TIMEOUT = 120.0
+
+# مهلة انتظار رد DLE EOT من الطابعة
+PROBE_TIMEOUT = 1.0
+
+# أقصى مدة للفحص كله على الاتصال المخزن (قناة فتح الدرج نفسها): أمر فتح يصل أثناء
+# الفحص ينتظر هذه المدة على الأكثر
+POOLED_PROBE_TIMEOUT = 0.25
+
+# مهلة الاتصال القصير لفحص الحالة (أقصر من TCP_TIMEOUT حتى لا يتأخر خيط المراقبة)
+PROBE_CONNECT_TIMEOUT = 2.0
+
+# ESC/POS real-time status: DLE EOT n
+DLE_EOT = b"\x10\x04"
+STATUS_PRINTER = 1
+STATUS_OFFLINE_CAUSE = 2
+STATUS_PAPER_SENSOR = 4
+
+
+def decode_dle_eot(printer: int, offline: int, paper: int) -> PrinterStatus:
+    """تفسير ردود DLE EOT 1 / 2 / 4 إلى حالة الطابعة."""
+    flags = {
+        "offline": bool(printer & 0x08),
+        "cover_open": bool(offline & 0x04),
+        "paper_out": bool(offline & 0x20) or bool(paper & 0x60),
+        "paper_near_end": bool(paper & 0x0C),
+        "error": bool(offline & 0x40),
+    }
+    for flag, reason in (("cover_open", "cover open"), ("paper_out", "paper out"),
+                         ("error", "printer error"), ("offline", "offline")):
+        if flags[flag]:
+            return PrinterStatus(online=False, reason=reason, flags=flags)
+    return PrinterStatus(online=True, flags=flags)
+
+
+class PartialWriteError(RuntimeError):
+    """فشل الإرسال بعد تسليم جزء من المهمة للطابعة: ربما طُبع جزء منها."""
+
+
+class PrinterTransport(ABC):
+    """
+    واجهة موحدة لإرسال بيانات RAW إلى طابعة.
+
+    يتم اختيار الـ backend حسب صيغة اسم الطابعة:
+        tcp://192.168.1.50:9100     طابعة شبكة (RAW 9100)
+        file:///tmp/printer.bin      ملف (للاختبار وقياس الأداء)
+        serial:///dev/ttyUSB0?baud=19200   منفذ تسلسلي
+        pty:///dev/pts/3             pseudo-terminal (طابعة وهمية)
+        أي اسم آخر                   طابعة ويندوز عبر win32print
+    """
+
+    scheme = ""
+    # A failed job is discarded whole: nothing of it reaches the printer
+    discards_failed_jobs = False
+
+    def __init__(self, target: str):
+        self.target = target
+
+    @abstractmethod
+    def open(self) -> None:
+        ...
+
+    @abstractmethod
+    def write_chunks(self, chunks: Iterable[bytes], job_name: str) -> int:
+        """كتابة مهمة واحدة على دفعات فور توفرها. يرجع عدد البايتات المرسلة."""
+
+    def write_job(self, data: bytes, job_name: str) -> int:
+        return self.write_chunks((data,), job_name)
+
+    @abstractmethod
+    def close(self) -> None:
+        ...
+
+    def is_alive(self) -> bool:
+        """فحص سريع لصلاحية الاتصال المفتوح قبل إعادة استخدامه."""
+        return True
+
+    def probe(self, timeout: float = PROBE_TIMEOUT) -> PrinterStatus | None:
+        """
+        فحص حالة الطابعة على الاتصال المفتوح خلال timeout ثانية على الأكثر.
+        None إذا لم تكن الحالة معروفة.
+        """
+        return None
+
+    def probe_once(self) -> PrinterStatus | None:
+        """فحص على اتصال قصير مستقل: يُفتح للفحص فقط ثم يُغلق."""
+        self.open()
+        try:
+            return self.probe()
+        finally:
+            self.close()
+
+    def _query_status(self, n: int, timeout: float) -> int | None:
+        """إرسال DLE EOT n وقراءة بايت الرد (None إذا لم ترد الطابعة خلال timeout أو لا يدعمه الاتصال)."""
+        return None
+
+    def _probe_escpos(self, timeout: float) -> PrinterStatus | None:
+        deadline = time.monotonic() + timeout
+        printer = self._query_status(STATUS_PRINTER, timeout)
+        if printer is None:
+            # No real-time status support (or disabled on the printer)
+            return None
+        # The three queries share one budget; a late reply is drained by the next probe
+        offline = self._query_status(STATUS_OFFLINE_CAUSE, max(0.0, deadline - time.monotonic())) or 0
+        paper = self._query_status(STATUS_PAPER_SENSOR, max(0.0, deadline - time.monotonic())) or 0
+        return decode_dle_eot(printer, offline, paper)
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} {self.target!r}>"
+
+
+# PRINTER_INFO_2 Status / Attributes bits (winspool.h)
+WIN32_STATUS_ERROR = 0x00000002
+WIN32_STATUS_PAPER_JAM = 0x00000008
+WIN32_STATUS_PAPER_OUT = 0x00000010
+WIN32_STATUS_OFFLINE = 0x00000080
+WIN32_STATUS_NOT_AVAILABLE = 0x00001000
+WIN32_STATUS_DOOR_OPEN = 0x00400000
+WIN32_ATTRIBUTE_WORK_OFFLINE = 0x00000400
+
+
+class Win32Transport(PrinterTransport):
+    """الطباعة عبر Windows spooler (win32print)."""
+
+    scheme = "win32"
+    # AbortDocPrinter drops the whole document from the spooler
+    discards_failed_jobs = True
+
+    def __init__(self, target: str):
+        super().__init__(target)
+        import win32print
+        self._win32print = win32print
+        self._handle = None
+
+    def open(self) -> None:
+        self._handle = self._win32print.OpenPrinter(self.target)
+
+    def write_chunks(self, chunks: Iterable[bytes], job_name: str) -> int:
+        wp = self._win32print
+        total = 0
+        wp.StartDocPrinter(self._handle, 1, (job_name, None, "RAW"))
+        try:
+            wp.StartPagePrinter(self._handle)
+            for chunk in chunks:
+                if chunk:
+                    wp.WritePrinter(self._handle, chunk)
+                    total += len(chunk)
+            wp.EndPagePrinter(self._handle)
+        except BaseException:
+            # A render error mid-stream must not commit half a receipt to the spooler
+            wp.AbortDocPrinter(self._handle)
+            raise
+        wp.EndDocPrinter(self._handle)
+        return total
+
+    def probe(self, timeout: float = PROBE_TIMEOUT) -> PrinterStatus | None:
+        # A local spooler query: no round trip to the printer
+        info = self._win32print.GetPrinter(self._handle, 2)
+        status = info["Status"]
+        flags = {
+            "offline": bool(status & WIN32_STATUS_OFFLINE
+                            or info["Attributes"] & WIN32_ATTRIBUTE_WORK_OFFLINE),
+            "paper_out": bool(status & WIN32_STATUS_PAPER_OUT),
+            "paper_jam": bool(status & WIN32_STATUS_PAPER_JAM),
+            "cover_open": bool(status & WIN32_STATUS_DOOR_OPEN),
+            "error": bool(status & (WIN32_STATUS_ERROR | WIN32_STATUS_NOT_AVAILABLE)),
+            "queued_jobs": info["cJobs"],
+        }
+        for flag, reason in (("cover_open", "cover open"), ("paper_out", "paper out"),
+                             ("paper_jam", "paper jam"), ("error", "printer error"),
+                             ("offline", "offline")):
+            if flags[flag]:
+                return PrinterStatus(online=False, reason=reason, flags=flags)
+        return PrinterStatus(online=True, flags=flags)
+
+    def close(self) -> None:
+        if self._handle is not None:
+            try:
+                self._win32print.ClosePrinter(self._handle)
+            finally:
+                self._handle = None
+
+
+class TcpTransport(PrinterTransport):
+    """طابعة شبكة عبر socket خام على المنفذ 9100."""
+
+    scheme = "tcp"
+
+    def __init__(self, target: str, host: str, port: int = DEFAULT_TCP_PORT):
+        super().__init__(target)
+        self.host = host
+        self.port = port
+        self._sock: socket.socket | None = None
+
+    def open(self) -> None:
+        self._sock = socket.create_connection((self.host, self.port), timeout=TCP_TIMEOUT)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def write_chunks(self, chunks: Iterable[bytes], job_name: str) -> int:
+        total = 0
+        for chunk in chunks:
+            self._sock.sendall(chunk)
+            total += len(chunk)
+        return total
+
+    def is_alive(self) -> bool:
+        if self._sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            if not readable:
+                return True
+            # Readable with no data means the printer closed the connection
+            return self._sock.recv(1, socket.MSG_PEEK) != b""
+        except OSError:
+            return False
+
+    def probe(self, timeout: float = PROBE_TIMEOUT) -> PrinterStatus | None:
+        return self._probe_escpos(timeout)
+
+    def probe_once(self) -> PrinterStatus | None:
+        self._sock = socket.create_connection((self.host, self.port), timeout=PROBE_CONNECT_TIMEOUT)
+        try:
+            return self.probe()
+        finally:
+            self.close()
+
+    def _query_status(self, n: int, timeout: float) -> int | None:
+        sock = self._sock
+        # Drop stale bytes (e.g. automatic status back) so the reply is ours
+        while select.select([sock], [], [], 0)[0]:
+            if not sock.recv(256):
+                raise ConnectionError("Printer closed the connection")
+        sock.sendall(DLE_EOT + bytes([n]))
+        if not select.select([sock], [], [], timeout)[0]:
+            return None
+        reply = sock.recv(1)
+        if not reply:
+            raise ConnectionError("Printer closed the connection")
+        return reply[0]
+
+    def close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = None
+
+
+class FileTransport(PrinterTransport):
+    """كتابة البيانات في ملف (طابعة وهمية للاختبار)."""
+
+    scheme = "file"
+
+    def __init__(self, target: str, path: str):
+        super().__init__(target)
+        self.path = path
+        self._fh = None
+
+    def open(self) -> None:
+        self._fh = open(self.path, "ab", buffering=0)
+
+    def write_chunks(self, chunks: Iterable[bytes], job_name: str) -> int:
+        total = 0
+        for chunk in chunks:
+            self._fh.write(chunk)
+            total += len(chunk)
+        return total
+
+    def close(self) -> None:
+        if self._fh is not None:
+            try:
+                self._fh.close()
+            finally:
+                self._fh = None
+
+
+class SerialTransport(PrinterTransport):
+    """منفذ تسلسلي أو pty عبر واصف ملف خام."""
+
+    scheme = "serial"
+
+    def __init__(self, target: str, path: str, baud: int | None = None):
+        super().__init__(target)
+        self.path = path
+        self.baud = baud
+        self._fd: int | None = None
+
+    def open(self) -> None:
+        flags = os.O_RDWR | getattr(os, "O_NOCTTY", 0) | getattr(os, "O_BINARY", 0)
+        self._fd = os.open(self.path, flags)
+        try:
+            self._configure()
+        except Exception:
+            self.close()
+            raise
+
+    def _configure(self) -> None:
+        try:
+            import termios
+            import tty
+        except ImportError:
+            return
+        if not os.isatty(self._fd):
+            return
+        tty.setraw(self._fd)
+        if self.baud:
+            speed = getattr(termios, f"B{self.baud}", None)
+            if speed is None:
+                raise ValueError(f"Unsupported baud rate: {self.baud}")
+            attrs = termios.tcgetattr(self._fd)
+            attrs[4] = attrs[5] = speed
+            termios.tcsetattr(self._fd, termios.TCSANOW, attrs)
+
+    def write_chunks(self, chunks: Iterable[bytes], job_name: str) -> int:
+        total = 0
+        for chunk in chunks:
+            view = memoryview(chunk)
+            while view:
+                written = os.write(self._fd, view)
+                view = view[written:]
+            total += len(chunk)
+        return total
+
+    def probe(self, timeout: float = PROBE_TIMEOUT) -> PrinterStatus | None:
+        return self._probe_escpos(timeout)
+
+    def _query_status(self, n: int, timeout: float) -> int | None:
+        try:
+            # Drop stale bytes so the reply is ours
+            while select.select([self._fd], [], [], 0)[0]:
+                if not os.read(self._fd, 256):
+                    break
+        except (OSError, ValueError):
+            # select() on device handles is not supported on Windows
+            return None
+        os.write(self._fd, DLE_EOT + bytes([n]))
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return None
+        reply = os.read(self._fd, 1)
+        return reply[0] if reply else None
+
+    def close(self) -> None:
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            finally:
+                self._fd = None
+
+
+def get_transport(printer_name: str) -> PrinterTransport:
+    """اختيار الـ backend المناسب حسب صيغة اسم الطابعة."""
+    if "://" not in printer_name:
+        return Win32Transport(printer_name)
+
+    parts = urlsplit(printer_name)
+    scheme = parts.scheme.lower()
+    if scheme == "tcp":
+        if not parts.hostname:
+            raise ValueError(f"Invalid TCP printer address: {printer_name}")
+        return TcpTransport(printer_name, parts.hostname, parts.port or DEFAULT_TCP_PORT)
+    if scheme == "file":
+        return FileTransport(printer_name, parts.netloc + parts.path)
+    if scheme in ("serial", "pty"):
+        baud = parse_qs(parts.query).get("baud", [None])[0]
+        return SerialTransport(
+            printer_name, parts.netloc + parts.path, int(baud) if baud else None,
+        )
+    raise ValueError(f"Unsupported printer transport: {scheme}")
+
+
+class _ChunkSource:
+    """
+    مصدر الدفعات لمهمة واحدة. الدفعة الأولى تُقرأ مسبقاً (أخطاء التجهيز تظهر قبل
+    فتح المهمة على الطابعة)، و started يصبح True بعد أن يكتب الاتصال دفعة كاملة:
+    بعدها لا تُعاد المهمة لأن جزءاً منها ربما طُبع.
+    """
+
+    __slots__ = ("_first", "_rest", "started", "failed", "atomic")
+
+    def __init__(self, data: bytes | Iterable[bytes]):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            self._first, self._rest = data, iter(())
+        else:
+            self._rest = iter(data)
+            self._first = next(self._rest, b"")
+        self.started = False
+        # True when the producer (not the printer) raised
+        self.failed = False
+        # The transport drops a failed job whole (Win32 AbortDocPrinter): nothing was printed
+        self.atomic = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._first
+        # The transport asks for the next chunk only once the previous one is written
+        self.started = True
+        try:
+            yield from self._rest
+        except Exception:
+            self.failed = True
+            raise
+
+
+class _PoolEntry:
+    __slots__ = ("transport", "lock", "is_open", "last_used", "jobs", "warm")
+
+    def __init__(self, transport: PrinterTransport):
+        self.transport = transport
+        self.lock = threading.Lock()
+        self.is_open = False
+        self.last_used = time.monotonic()
+        self.jobs = 0
+        # Opened ahead for the drawer (warm()): kept open instead of closed when idle
+        self.warm = False
+
+    def open(self) -> None:
+        self.transport.open()
+        self.is_open = True
+        self.last_used = time.monotonic()
+
+    def close(self) -> None:
+        self.is_open = False
+        self.transport.close()
+
+
+class TransportPool:
+    """
+    تخزين الاتصالات المفتوحة حسب اسم الطابعة لإعادة استخدامها بين المهام.
+    يتم فحص الاتصال قبل الاستخدام، وإعادة فتحه تلقائياً عند الخطأ،
+    وإغلاقه بعد فترة خمول (عدا قناة فتح الدرج: تبقى مفتوحة ويُعاد فتحها إذا سقطت).
+    """
+
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._entries: dict[str, _PoolEntry] = {}
+        self._lock = threading.Lock()
+        self._janitor: threading.Thread | None = None
+        self.opens: int = 0
+        self.reuses: int = 0
+        self.reopens: int = 0
+
+    def _entry(self, printer_name: str) -> _PoolEntry:
+        with self._lock:
+            entry = self._entries.get(printer_name)
+            if entry is None:
+                entry = _PoolEntry(get_transport(printer_name))
+                self._entries[printer_name] = entry
+            if self._janitor is None:
+                self._janitor = threading.Thread(
+                    target=self._evict_loop, name="transport-janitor", daemon=True,
+                )
+                self._janitor.start()
+                printer_breakers.start(self.probe)
+            return entry
+
+    def _ensure_open(self, entry: _PoolEntry) -> bool:
+        """فتح الاتصال عند الحاجة. يرجع True إذا أُعيد استخدام اتصال قائم."""
+        if entry.is_open:
+            if entry.transport.is_alive():
+                with self._lock:
+                    self.reuses += 1
+                return True
+            log.info("Stale connection to %r, reopening", entry.transport)
+            entry.close()
+        entry.open()
+        with self._lock:
+            self.opens += 1
+        return False
+
+    def send(self, printer_name: str, data: bytes | Iterable[bytes], job_name: str) -> int:
+        """
+        إرسال مهمة (bytes أو دفعات متتالية) عبر اتصال مُعاد استخدامه،
+        مع إعادة الفتح مرة واحدة عند الفشل. يرجع عدد البايتات المرسلة.
+        """
+        source = _ChunkSource(data)
+        # Fail fast on a printer that is known to be down
+        printer_breakers.check(printer_name)
+        started = time.perf_counter()
+        try:
+            total = self._send(printer_name, source, job_name)
+        except Exception as e:
+            if source.failed:
+                # The producer failed: nothing was learned about the printer
+                printer_breakers.end_trial(printer_name)
+                raise
+            printer_breakers.record_failure(printer_name, str(e))
+            if source.started and not source.atomic:
+                raise PartialWriteError(str(e)) from e
+            raise
+        except BaseException:
+            printer_breakers.end_trial(printer_name)
+            raise
+        printer_breakers.record_success(printer_name)
+        printer_throughput.record(printer_name, total, time.perf_counter() - started)
+        return total
+
+    def _send(self, printer_name: str, source: _ChunkSource, job_name: str) -> int:
+        entry = self._entry(printer_name)
+        source.atomic = entry.transport.discards_failed_jobs
+        with entry.lock:
+            reused = self._ensure_open(entry)
+            try:
+                total = entry.transport.write_chunks(source, job_name)
+            except Exception as e:
+                entry.close()
+                # Only a cached handle that failed before any byte was handed to it can be
+                # retried; resending after a partial write could print or kick twice
+                if not reused or source.started:
+                    raise
+                log.warning("Write on cached connection to '%s' failed (%s), reopening", printer_name, e)
+                with self._lock:
+                    self.reopens += 1
+                self._ensure_open(entry)
+                try:
+                    total = entry.transport.write_chunks(source, job_name)
+                except Exception:
+                    entry.close()
+                    raise
+            entry.jobs += 1
+            entry.last_used = time.monotonic()
+        return total
+
+    def warm(self, printer_name: str) -> None:
+        """فتح الاتصال مسبقاً حتى لا تدفع المهمة الأولى تكلفة الفتح."""
+        entry = self._entry(printer_name)
+        printer_breakers.watch(printer_name)
+        with entry.lock:
+            entry.warm = True
+            if not entry.is_open:
+                entry.open()
+                with self._lock:
+                    self.opens += 1
+
+    def probe(self, printer_name: str) -> PrinterStatus | None:
+        """
+        فحص حالة الطابعة (يُستدعى من خيط المراقبة).
+        إذا كانت مهمة قيد الطباعة يتم التخطي: الطابعة تستقبل البيانات بالفعل.
+        الاتصال المخزن يُستخدم فقط إذا كان مفتوحاً (كثير من الطابعات تقبل اتصالاً واحداً)،
+        والفحص عليه محدود بـ POOLED_PROBE_TIMEOUT لأن أمر فتح الدرج ينتظره؛ وإلا يُفحص على
+        اتصال قصير مستقل خارج القفل، فلا يُعاد فتح اتصال أغلقه الخمول ولا تنتظر المهام اتصال الفحص.
+        """
+        with self._lock:
+            # Never creates an entry: a printer discarded after a config change stays gone
+            entry = self._entries.get(printer_name)
+        if entry is None:
+            return get_transport(printer_name).probe_once()
+        if not entry.lock.acquire(blocking=False):
+            return None
+        try:
+            if entry.is_open:
+                if entry.transport.is_alive():
+                    return entry.transport.probe(POOLED_PROBE_TIMEOUT)
+                entry.close()
+        except Exception:
+            entry.close()
+            raise
+        finally:
+            entry.lock.release()
+        return get_transport(printer_name).probe_once()
+
+    def discard(self, printer_name: str) -> None:
+        """إغلاق الاتصال وحذفه من الذاكرة (مثلاً بعد تغيير الإعدادات)."""
+        with self._lock:
+            entry = self._entries.pop(printer_name, None)
+        if entry is not None:
+            with entry.lock:
+                entry.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            names = list(self._entries)
+        for name in names:
+            self.discard(name)
+
+    def _evict_loop(self):
+        while True:
+            time.sleep(max(1.0, self.idle_timeout / 4))
+            self.evict_idle()
+
+    def evict_idle(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                name for name, e in self._entries.items()
+                if not e.warm and now - e.last_used > self.idle_timeout
+            ]
+            warm = [e for e in self._entries.values() if e.warm]
+        for name in idle:
+            log.debug("Closing idle connection to printer '%s'", name)
+            self.discard(name)
+        for entry in warm:
+            self._keep_warm(entry)
+
+    def _keep_warm(self, entry: _PoolEntry) -> None:
+        """إعادة فتح قناة فتح الدرج إذا أغلقتها الطابعة أو خطأ سابق (قبل وصول الأمر التالي)."""
+        if not entry.lock.acquire(blocking=False):
+            return  # in use: the job checks the connection itself
+        try:
+            if entry.is_open and entry.transport.is_alive():
+                return
+            if entry.is_open:
+                entry.close()
+            entry.open()
+            with self._lock:
+                self.opens += 1
+            log.debug("Drawer channel to %r reopened", entry.transport)
+        except Exception as e:
+            log.debug("Could not reopen drawer channel to %r: %s", entry.transport, e)
+        finally:
+            entry.lock.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            open_printers = [name for name, e in self._entries.items() if e.is_open]
+        return {
+            "open_connections": open_printers,
+            "opens": self.opens,
+            "reuses": self.reuses,
+            "reopens": self.reopens,
+        }
+
+
+# ── Singleton ──
+transport_pool = TransportPool()
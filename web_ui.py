@@ -1,18 +1,36 @@
 # web_ui.py
-from fastapi import FastAPI, HTTPException
+import asyncio
+import itertools
+import json
+import math
+import secrets
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, RedirectResponse, Response
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, Any
-import win32print
+from typing import Optional, Any, Callable, Literal
+try:
+    import win32print
+except ImportError:  # non-Windows build/test machines
+    win32print = None
 from config import (
-    load_config, save_config, AgentConfig,
+    load_config, update_config, config_snapshot, AgentConfig,
     ConfigUpdatePayload, APP_VERSION,
 )
 from printer_raw import open_drawer, print_receipt, print_raw_receipt
-from state import app_state
-from dashboard import get_dashboard_html
-from logger import get_logger
+from breaker import printer_breakers
+from routing import resolve_printer, order_jobs, fan_out
+from idempotency import idempotency_cache, DONE, PENDING
+from spool_store import durable_spool
+from spooler import print_spooler, SpoolerBusyError, JobTimeoutError
+from transports import transport_pool
+from state import app_state, RateLimiter
+from dashboard import dashboard_asset
+from log_search import search_logs, MAX_LINES
+from logger import (
+    get_logger, log_context, logging_stats, set_level, set_sampling, set_json_output,
+    LOG_LEVELS,
+)
 
 log = get_logger("web_ui")
 
@@ -30,6 +48,8 @@ class ReceiptPrintRequest(BaseModel):
     encoding: str = "cp437"  # ترميز النص
     cut_after: bool = True  # قص الورقة
     open_drawer: bool = False  # فتح الدرج بعد الطباعة
+    include_logo: bool = True  # طباعة الشعار (إذا كان logo_path محدداً)
+    target: Optional[str] = None  # الطابعة: "receipt" (افتراضي) أو اسم من printers
 
 
 class RawPrintRequest(BaseModel):
@@ -37,6 +57,27 @@ class RawPrintRequest(BaseModel):
     data: str  # النص أو base64
     encoding: str = "utf-8"
     cut_after: bool = True
+    format: Literal["auto", "base64", "text"] = "auto"  # auto = التخمين القديم
+    target: Optional[str] = None  # الطابعة: "receipt" (افتراضي) أو اسم من printers
+
+
+class OrderPrintRequest(BaseModel):
+    """طلب طباعة طلب كامل: إيصال + تذاكر المحطات (مطبخ / بار) بالتوازي."""
+    receipt_data: dict
+    print_receipt: bool = True  # طباعة الإيصال على الطابعة الرئيسية
+    paper_width: int = 48
+    encoding: str = "cp437"
+    cut_after: bool = True
+    open_drawer: bool = False
+    include_logo: bool = True
+
+
+class LoggingUpdate(BaseModel):
+    """تغيير إعدادات السجل أثناء التشغيل (لا يُحفظ؛ للحفظ استخدم log_level في /config)."""
+    level: Optional[str] = None  # مستوى البرنامج العام
+    loggers: dict[str, str] = {}  # {"ws_client": "DEBUG"} ، NOTSET = العودة للمستوى العام
+    sampling: dict[str, int] = {}  # {"spooler": 10} = سطر INFO من كل 10 ، 1 = الكل
+    json_format: Optional[bool] = None  # JSON lines بدل السطور النصية
 
 # CORS: السماح لطلبات من واجهة Odoo POS (متصفح على نفس الجهاز أو خادم Odoo)
 app.add_middleware(
@@ -48,12 +89,59 @@ app.add_middleware(
 )
 
 
+# ── Request IDs ──
+# كل سطر سجل أثناء الطلب (وفي مهام الطباعة التي يرسلها) يحمل request_id:
+# من ترويسة X-Request-Id إن وُجدت، وإلا رقم جديد يُعاد في الرد.
+_request_ids = itertools.count(1)
+
+
+class RequestIdMiddleware:
+    """ASGI middleware خفيف (بدون BaseHTTPMiddleware) لا يغلّف جسم الرد."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_id = ""
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or f"r{next(_request_ids)}"
+        header = (b"x-request-id", request_id.encode("latin-1"))
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), header]
+            await send(message)
+
+        with log_context(request_id=request_id):
+            await self.app(scope, receive, send_with_id)
+
+
+app.add_middleware(RequestIdMiddleware)
+
+
 # ── Dashboard ──
 
+def _dashboard_response(http: Request) -> Response:
+    """الصفحة المولّدة مسبقاً بأفضل ضغط يقبله المتصفح، و 304 إذا كانت لديه نفس النسخة."""
+    encoding, body = dashboard_asset.negotiate(http.headers.get("accept-encoding", ""))
+    etag = dashboard_asset.etag(encoding)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _not_modified(http, etag):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="text/html; charset=utf-8", headers=headers)
+
+
 @app.get("/", response_class=HTMLResponse)
-def dashboard():
+def dashboard(http: Request):
     """صفحة لوحة التحكم الرئيسية."""
-    return get_dashboard_html()
+    return _dashboard_response(http)
 
 
 @app.get("/favicon.ico", include_in_schema=False)
@@ -64,9 +152,36 @@ def favicon():
 
 # ── API Endpoints ──
 
+# جزء من كل ETag مبني على عدادات: العدادات تبدأ من جديد مع كل تشغيل، فلا يطابق
+# ETag محفوظ من تشغيل سابق نسخة مختلفة تحمل نفس الرقم
+_ETAG_EPOCH = secrets.token_hex(4)
+
+
+def _not_modified(http: Request, etag: str) -> bool:
+    """هل يملك العميل النسخة الحالية؟ (If-None-Match، مقارنة ضعيفة كما في RFC 9110)"""
+    header = http.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    current = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == current for tag in header.split(","))
+
+
+def _conditional(http: Request, etag: str, render: Callable[[], bytes]) -> Response:
+    """304 بدون جسم إذا لم تتغير النسخة، وإلا الجسم (يُبنى فقط عند الحاجة) مع ETag."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _not_modified(http, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(render(), media_type="application/json", headers=headers)
+
+
 @app.get("/printers")
 def list_printers():
     """قائمة الطابعات المثبتة على النظام."""
+    if win32print is None:
+        # No Windows spooler: only URI printers (tcp://, file://, serial://) apply
+        return {"printers": []}
     try:
         printers = [
             p[2] for p in win32print.EnumPrinters(
@@ -80,32 +195,39 @@ def list_printers():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# (config version, serialized GET /config body)
+_config_body: tuple[int, bytes] = (-1, b"")
+
+
 @app.get("/config")
-def get_config():
+def get_config(http: Request):
     """قراءة الإعدادات مع إخفاء جزء من Token."""
-    cfg = load_config()
-    data = cfg.model_dump()
-    # إخفاء Token - إظهار آخر 4 أحرف فقط
-    token = data.get("device_token", "")
-    if len(token) > 4:
-        data["device_token_masked"] = "●" * (len(token) - 4) + token[-4:]
-    else:
-        data["device_token_masked"] = "●" * len(token)
-    return data
+    global _config_body
+    version, cfg = config_snapshot()
+    if _config_body[0] != version:
+        data = cfg.model_dump()
+        # إخفاء Token - إظهار آخر 4 أحرف فقط
+        token = data.get("device_token", "")
+        if len(token) > 4:
+            data["device_token_masked"] = "●" * (len(token) - 4) + token[-4:]
+        else:
+            data["device_token_masked"] = "●" * len(token)
+        _config_body = (version, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+    body = _config_body[1]
+    return _conditional(http, f'"c{_ETAG_EPOCH}-{version}"', lambda: body)
 
 
 @app.post("/config")
 def set_config(payload: ConfigUpdatePayload):
     """تحديث الإعدادات مع التحقق من صحة البيانات."""
-    cfg = load_config()
     update_data = payload.model_dump(exclude_none=True)
 
     if not update_data:
         raise HTTPException(status_code=400, detail="No valid fields to update")
 
     try:
-        new_cfg = AgentConfig(**{**cfg.model_dump(), **update_data})
-        save_config(new_cfg)
+        # Printers, rate limits and logging follow through config subscribers
+        new_cfg = update_config(update_data)
         log.info("Config updated via REST: %s", list(update_data.keys()))
 
         result = new_cfg.model_dump()
@@ -125,22 +247,95 @@ def set_config(payload: ConfigUpdatePayload):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+def _queued_job(error: BaseException | None):
+    """المهمة التي انتهت مهلة انتظارها (JobTimeoutError، ولو غُلّف في HTTPException)."""
+    while error is not None:
+        if isinstance(error, JobTimeoutError):
+            return error.future
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def _run_idempotent(cmd: str, key: Optional[str], action: Callable[[], dict]) -> dict:
+    """تنفيذ طلب مع Idempotency-Key: التكرار يُرجع الرد الأصلي بدون لمس الطابعة."""
+    if not key:
+        return action()
+    state, result = idempotency_cache.begin(cmd, key)
+    if state == DONE:
+        log.info("Replaying response for idempotency key %s", key)
+        return {**result, "replayed": True}
+    if state == PENDING:
+        raise HTTPException(status_code=409, detail="Request already in progress")
+    try:
+        result = action()
+    except BaseException as e:
+        # Timed out but still queued: the key stays pending until the job actually finishes
+        job = _queued_job(e)
+        if job is not None:
+            idempotency_cache.hold(cmd, key, job)
+        else:
+            idempotency_cache.release(cmd, key)
+        raise
+    idempotency_cache.complete(cmd, key, result)
+    return result
+
+
+def _check_rate(limiter: RateLimiter, source: str, http: Request, what: str):
+    """
+    حد المعدل لكل (مصدر، عميل). هوية العميل: Origin (يضبطه المتصفح ولا تستطيع الصفحة تغييره)،
+    ثم عنوان IP. لا تُقبل هوية يرسلها العميل نفسه، وإلا تتجاوز الصفحة الحد بتغييرها.
+    عند التجاوز: 429 مع Retry-After.
+    """
+    client = http.headers.get("origin") or (http.client.host if http.client else "")
+    retry_after = limiter.acquire(source, client)
+    if retry_after:
+        log.warning("Rate limit exceeded for %s (client=%s, retry after %.1fs)", what, client, retry_after)
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded. Retry after {retry_after:.1f}s",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
+def _backlogged(e: SpoolerBusyError) -> HTTPException:
+    """الطابعة متأخرة عن قائمتها: 503 مع Retry-After بدل قبول مهمة ستنتظر طويلاً."""
+    return HTTPException(
+        status_code=503,
+        detail=str(e),
+        headers={"Retry-After": str(math.ceil(e.retry_after))},
+    )
+
+
+def _resolve_printer(cfg: AgentConfig, target: Optional[str]) -> str:
+    """اسم الطابعة لهدف الطلب، مع خطأ 400 واضح إذا لم تكن مضبوطة."""
+    try:
+        printer_name = resolve_printer(cfg, target)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not printer_name:
+        raise HTTPException(status_code=400, detail="No printer configured. Set printer_name first.")
+    return printer_name
+
+
 @app.post("/test/open_drawer")
-def test_open_drawer():
+def test_open_drawer(http: Request, idempotency_key: Optional[str] = Header(default=None)):
     """اختبار فتح درج النقدية."""
-    # Rate limiting
-    if not app_state.drawer_rate_limiter.allow():
-        log.warning("Rate limit exceeded for test open_drawer")
-        raise HTTPException(status_code=429, detail="Rate limit exceeded. Try again later.")
+    return _run_idempotent("OPEN_DRAWER", idempotency_key, lambda: _test_open_drawer(http))
 
+
+def _test_open_drawer(http: Request) -> dict:
     cfg = load_config()
+    _check_rate(app_state.drawer_rate_limiter, "test", http, "test open_drawer")
     try:
-        open_drawer(cfg.printer_name, cfg.drawer_pin, cfg.pulse_on, cfg.pulse_off)
+        elapsed_ms = print_spooler.run_sync(
+            cfg.printer_name, "OPEN_DRAWER", open_drawer,
+            cfg.printer_name, cfg.drawer_pin, cfg.pulse_on, cfg.pulse_off,
+        )
         log.info("Test drawer open: OK")
         app_state.add_history(
             action="OPEN_DRAWER", source="test", status="ok",
         )
-        return {"ok": True}
+        return {"ok": True, "elapsed_ms": round(elapsed_ms, 2)}
     except Exception as e:
         log.error("Test drawer open failed: %s", e)
         app_state.add_history(
@@ -154,92 +349,150 @@ def test_open_drawer():
 # ══════════════════════════════════════════════════════════════════════════════
 
 @app.post("/print/receipt")
-def api_print_receipt(request: ReceiptPrintRequest):
+def api_print_receipt(
+    request: ReceiptPrintRequest,
+    http: Request,
+    idempotency_key: Optional[str] = Header(default=None),
+):
     """
     طباعة إيصال POS كامل.
     يستقبل بيانات الإيصال من Odoo POS (export_for_printing) ويحولها إلى أوامر ESC/POS.
     """
-    # Rate limiting
-    if not app_state.receipt_rate_limiter.allow():
-        log.warning("Rate limit exceeded for print receipt")
-        raise HTTPException(status_code=429, detail="Rate limit exceeded. Try again later.")
-    
+    return _run_idempotent("PRINT_RECEIPT", idempotency_key, lambda: _print_receipt(request, http))
+
+
+def _print_receipt(request: ReceiptPrintRequest, http: Request) -> dict:
     cfg = load_config()
-    if not cfg.printer_name:
-        raise HTTPException(status_code=400, detail="No printer configured. Set printer_name first.")
+    _check_rate(app_state.receipt_rate_limiter, "rest_api", http, "print receipt")
+    printer_name = _resolve_printer(cfg, request.target)
     
     try:
-        print_receipt(
-            printer_name=cfg.printer_name,
+        spool_id = print_spooler.run_sync(
+            printer_name, "PRINT_RECEIPT", print_receipt,
+            printer_name=printer_name,
             receipt_data=request.receipt_data,
             paper_width=request.paper_width,
             encoding=request.encoding,
             cut_after=request.cut_after,
             open_drawer=request.open_drawer,
             drawer_pin=cfg.drawer_pin,
+            logo_path=cfg.logo_path if request.include_logo else "",
         )
-        log.info("Receipt printed via REST API")
+        log.info("Receipt %s via REST API", "spooled" if spool_id else "printed")
         app_state.add_history(
             action="PRINT_RECEIPT", source="rest_api", status="ok",
             detail=f"Order: {request.receipt_data.get('name', 'N/A')}",
         )
-        return {"ok": True, "message": "Receipt printed successfully"}
+        load = print_spooler.load(printer_name)
+        if spool_id:
+            return {"ok": True, "message": "Printer unavailable, receipt queued",
+                    "spool_id": spool_id, **load}
+        return {"ok": True, "message": "Receipt printed successfully", **load}
     
     except Exception as e:
         log.error("Receipt print failed via REST: %s", e)
         app_state.add_history(
             action="PRINT_RECEIPT", source="rest_api", status="error", detail=str(e),
         )
+        if isinstance(e, SpoolerBusyError):
+            raise _backlogged(e)
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.post("/print/raw")
-def api_print_raw(request: RawPrintRequest):
+def api_print_raw(
+    request: RawPrintRequest,
+    http: Request,
+    idempotency_key: Optional[str] = Header(default=None),
+):
     """
     طباعة بيانات خام (نص عادي أو base64).
     مفيد لطباعة تقارير أو نصوص مخصصة.
     """
-    # Rate limiting
-    if not app_state.receipt_rate_limiter.allow():
-        log.warning("Rate limit exceeded for print raw")
-        raise HTTPException(status_code=429, detail="Rate limit exceeded. Try again later.")
-    
+    return _run_idempotent("PRINT_RAW", idempotency_key, lambda: _print_raw(request, http))
+
+
+def _print_raw(request: RawPrintRequest, http: Request) -> dict:
     cfg = load_config()
-    if not cfg.printer_name:
-        raise HTTPException(status_code=400, detail="No printer configured. Set printer_name first.")
+    _check_rate(app_state.receipt_rate_limiter, "rest_api", http, "print raw")
+    printer_name = _resolve_printer(cfg, request.target)
     
     try:
-        print_raw_receipt(
-            printer_name=cfg.printer_name,
+        spool_id = print_spooler.run_sync(
+            printer_name, "PRINT_RAW", print_raw_receipt,
+            printer_name=printer_name,
             raw_data=request.data,
             encoding=request.encoding,
             cut_after=request.cut_after,
+            data_format=request.format,
         )
-        log.info("Raw data printed via REST API")
+        log.info("Raw data %s via REST API", "spooled" if spool_id else "printed")
         app_state.add_history(
             action="PRINT_RAW", source="rest_api", status="ok",
         )
-        return {"ok": True, "message": "Raw data printed successfully"}
+        load = print_spooler.load(printer_name)
+        if spool_id:
+            return {"ok": True, "message": "Printer unavailable, raw data queued",
+                    "spool_id": spool_id, **load}
+        return {"ok": True, "message": "Raw data printed successfully", **load}
     
     except Exception as e:
         log.error("Raw print failed via REST: %s", e)
         app_state.add_history(
             action="PRINT_RAW", source="rest_api", status="error", detail=str(e),
         )
+        if isinstance(e, SpoolerBusyError):
+            raise _backlogged(e)
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.post("/print/order")
+def api_print_order(
+    request: OrderPrintRequest,
+    http: Request,
+    idempotency_key: Optional[str] = Header(default=None),
+):
+    """
+    طباعة طلب على عدة طابعات بالتوازي: الإيصال على الطابعة الرئيسية،
+    وتذكرة لكل محطة حسب category_routes. يرجع النتيجة لكل طابعة.
+    """
+    return _run_idempotent("PRINT_ORDER", idempotency_key, lambda: _print_order(request, http))
+
+
+def _print_order(request: OrderPrintRequest, http: Request) -> dict:
+    cfg = load_config()
+    _check_rate(app_state.receipt_rate_limiter, "rest_api", http, "print order")
+    try:
+        jobs = order_jobs(
+            cfg, request.receipt_data,
+            include_receipt=request.print_receipt,
+            paper_width=request.paper_width,
+            encoding=request.encoding,
+            cut_after=request.cut_after,
+            open_drawer=request.open_drawer,
+            include_logo=request.include_logo,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not jobs:
+        raise HTTPException(status_code=400, detail="Nothing to print for this order")
+
+    results = fan_out(jobs)
+    ok = all(r["ok"] for r in results.values())
+    detail = f"Order: {request.receipt_data.get('name', 'N/A')} → {', '.join(results)}"
+    app_state.add_history(
+        action="PRINT_ORDER", source="rest_api", status="ok" if ok else "error", detail=detail,
+    )
+    return {"ok": ok, "printers": results}
+
+
 @app.post("/test/print")
-def test_print():
+def test_print(http: Request):
     """
     طباعة صفحة اختبار لفحص الطابعة.
     """
-    # Rate limiting
-    if not app_state.receipt_rate_limiter.allow():
-        log.warning("Rate limit exceeded for test print")
-        raise HTTPException(status_code=429, detail="Rate limit exceeded. Try again later.")
-    
     cfg = load_config()
+    _check_rate(app_state.receipt_rate_limiter, "test", http, "test print")
     if not cfg.printer_name:
         raise HTTPException(status_code=400, detail="No printer configured. Set printer_name first.")
     
@@ -267,13 +520,15 @@ def test_print():
     }
     
     try:
-        print_receipt(
+        print_spooler.run_sync(
+            cfg.printer_name, "TEST_PRINT", print_receipt,
             printer_name=cfg.printer_name,
             receipt_data=test_receipt,
             paper_width=48,
             encoding="cp437",
             cut_after=True,
             open_drawer=False,
+            logo_path=cfg.logo_path,
         )
         log.info("Test print completed")
         app_state.add_history(
@@ -289,20 +544,204 @@ def test_print():
         raise HTTPException(status_code=400, detail=str(e))
 
 
+def _health() -> dict:
+    health = app_state.health_dict()
+    health["spooler"] = print_spooler.stats()
+    health["print_spool"] = durable_spool.stats()
+    health["printers"] = printer_breakers.stats()
+    return health
+
+
 @app.get("/health")
-def health_check():
-    """فحص صحة التطبيق وحالة المكونات."""
-    return app_state.health_dict()
+def health_check(http: Request):
+    """
+    فحص صحة التطبيق وحالة المكونات. ETag ضعيف من عدادات التغيير لكل مكوّن
+    (ووقت التشغيل بالدقائق)، فالعميل الذي يملك النسخة الحالية يأخذ 304 بدون بناء الحالة.
+    """
+    versions = (
+        *app_state.health_version(), print_spooler.version(),
+        printer_breakers.version, durable_spool.version,
+        int(app_state.uptime_seconds // 60),
+    )
+    etag = f'W/"h{_ETAG_EPOCH}.' + ".".join(map(str, versions)) + '"'
+    return _conditional(
+        http, etag, lambda: json.dumps(_health(), ensure_ascii=False).encode("utf-8"),
+    )
+
+
+@app.get("/spooler")
+def spooler_stats():
+    """إحصائيات قوائم انتظار الطابعات (العمق وزمن الانتظار)."""
+    return {
+        "printers": print_spooler.stats(),
+        "connections": transport_pool.stats(),
+        "idempotency": idempotency_cache.stats(),
+    }
+
+
+@app.get("/spool")
+def get_spool():
+    """المهام المحفوظة على القرص بانتظار عودة الطابعة."""
+    return {"jobs": durable_spool.jobs(), **durable_spool.stats()}
+
+
+@app.post("/spool/retry")
+def retry_spool():
+    """إعادة محاولة إرسال المهام المحفوظة فوراً."""
+    durable_spool.retry_now()
+    return {"ok": True}
+
+
+@app.delete("/spool/{job_id}")
+def delete_spool_job(job_id: str):
+    """حذف مهمة محفوظة بدون طباعتها."""
+    if not durable_spool.drop(job_id):
+        raise HTTPException(status_code=404, detail="Spool job not found")
+    app_state.add_history(action="SPOOL_DROP", source="rest_api", status="ok", detail=job_id)
+    return {"ok": True}
 
 
 @app.get("/history")
-def get_history(limit: int = 50):
-    """سجل العمليات الأخيرة."""
-    if limit < 1:
-        limit = 1
-    if limit > 200:
-        limit = 200
-    return {"history": app_state.get_history(limit=limit)}
+def get_history(
+    http: Request,
+    limit: int = 50,
+    before: Optional[int] = None,
+    action: Optional[str] = None,
+    source: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+):
+    """
+    سجل العمليات، الأحدث أولاً. بدون تصفية: آخر العمليات من الذاكرة مع ETag (304 إذا لم تتغير).
+    للصفحات الأقدم أرسل before=next_cursor من الصفحة السابقة، مع تصفية اختيارية حسب
+    action / source / status والفترة since / until (Unix timestamp).
+    """
+    limit = max(1, min(limit, 1000))
+    if before is None and not (action or source or status) and since is None and until is None:
+        limit = min(limit, 200)
+        seq, body = app_state.history_payload(limit)
+        return _conditional(http, f'"r{_ETAG_EPOCH}-{seq}-{limit}"', lambda: body)
+    entries = app_state.query_history(limit, before, action, source, status, since, until)
+    return {
+        "history": entries,
+        "next_cursor": entries[-1]["id"] if len(entries) == limit else None,
+    }
+
+
+# ── Server-Sent Events ──
+# أقل فترة بين دفعتين من الأحداث، ورسالة حالة دورية تُبقي الاتصال حياً وتحدّث وقت التشغيل
+EVENTS_MIN_INTERVAL = 0.5
+EVENTS_KEEPALIVE = 15.0
+
+# (loop, event) لكل متصفح متصل بـ /events
+_event_listeners: set[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+
+def _notify_event_listeners(*_):
+    # Called from any thread (printer workers, breaker monitor, WebSocket loop)
+    for loop, changed in list(_event_listeners):
+        try:
+            loop.call_soon_threadsafe(changed.set)
+        except RuntimeError:
+            _event_listeners.discard((loop, changed))
+
+
+app_state.subscribe(_notify_event_listeners)
+printer_breakers.subscribe(_notify_event_listeners)
+# Queue depth and spool stats in _health()
+print_spooler.on_change(_notify_event_listeners)
+durable_spool.subscribe(_notify_event_listeners)
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+@app.get("/events")
+async def events(http: Request):
+    """
+    بث مباشر للوحة التحكم (Server-Sent Events): الحالة كاملة وآخر 50 عملية عند الاتصال،
+    ثم العمليات الجديدة والحقول المتغيرة في الحالة فقط عند كل تغيير.
+    """
+    async def stream():
+        listener = (asyncio.get_running_loop(), asyncio.Event())
+        changed = listener[1]
+        _event_listeners.add(listener)
+        try:
+            health = _health()
+            history_seq, entries = app_state.history_since(0)
+            yield _sse("health", health)
+            yield _sse("history", {"full": True, "entries": entries})
+            while not await http.is_disconnected():
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    pass
+                changed.clear()
+                current = _health()
+                delta = {key: value for key, value in current.items() if health.get(key) != value}
+                health = current
+                yield _sse("health", delta)
+                history_seq, entries = app_state.history_since(history_seq)
+                if entries:
+                    yield _sse("history", {"full": False, "entries": entries})
+                # Changes during the pause go out together
+                await asyncio.sleep(EVENTS_MIN_INTERVAL)
+        finally:
+            _event_listeners.discard(listener)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/logging")
+def get_logging():
+    """مستويات السجل الحالية ومعدلات العينة وحالة قائمة الكتابة."""
+    return logging_stats()
+
+
+@app.post("/logging")
+def update_logging(payload: LoggingUpdate):
+    """تغيير مستوى السجل (عام أو لوحدة) والعينة وصيغة JSON بدون إعادة تشغيل."""
+    try:
+        if payload.level is not None:
+            set_level("", payload.level)
+        for module, level in payload.loggers.items():
+            set_level(module, level)
+        for module, every in payload.sampling.items():
+            set_sampling(module, every)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if payload.json_format is not None:
+        set_json_output(payload.json_format)
+    log.info("Logging updated via REST: %s", payload.model_dump(exclude_defaults=True))
+    return {"ok": True, **logging_stats()}
+
+
+@app.get("/logs")
+def get_logs(
+    q: Optional[str] = None,
+    level: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 200,
+):
+    """
+    البحث في agent.log والنسخ الدوارة (الأحدث أولاً). يُرسل فقط السجلات المطابقة
+    تدريجياً، فيصلح للتشخيص عن بعد بدل تنزيل الملفات كاملة.
+    q: نص للبحث، level: الحد الأدنى للمستوى، since/until: نطاق زمني (epoch).
+    """
+    if level is not None and level.upper() not in LOG_LEVELS:
+        raise HTTPException(status_code=400, detail=f"level must be one of {', '.join(LOG_LEVELS)}")
+    return StreamingResponse(
+        search_logs(q, level, since, until, max(1, min(limit, MAX_LINES))),
+        media_type="text/plain; charset=utf-8",
+        headers={"Cache-Control": "no-store"},
+    )
 
 
 @app.get("/version")
@@ -311,9 +750,16 @@ def get_version():
     return {"version": APP_VERSION}
 
 
-# ── تجنب 404: توجيه أي مسار غير معرّف إلى الصفحة الرئيسية ──
+# ── تجنب 404: توجيه صفحات المتصفح غير المعرّفة إلى الصفحة الرئيسية ──
 
 @app.get("/{full_path:path}", response_class=HTMLResponse, include_in_schema=False)
-def catch_all(full_path: str):
-    """أي مسار غير معرّف (مثل /dashboard أو /index) يعيد لوحة التحكم."""
-    return get_dashboard_html()
+def catch_all(full_path: str, http: Request):
+    """
+    مسار صفحة غير معرّف (مثل /dashboard أو /index.html) يفتحه متصفح يعيد لوحة التحكم.
+    الملفات الأخرى (robots.txt, apple-touch-icon.png, wp-login.php...) والطلبات الآلية تأخذ 404.
+    """
+    name = full_path.rsplit("/", 1)[-1]
+    is_page = "." not in name or name.endswith((".html", ".htm"))
+    if not is_page or "text/html" not in http.headers.get("accept", ""):
+        raise HTTPException(status_code=404, detail="Not found")
+    return _dashboard_response(http)
@@ -3,10 +3,15 @@ import asyncio
 import json
 import time
 import websockets
-from config import load_config
-from printer_raw import open_drawer, print_receipt, print_raw_receipt
-from state import app_state
-from logger import get_logger
+from breaker import printer_breakers
+from config import load_config, update_config, subscribe as subscribe_config
+from printer_raw import open_drawer, print_receipt, print_raw_receipt, print_raw_bytes
+from routing import resolve_printer, order_jobs, fan_out_async
+from idempotency import idempotency_cache, NEW, DONE
+from spool_store import durable_spool
+from spooler import print_spooler, SpoolerBusyError
+from state import app_state, RateLimiter
+from logger import get_logger, log_context
 
 log = get_logger("ws_client")
 
@@ -14,14 +19,51 @@ log = get_logger("ws_client")
 MIN_RETRY_DELAY = 3
 MAX_RETRY_DELAY = 30
 
+# تغيير هذه الإعدادات يعيد الاتصال فوراً بالقيم الجديدة
+CONNECTION_FIELDS = ("wss_url", "device_id", "device_token")
+
+# ── Binary PRINT_RAW frames ──
+# يعلن العميل دعمها في HELLO، ويرسل السيرفر بعدها إطارات ثنائية بدل base64 داخل JSON:
+#   [magic "GSP1" 4B][flags 1B][job_id length 1B][job_id UTF-8][ESC/POS bytes ...]
+BINARY_MAGIC = b"GSP1"
+BINARY_HEADER_SIZE = 6
+BINARY_FLAG_CUT = 0x01
+CAPABILITIES = ["binary_print_raw", "status_delta"]
+
+# ── STATUS_DELTA push ──
+# بدل أن يسأل السيرفر كل جهاز بـ GET_STATUS دورياً، يرسل الوكيل الحقول التي تغيرت فقط.
+# التغييرات خلال STATUS_PUSH_INTERVAL ثانية تُدمج في رسالة واحدة.
+STATUS_PUSH_INTERVAL = 1.0
+STATUS_FIELDS = (
+    "ws_reconnect_count", "total_opens", "today_opens", "total_prints", "today_prints",
+    "last_operation", "drawer_kick",
+)
+
+
+def parse_binary_frame(frame: bytes) -> tuple[str, int, memoryview]:
+    """تحليل إطار PRINT_RAW ثنائي. يرجع (job_id, flags, payload) بدون نسخ البيانات."""
+    view = memoryview(frame)
+    if len(view) < BINARY_HEADER_SIZE or view[:4] != BINARY_MAGIC:
+        raise ValueError("Invalid binary frame header")
+    flags = view[4]
+    id_len = view[5]
+    payload_start = BINARY_HEADER_SIZE + id_len
+    if len(view) < payload_start:
+        raise ValueError("Truncated binary frame")
+    job_id = bytes(view[BINARY_HEADER_SIZE:payload_start]).decode("utf-8", errors="replace")
+    return job_id, flags, view[payload_start:]
+
 
 async def run_ws():
     """عميل WebSocket مع إعادة اتصال ذكية (exponential backoff)."""
+    global _connection
     log.info("WebSocket client initializing...")
     retry_delay = MIN_RETRY_DELAY
 
     while True:
-        cfg = load_config(force_reload=True)
+        # Current snapshot: config changes arrive through _watch_config, not by re-reading disk
+        cfg = load_config()
+        _settings_changed.clear()
         headers = {
             "X-Device-Id": cfg.device_id,
             "X-Device-Token": cfg.device_token,
@@ -36,13 +78,23 @@ async def run_ws():
                 ping_interval=20,
                 ping_timeout=20,
             ) as ws:
+                if _settings_changed.is_set():
+                    # Changed while connecting: _reconnect had no connection to close yet
+                    log.info("Connection settings changed while connecting, reconnecting")
+                    await ws.close(code=1012, reason="Connection settings changed")
+                    continue
                 # Connection successful - reset backoff
                 retry_delay = MIN_RETRY_DELAY
+                _connection = ws
                 app_state.set_ws_connected(True)
                 log.info("WebSocket connected!")
 
                 # Send HELLO
-                hello = {"type": "HELLO", "device_id": cfg.device_id}
+                hello = {
+                    "type": "HELLO",
+                    "device_id": cfg.device_id,
+                    "capabilities": CAPABILITIES,
+                }
                 await ws.send(json.dumps(hello))
                 log.info("Sent HELLO (device_id: %s)", cfg.device_id)
 
@@ -53,45 +105,64 @@ async def run_ws():
                     detail=f"Connected to {cfg.wss_url}",
                 )
 
-                async for msg in ws:
-                    try:
-                        data = json.loads(msg)
-                    except (json.JSONDecodeError, ValueError):
-                        log.warning("Received invalid JSON: %s", msg[:100])
-                        continue
-
-                    cmd = data.get("cmd", "")
-                    log.info("Received command: %s", cmd)
-
-                    if cmd == "OPEN_DRAWER":
-                        await _handle_open_drawer(ws, cfg)
-
-                    elif cmd == "PRINT_RECEIPT":
-                        await _handle_print_receipt(ws, data, cfg)
-
-                    elif cmd == "PRINT_RAW":
-                        await _handle_print_raw(ws, data, cfg)
-
-                    elif cmd == "PING":
-                        await ws.send(json.dumps({
-                            "type": "PONG",
-                            "device_id": cfg.device_id,
-                            "timestamp": time.time(),
-                        }))
-                        log.debug("Responded to PING")
-
-                    elif cmd == "GET_STATUS":
-                        status = app_state.health_dict()
-                        status["type"] = "STATUS_RESPONSE"
-                        status["device_id"] = cfg.device_id
-                        await ws.send(json.dumps(status))
-                        log.info("Sent status response")
-
-                    elif cmd == "UPDATE_CONFIG":
-                        await _handle_remote_config(ws, data, cfg)
-
-                    else:
-                        log.warning("Unknown command: %s", cmd)
+                pusher = StatusPusher(ws, cfg.device_id)
+                push_task = asyncio.create_task(pusher.run())
+                try:
+                    async for msg in ws:
+                        cfg = load_config()
+                        if isinstance(msg, bytes):
+                            _dispatch(_handle_print_raw_binary(ws, msg, cfg),
+                                      ws, "PRINT_RAW", None, cfg)
+                            continue
+
+                        try:
+                            data = json.loads(msg)
+                        except (json.JSONDecodeError, ValueError):
+                            log.warning("Received invalid JSON: %s", msg[:100])
+                            continue
+
+                        cmd = data.get("cmd", "")
+                        request_id = data.get("request_id")
+                        log.info("Received command: %s (request_id=%s)", cmd, request_id)
+
+                        # Printer commands run concurrently on their printer's queue;
+                        # everything else is answered inline without waiting on them.
+                        if cmd in PRINTER_COMMANDS:
+                            _dispatch(PRINTER_COMMANDS[cmd](ws, data, cfg),
+                                      ws, cmd, request_id, cfg)
+
+                        elif cmd == "PING":
+                            await _send(ws, _with_request_id({
+                                "type": "PONG",
+                                "device_id": cfg.device_id,
+                                "timestamp": time.time(),
+                            }, request_id))
+                            log.debug("Responded to PING")
+
+                        elif cmd == "GET_STATUS" and data.get("compact"):
+                            # Full compact snapshot on demand (e.g. after a gap in seq)
+                            await pusher.push(full=True, request_id=request_id)
+
+                        elif cmd == "GET_STATUS":
+                            status = app_state.health_dict()
+                            status["spooler"] = print_spooler.stats()
+                            status["print_spool"] = durable_spool.stats()
+                            status["printers"] = printer_breakers.stats()
+                            status["inflight"] = len(_inflight)
+                            status["type"] = "STATUS_RESPONSE"
+                            status["device_id"] = cfg.device_id
+                            status["status_seq"] = pusher.seq
+                            await _send(ws, _with_request_id(status, request_id))
+                            log.info("Sent status response")
+
+                        elif cmd == "UPDATE_CONFIG":
+                            await _handle_remote_config(ws, data)
+
+                        else:
+                            log.warning("Unknown command: %s", cmd)
+                finally:
+                    push_task.cancel()
+                    _connection = None
 
         except websockets.exceptions.ConnectionClosed as e:
             log.warning("WebSocket connection closed: %s", e)
@@ -112,42 +183,147 @@ async def run_ws():
                 detail=str(e),
             )
 
-        # Exponential backoff
+        if _settings_changed.is_set():
+            log.info("Connection settings changed, reconnecting")
+            continue
+
+        # Exponential backoff (cut short if the connection settings change)
         log.info("Retrying in %d seconds...", retry_delay)
-        await asyncio.sleep(retry_delay)
+        try:
+            await asyncio.wait_for(_settings_changed.wait(), retry_delay)
+        except asyncio.TimeoutError:
+            pass
         retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
 
 
-async def _handle_open_drawer(ws, cfg):
+# ── Concurrent dispatch ──
+# الأوامر الجارية تبقى مسجلة عبر إعادة الاتصال لأن الطابعة ما زالت تنفذها
+_inflight: set[asyncio.Task] = set()
+# Strong references for fire-and-forget rejection ACKs (not counted as in flight)
+_rejections: set[asyncio.Task] = set()
+
+
+def _dispatch(handler, ws, cmd: str, request_id, cfg):
+    """تشغيل أمر طابعة كمهمة مستقلة مع احترام الحد الأقصى للأوامر الجارية."""
+    if len(_inflight) >= cfg.ws_max_inflight:
+        handler.close()
+        log.warning("Rejected %s (request_id=%s): %d commands in flight",
+                    cmd, request_id, len(_inflight))
+        task = asyncio.create_task(_send_ack(
+            ws, cmd, request_id, "ERR", error="Too many commands in flight",
+        ))
+        _rejections.add(task)
+        task.add_done_callback(_rejections.discard)
+        return
+    # The task copies the current context, so its logs (and its print jobs) carry request_id
+    with log_context(request_id=request_id):
+        task = asyncio.create_task(handler)
+    _inflight.add(task)
+    task.add_done_callback(_inflight.discard)
+
+
+def _with_request_id(message: dict, request_id) -> dict:
+    if request_id is not None:
+        message["request_id"] = request_id
+    return message
+
+
+async def _send(ws, message: dict):
+    """إرسال رسالة JSON. انقطاع الاتصال أثناء تنفيذ أمر لا يُعتبر خطأ في الأمر نفسه."""
+    try:
+        await ws.send(json.dumps(message))
+    except websockets.exceptions.ConnectionClosed:
+        log.warning("Connection closed before %s %s could be sent (request_id=%s)",
+                    message.get("type"), message.get("cmd", ""), message.get("request_id"))
+
+
+async def _send_ack(ws, cmd: str, request_id, status: str = "OK",
+                    idempotency_key: str | None = None, **extra):
+    """
+    إرسال ACK مع request_id حتى يربط السيرفر الرد بالأمر.
+    مع idempotency_key: الرد النهائي (OK / PARTIAL) يُحفظ لإعادته عند التكرار، و ERR يحرر المفتاح.
+    """
+    ack = {"type": "ACK", "cmd": cmd, "status": status, **extra}
+    if idempotency_key:
+        if status != "ERR":
+            idempotency_cache.complete(cmd, idempotency_key, ack)
+        else:
+            idempotency_cache.release(cmd, idempotency_key)
+    await _send(ws, _with_request_id(dict(ack), request_id))
+
+
+def _spooled(spool_id: str | None) -> dict:
+    """حقول ACK لمهمة حُفظت في الـ spool على القرص لأن الطابعة غير متاحة."""
+    return {"spooled": True, "spool_id": spool_id} if spool_id else {}
+
+
+def _queue_fields(printer_name: str, error: BaseException | None = None) -> dict:
+    """عمق قائمة الطابعة والزمن المتوقع لإنهائها في ACK، حتى يخفف الخادم الإرسال قبل تراكم المهام."""
+    fields = print_spooler.load(printer_name) if printer_name else {}
+    if isinstance(error, SpoolerBusyError):
+        fields["retry_after"] = error.retry_after
+    return fields
+
+
+def _rate_limit(limiter: RateLimiter, data: dict | None) -> float:
+    """حد المعدل لأوامر WebSocket حسب client_id في الأمر. يرجع retry-after (0 = مسموح)."""
+    client = str((data or {}).get("client_id") or "")
+    return limiter.acquire("websocket", client)
+
+
+async def _replay_if_duplicate(ws, cmd: str, key: str | None, request_id) -> bool:
+    """إعادة الرد الأصلي لأمر مكرر بنفس idempotency_key بدون لمس الطابعة."""
+    if not key:
+        return False
+    state, result = idempotency_cache.begin(cmd, key)
+    if state == NEW:
+        return False
+    if state == DONE:
+        log.info("Replaying %s ACK for idempotency key %s", cmd, key)
+        await _send(ws, _with_request_id({**result, "replayed": True}, request_id))
+    else:
+        log.warning("%s with idempotency key %s is already in progress", cmd, key)
+        await _send_ack(ws, cmd, request_id, "ERR",
+                        error="Request already in progress", in_progress=True)
+    return True
+
+
+async def _handle_open_drawer(ws, data, cfg):
     """معالجة أمر فتح الدرج."""
+    request_id = data.get("request_id")
+    key = data.get("idempotency_key")
+    if await _replay_if_duplicate(ws, "OPEN_DRAWER", key, request_id):
+        return
+
     # Rate limiting check
-    if not app_state.drawer_rate_limiter.allow():
-        log.warning("Rate limit exceeded for OPEN_DRAWER")
-        await ws.send(json.dumps({
-            "type": "ACK", "cmd": "OPEN_DRAWER",
-            "status": "ERR", "error": "Rate limit exceeded",
-        }))
+    retry_after = _rate_limit(app_state.drawer_rate_limiter, data)
+    if retry_after:
+        log.warning("Rate limit exceeded for OPEN_DRAWER (retry after %.1fs)", retry_after)
+        await _send_ack(ws, "OPEN_DRAWER", request_id, "ERR", error="Rate limit exceeded",
+                        retry_after=round(retry_after, 2), idempotency_key=key)
         app_state.add_history(
             action="OPEN_DRAWER", source="websocket",
             status="error", detail="Rate limit exceeded",
         )
         return
 
+    printer_name = cfg.printer_name
     try:
-        open_drawer(cfg.printer_name, cfg.drawer_pin, cfg.pulse_on, cfg.pulse_off)
-        await ws.send(json.dumps({
-            "type": "ACK", "cmd": "OPEN_DRAWER", "status": "OK",
-        }))
+        printer_name = resolve_printer(cfg, data.get("target"))
+        elapsed_ms = await print_spooler.run(
+            printer_name, "OPEN_DRAWER", open_drawer,
+            printer_name, cfg.drawer_pin, cfg.pulse_on, cfg.pulse_off,
+        )
+        await _send_ack(ws, "OPEN_DRAWER", request_id, elapsed_ms=round(elapsed_ms, 2), idempotency_key=key,
+                        **_queue_fields(printer_name))
         log.info("Drawer opened OK via WebSocket")
         app_state.add_history(
             action="OPEN_DRAWER", source="websocket", status="ok",
         )
     except Exception as e:
         log.error("Drawer error: %s", e)
-        await ws.send(json.dumps({
-            "type": "ACK", "cmd": "OPEN_DRAWER",
-            "status": "ERR", "error": str(e),
-        }))
+        await _send_ack(ws, "OPEN_DRAWER", request_id, "ERR", error=str(e), idempotency_key=key,
+                        **_queue_fields(printer_name, e))
         app_state.add_history(
             action="OPEN_DRAWER", source="websocket",
             status="error", detail=str(e),
@@ -156,50 +332,56 @@ async def _handle_open_drawer(ws, cfg):
 
 async def _handle_print_receipt(ws, data, cfg):
     """معالجة أمر طباعة الإيصال."""
+    request_id = data.get("request_id")
+    key = data.get("idempotency_key")
+    if await _replay_if_duplicate(ws, "PRINT_RECEIPT", key, request_id):
+        return
+
     # Rate limiting check
-    if not app_state.receipt_rate_limiter.allow():
-        log.warning("Rate limit exceeded for PRINT_RECEIPT")
-        await ws.send(json.dumps({
-            "type": "ACK", "cmd": "PRINT_RECEIPT",
-            "status": "ERR", "error": "Rate limit exceeded",
-        }))
+    retry_after = _rate_limit(app_state.receipt_rate_limiter, data)
+    if retry_after:
+        log.warning("Rate limit exceeded for PRINT_RECEIPT (retry after %.1fs)", retry_after)
+        await _send_ack(ws, "PRINT_RECEIPT", request_id, "ERR", error="Rate limit exceeded",
+                        retry_after=round(retry_after, 2), idempotency_key=key)
         app_state.add_history(
             action="PRINT_RECEIPT", source="websocket",
             status="error", detail="Rate limit exceeded",
         )
         return
 
+    printer_name = cfg.printer_name
     try:
         receipt_data = data.get("receipt_data", {})
         paper_width = data.get("paper_width", 48)
         encoding = data.get("encoding", "cp437")
         cut_after = data.get("cut_after", True)
         open_drawer_flag = data.get("open_drawer", False)
+        include_logo = data.get("include_logo", True)
+        printer_name = resolve_printer(cfg, data.get("target"))
         
-        print_receipt(
-            printer_name=cfg.printer_name,
+        spool_id = await print_spooler.run(
+            printer_name, "PRINT_RECEIPT", print_receipt,
+            printer_name=printer_name,
             receipt_data=receipt_data,
             paper_width=paper_width,
             encoding=encoding,
             cut_after=cut_after,
             open_drawer=open_drawer_flag,
             drawer_pin=cfg.drawer_pin,
+            logo_path=cfg.logo_path if include_logo else "",
         )
         
-        await ws.send(json.dumps({
-            "type": "ACK", "cmd": "PRINT_RECEIPT", "status": "OK",
-        }))
-        log.info("Receipt printed OK via WebSocket")
+        await _send_ack(ws, "PRINT_RECEIPT", request_id, idempotency_key=key,
+                        **_spooled(spool_id), **_queue_fields(printer_name))
+        log.info("Receipt %s OK via WebSocket", "spooled" if spool_id else "printed")
         app_state.add_history(
             action="PRINT_RECEIPT", source="websocket", status="ok",
             detail=f"Order: {receipt_data.get('name', 'N/A')}",
         )
     except Exception as e:
         log.error("Receipt print error: %s", e)
-        await ws.send(json.dumps({
-            "type": "ACK", "cmd": "PRINT_RECEIPT",
-            "status": "ERR", "error": str(e),
-        }))
+        await _send_ack(ws, "PRINT_RECEIPT", request_id, "ERR", error=str(e), idempotency_key=key,
+                        **_queue_fields(printer_name, e))
         app_state.add_history(
             action="PRINT_RECEIPT", source="websocket",
             status="error", detail=str(e),
@@ -208,72 +390,299 @@ async def _handle_print_receipt(ws, data, cfg):
 
 async def _handle_print_raw(ws, data, cfg):
     """معالجة أمر طباعة بيانات خام."""
+    request_id = data.get("request_id")
+    key = data.get("idempotency_key")
+    if await _replay_if_duplicate(ws, "PRINT_RAW", key, request_id):
+        return
+
     # Rate limiting check
-    if not app_state.receipt_rate_limiter.allow():
-        log.warning("Rate limit exceeded for PRINT_RAW")
-        await ws.send(json.dumps({
-            "type": "ACK", "cmd": "PRINT_RAW",
-            "status": "ERR", "error": "Rate limit exceeded",
-        }))
+    retry_after = _rate_limit(app_state.receipt_rate_limiter, data)
+    if retry_after:
+        log.warning("Rate limit exceeded for PRINT_RAW (retry after %.1fs)", retry_after)
+        await _send_ack(ws, "PRINT_RAW", request_id, "ERR", error="Rate limit exceeded",
+                        retry_after=round(retry_after, 2), idempotency_key=key)
         app_state.add_history(
             action="PRINT_RAW", source="websocket",
             status="error", detail="Rate limit exceeded",
         )
         return
 
+    printer_name = cfg.printer_name
     try:
         raw_data = data.get("data", "")
         encoding = data.get("encoding", "utf-8")
         cut_after = data.get("cut_after", True)
+        data_format = data.get("format", "auto")
+        printer_name = resolve_printer(cfg, data.get("target"))
         
-        print_raw_receipt(
-            printer_name=cfg.printer_name,
+        spool_id = await print_spooler.run(
+            printer_name, "PRINT_RAW", print_raw_receipt,
+            printer_name=printer_name,
             raw_data=raw_data,
             encoding=encoding,
             cut_after=cut_after,
+            data_format=data_format,
         )
         
-        await ws.send(json.dumps({
-            "type": "ACK", "cmd": "PRINT_RAW", "status": "OK",
-        }))
-        log.info("Raw data printed OK via WebSocket")
+        await _send_ack(ws, "PRINT_RAW", request_id, idempotency_key=key,
+                        **_spooled(spool_id), **_queue_fields(printer_name))
+        log.info("Raw data %s OK via WebSocket", "spooled" if spool_id else "printed")
         app_state.add_history(
             action="PRINT_RAW", source="websocket", status="ok",
         )
     except Exception as e:
         log.error("Raw print error: %s", e)
-        await ws.send(json.dumps({
-            "type": "ACK", "cmd": "PRINT_RAW",
-            "status": "ERR", "error": str(e),
-        }))
+        await _send_ack(ws, "PRINT_RAW", request_id, "ERR", error=str(e), idempotency_key=key,
+                        **_queue_fields(printer_name, e))
         app_state.add_history(
             action="PRINT_RAW", source="websocket",
             status="error", detail=str(e),
         )
 
 
-async def _handle_remote_config(ws, data, cfg):
-    """معالجة أمر تحديث الإعدادات عن بُعد."""
-    from config import save_config, AgentConfig
+async def _handle_print_order(ws, data, cfg):
+    """معالجة أمر طباعة طلب على عدة طابعات (إيصال + مطبخ / بار) بالتوازي."""
+    request_id = data.get("request_id")
+    key = data.get("idempotency_key")
+    if await _replay_if_duplicate(ws, "PRINT_ORDER", key, request_id):
+        return
+
+    # Rate limiting check
+    retry_after = _rate_limit(app_state.receipt_rate_limiter, data)
+    if retry_after:
+        log.warning("Rate limit exceeded for PRINT_ORDER (retry after %.1fs)", retry_after)
+        await _send_ack(ws, "PRINT_ORDER", request_id, "ERR", error="Rate limit exceeded",
+                        retry_after=round(retry_after, 2), idempotency_key=key)
+        app_state.add_history(
+            action="PRINT_ORDER", source="websocket",
+            status="error", detail="Rate limit exceeded",
+        )
+        return
+
+    receipt_data = data.get("receipt_data", {})
+    try:
+        jobs = order_jobs(
+            cfg, receipt_data,
+            include_receipt=data.get("print_receipt", True),
+            paper_width=data.get("paper_width", 48),
+            encoding=data.get("encoding", "cp437"),
+            cut_after=data.get("cut_after", True),
+            open_drawer=data.get("open_drawer", False),
+            include_logo=data.get("include_logo", True),
+        )
+        if not jobs:
+            raise ValueError("Nothing to print for this order")
+    except ValueError as e:
+        log.error("Order print error: %s", e)
+        await _send_ack(ws, "PRINT_ORDER", request_id, "ERR", error=str(e), idempotency_key=key)
+        app_state.add_history(
+            action="PRINT_ORDER", source="websocket",
+            status="error", detail=str(e),
+        )
+        return
+
+    results = await fan_out_async(jobs)
+    ok = all(r["ok"] for r in results.values())
+    # A partial failure is still final: resending would reprint the printers that succeeded
+    await _send_ack(ws, "PRINT_ORDER", request_id, "OK" if ok else "PARTIAL",
+                    printers=results, idempotency_key=key)
+    log.info("Order %s printed on %s", receipt_data.get("name", "N/A"), ", ".join(results))
+    app_state.add_history(
+        action="PRINT_ORDER", source="websocket", status="ok" if ok else "error",
+        detail=f"Order: {receipt_data.get('name', 'N/A')} → {', '.join(results)}",
+    )
+
+
+async def _handle_print_raw_binary(ws, frame: bytes, cfg):
+    """معالجة إطار PRINT_RAW ثنائي: تمرير البيانات إلى الطابعة بدون فك ترميز أو نسخ."""
     try:
-        new_data = {**cfg.model_dump(), **data.get("config", {})}
-        new_cfg = AgentConfig(**new_data)
-        save_config(new_cfg)
-        await ws.send(json.dumps({
-            "type": "ACK", "cmd": "UPDATE_CONFIG", "status": "OK",
-        }))
+        job_id, flags, payload = parse_binary_frame(frame)
+    except ValueError as e:
+        log.warning("Rejected binary frame (%d bytes): %s", len(frame), e)
+        await _send_ack(ws, "PRINT_RAW", None, "ERR", error=str(e))
+        return
+
+    # The frame's job id doubles as the correlation id and idempotency key
+    request_id = key = job_id or None
+    if await _replay_if_duplicate(ws, "PRINT_RAW", key, request_id):
+        return
+
+    # Rate limiting check
+    retry_after = _rate_limit(app_state.receipt_rate_limiter, None)
+    if retry_after:
+        log.warning("Rate limit exceeded for binary PRINT_RAW (retry after %.1fs)", retry_after)
+        await _send_ack(ws, "PRINT_RAW", request_id, "ERR", job_id=job_id, error="Rate limit exceeded",
+                        retry_after=round(retry_after, 2), idempotency_key=key)
+        app_state.add_history(
+            action="PRINT_RAW", source="websocket",
+            status="error", detail="Rate limit exceeded",
+        )
+        return
+
+    printer_name = cfg.printer_name
+    try:
+        spool_id = await print_spooler.run(
+            printer_name, "PRINT_RAW", print_raw_bytes,
+            printer_name=printer_name,
+            data=payload,
+            cut_after=bool(flags & BINARY_FLAG_CUT),
+        )
+        await _send_ack(ws, "PRINT_RAW", request_id, job_id=job_id, idempotency_key=key,
+                        **_spooled(spool_id), **_queue_fields(printer_name))
+        log.info("Binary raw job %s %s OK (%d bytes)",
+                 job_id, "spooled" if spool_id else "printed", len(payload))
+        app_state.add_history(
+            action="PRINT_RAW", source="websocket", status="ok",
+            detail=f"Job: {job_id}" if job_id else "",
+        )
+    except Exception as e:
+        log.error("Binary raw print error: %s", e)
+        await _send_ack(ws, "PRINT_RAW", request_id, "ERR", job_id=job_id, error=str(e),
+                        idempotency_key=key, **_queue_fields(printer_name, e))
+        app_state.add_history(
+            action="PRINT_RAW", source="websocket",
+            status="error", detail=str(e),
+        )
+
+
+async def _handle_remote_config(ws, data):
+    """معالجة أمر تحديث الإعدادات عن بُعد (الطابعات والحدود تتبعها عبر المشتركين)."""
+    request_id = data.get("request_id")
+    try:
+        update_config(data.get("config", {}))
+        await _send_ack(ws, "UPDATE_CONFIG", request_id)
         log.info("Config updated remotely")
         app_state.add_history(
             action="UPDATE_CONFIG", source="websocket", status="ok",
         )
     except Exception as e:
         log.error("Remote config update error: %s", e)
-        await ws.send(json.dumps({
-            "type": "ACK", "cmd": "UPDATE_CONFIG",
-            "status": "ERR", "error": str(e),
-        }))
+        await _send_ack(ws, "UPDATE_CONFIG", request_id, "ERR", error=str(e))
+
+
+PRINTER_COMMANDS = {
+    "OPEN_DRAWER": _handle_open_drawer,
+    "PRINT_RECEIPT": _handle_print_receipt,
+    "PRINT_RAW": _handle_print_raw,
+    "PRINT_ORDER": _handle_print_order,
+}
+
+
+# ── STATUS_DELTA push ──
+# يُضبط من أي خيط (عمال الطابعات، فحص الحالة) عبر call_soon_threadsafe
+_status_changed = asyncio.Event()
+
+
+def status_snapshot() -> dict:
+    """الحالة المختصرة التي تُقارن بين رسائل STATUS_DELTA (بدون الإحصائيات الثقيلة)."""
+    health = app_state.health_dict()
+    snapshot = {key: health[key] for key in STATUS_FIELDS}
+    snapshot["printers"] = {
+        name: {
+            "state": breaker["state"],
+            "reason": breaker["reason"],
+            "queue_depth": print_spooler.load(name)["queue_depth"],
+        }
+        for name, breaker in printer_breakers.stats().items()
+    }
+    snapshot["print_spool_pending"] = durable_spool.stats()["pending"]
+    return snapshot
+
+
+def status_delta(old: dict, new: dict) -> dict:
+    """الحقول التي تغيرت بين لقطتين. الطابعات تُقارن كلٌّ على حدة، والمحذوفة تُرسل None."""
+    changes = {key: value for key, value in new.items() if old.get(key) != value}
+    if "printers" in changes and "printers" in old:
+        before, after = old["printers"], new["printers"]
+        changes["printers"] = {name: p for name, p in after.items() if before.get(name) != p}
+        changes["printers"].update({name: None for name in before if name not in after})
+    return changes
+
+
+class StatusPusher:
+    """
+    إرسال STATUS_DELTA على اتصال واحد: لقطة كاملة عند الاتصال ثم الحقول المتغيرة فقط.
+    seq يزيد مع كل رسالة، فإذا لاحظ السيرفر فجوة طلب لقطة كاملة بـ GET_STATUS {"compact": true}.
+    """
+
+    def __init__(self, ws, device_id: str):
+        self.ws = ws
+        self.device_id = device_id
+        self.seq = -1
+        self._last: dict | None = None
+
+    async def push(self, full: bool = False, request_id=None):
+        snapshot = status_snapshot()
+        full = full or self._last is None
+        changes = snapshot if full else status_delta(self._last, snapshot)
+        if not changes:
+            return
+        self._last = snapshot
+        self.seq += 1
+        message = {
+            "type": "STATUS_DELTA",
+            "device_id": self.device_id,
+            "seq": self.seq,
+            "full": full,
+            "changes": changes,
+        }
+        await _send(self.ws, _with_request_id(message, request_id))
+
+    async def run(self):
+        try:
+            await self.push(full=True)
+            while True:
+                # Everything that changes during the pause goes out as one delta
+                await asyncio.sleep(STATUS_PUSH_INTERVAL)
+                await _status_changed.wait()
+                _status_changed.clear()
+                await self.push()
+        except Exception as e:
+            # The receive loop sees the disconnect; the task must not end with an unretrieved error
+            log.warning("STATUS_DELTA push stopped: %s", e)
+
+
+def _watch_status(loop: asyncio.AbstractEventLoop):
+    def notify(*_):
+        try:
+            loop.call_soon_threadsafe(_status_changed.set)
+        except RuntimeError:
+            pass  # loop already closed during shutdown
+
+    app_state.subscribe(notify)
+    printer_breakers.subscribe(notify)
+    # queue_depth / print_spool_pending in the snapshot
+    print_spooler.on_change(notify)
+    durable_spool.subscribe(notify)
+
+
+# ── Config changes ──
+# الاتصال الحالي (إن وُجد)، لإغلاقه عند تغيير إعدادات الاتصال
+_connection = None
+_settings_changed = asyncio.Event()
+
+
+def _reconnect():
+    _settings_changed.set()
+    ws = _connection
+    if ws is not None:
+        # 1012 = service restart: the server can expect the device back right away
+        asyncio.ensure_future(ws.close(code=1012, reason="Connection settings changed"))
+
+
+def _watch_config(loop: asyncio.AbstractEventLoop):
+    def on_change(new, old):
+        if any(getattr(new, name) != getattr(old, name) for name in CONNECTION_FIELDS):
+            try:
+                loop.call_soon_threadsafe(_reconnect)
+            except RuntimeError:
+                pass  # loop already closed during shutdown
+
+    subscribe_config(on_change)
 
 
 def start_ws_in_background(loop: asyncio.AbstractEventLoop):
     """تشغيل عميل WebSocket في الخلفية."""
+    _watch_status(loop)
+    _watch_config(loop)
     loop.create_task(run_ws())